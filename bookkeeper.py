@@ -8,6 +8,7 @@ and stores the information in a Postgres database.
 import uvicorn
 import datetime
 import logging
+import asyncio
 
 # 3rd party
 import daiquiri
@@ -50,7 +51,22 @@ BOOKKEEPER_PORT   = bookkeeper_config('PORT', cast=int, default=8080)
 BOOKKEEPER_HOST   = bookkeeper_config('HOST', default='0.0.0.0')
 DATABASE_URL      = bookkeeper_config('DATABASE_URL', default='postgresql://mercure@localhost')
 DATABASE_SCHEMA   = bookkeeper_config('DATABASE_SCHEMA', default=None)
-database = databases.Database(DATABASE_URL)
+BUFFER_SIZE       = bookkeeper_config('BUFFER_SIZE', cast=int, default=1000)
+BUFFER_INTERVAL   = bookkeeper_config('BUFFER_INTERVAL', cast=float, default=1.0) # in seconds
+DATABASE_POOL_MIN = bookkeeper_config('DATABASE_POOL_MIN', cast=int, default=1)
+DATABASE_POOL_MAX = bookkeeper_config('DATABASE_POOL_MAX', cast=int, default=10)
+RETENTION_DAYS    = bookkeeper_config('RETENTION_DAYS', cast=int, default=0) # 0 = keep data forever
+# Monthly partitioning of the event tables is only supported for PostgreSQL and only applies to newly created tables
+DATABASE_PARTITIONING = bookkeeper_config('DATABASE_PARTITIONING', cast=bool, default=False) and DATABASE_URL.startswith("postgresql")
+MAINTENANCE_INTERVAL = 3600 # in seconds
+PARTITIONS_AHEAD  = 2 # number of future monthly partitions that are created in advance
+
+# Asynchronous connection pool that is used for all database writes, so that the requests of the 
+# different mercure services can be served in parallel without blocking the event loop
+if DATABASE_URL.startswith("postgresql"):
+    database = databases.Database(DATABASE_URL, min_size=DATABASE_POOL_MIN, max_size=DATABASE_POOL_MAX)
+else:
+    database = databases.Database(DATABASE_URL)
 app = Starlette(debug=True)
 
 
@@ -59,25 +75,33 @@ app = Starlette(debug=True)
 ###################################################################################
 
 metadata = sqlalchemy.MetaData(schema = DATABASE_SCHEMA)
-engine = sqlalchemy.create_engine(DATABASE_URL)
-connection = None
+
+# The tables mercure_events, dicom_files, series_events, and processing_jobs grow with every received series. 
+# If partitioning is enabled, they are partitioned by month, so that old data can be removed by dropping whole
+# partitions.
+# PostgreSQL requires that the partition key is part of the primary key.
+if DATABASE_PARTITIONING:
+    partition_options = { "postgresql_partition_by": "RANGE (time)" }
+else:
+    partition_options = {}
 
 mercure_events = sqlalchemy.Table(
     "mercure_events",
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
-    sqlalchemy.Column("time", sqlalchemy.DateTime),
+    sqlalchemy.Column("time", sqlalchemy.DateTime, primary_key=DATABASE_PARTITIONING, index=True),
     sqlalchemy.Column("sender", sqlalchemy.String, default="Unknown"),
     sqlalchemy.Column("event", sqlalchemy.String, default=monitor.h_events.UNKNOWN),
     sqlalchemy.Column("severity", sqlalchemy.Integer, default=monitor.severity.INFO),
-    sqlalchemy.Column("description", sqlalchemy.String, default="")
+    sqlalchemy.Column("description", sqlalchemy.String, default=""),
+    **partition_options
 )
 
 webgui_events = sqlalchemy.Table(
     "webgui_events",
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
-    sqlalchemy.Column("time", sqlalchemy.DateTime),
+    sqlalchemy.Column("time", sqlalchemy.DateTime, index=True),
     sqlalchemy.Column("sender", sqlalchemy.String, default="Unknown"),
     sqlalchemy.Column("event", sqlalchemy.String, default=monitor.w_events.UNKNOWN),
     sqlalchemy.Column("user", sqlalchemy.String, default=""),
@@ -88,10 +112,11 @@ dicom_files = sqlalchemy.Table(
     "dicom_files",
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
-    sqlalchemy.Column("time", sqlalchemy.DateTime),
+    sqlalchemy.Column("time", sqlalchemy.DateTime, primary_key=DATABASE_PARTITIONING, index=True),
     sqlalchemy.Column("filename", sqlalchemy.String),
     sqlalchemy.Column("file_uid", sqlalchemy.String),
-    sqlalchemy.Column("series_uid", sqlalchemy.String)
+    sqlalchemy.Column("series_uid", sqlalchemy.String, index=True),
+    **partition_options
 )
 
 dicom_series = sqlalchemy.Table(
@@ -134,13 +159,31 @@ series_events = sqlalchemy.Table(
     "series_events",
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
-    sqlalchemy.Column("time", sqlalchemy.DateTime),
+    sqlalchemy.Column("time", sqlalchemy.DateTime, primary_key=DATABASE_PARTITIONING, index=True),
     sqlalchemy.Column("sender", sqlalchemy.String, default="Unknown"),    
     sqlalchemy.Column("event", sqlalchemy.String),
-    sqlalchemy.Column("series_uid", sqlalchemy.String),
+    sqlalchemy.Column("series_uid", sqlalchemy.String, index=True),
     sqlalchemy.Column("file_count", sqlalchemy.Integer),
     sqlalchemy.Column("target", sqlalchemy.String),    
-    sqlalchemy.Column("info", sqlalchemy.String)
+    sqlalchemy.Column("info", sqlalchemy.String),
+    **partition_options
+)
+
+processing_jobs = sqlalchemy.Table(
+    "processing_jobs",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
+    sqlalchemy.Column("time", sqlalchemy.DateTime, primary_key=DATABASE_PARTITIONING, index=True),
+    sqlalchemy.Column("sender", sqlalchemy.String, default="Unknown"),
+    sqlalchemy.Column("series_uid", sqlalchemy.String, index=True),
+    sqlalchemy.Column("module", sqlalchemy.String, index=True),
+    sqlalchemy.Column("success", sqlalchemy.Boolean),
+    sqlalchemy.Column("wall_time", sqlalchemy.Float),
+    sqlalchemy.Column("cpu_time", sqlalchemy.Float),
+    sqlalchemy.Column("peak_memory", sqlalchemy.BigInteger),
+    sqlalchemy.Column("read_bytes", sqlalchemy.BigInteger),
+    sqlalchemy.Column("write_bytes", sqlalchemy.BigInteger),
+    **partition_options
 )
 
 file_events = sqlalchemy.Table(
@@ -164,28 +207,121 @@ series_sequence_data = sqlalchemy.Table('series_sequence_data', metadata,
     sqlalchemy.Column('data', sqlalchemy.JSON)
 )
 
+# Tables from which old rows are removed according to the retention policy
+event_tables = [mercure_events, dicom_files, series_events, processing_jobs]
+
+
 ###################################################################################
 ## Event handlers
 ###################################################################################
 
 def create_database():
-    """Creates all tables in the database if they do not exist."""
+    """Creates all tables in the database if they do not exist. Uses a temporary synchronous 
+       connection, as the schema creation is not supported by the asynchronous connection pool."""
+    engine = sqlalchemy.create_engine(DATABASE_URL)
     metadata.create_all(engine)
+    # Tables created by earlier versions do not have the lookup indexes yet
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    engine.dispose()
+
+
+def month_start(date, offset=0):
+    """Returns the first day of the month of the given date, shifted by the given number of months."""
+    month = date.year*12 + date.month-1 + offset
+    return datetime.datetime(month // 12, month % 12 + 1, 1)
+
+
+# Partitions that have been created by the bookkeeper instance, given as tuples of table name and month
+partitions_created = set()
+
+
+def qualified_name(name):
+    """Returns the quoted name of the table, including the schema if configured."""
+    if DATABASE_SCHEMA:
+        return f'"{DATABASE_SCHEMA}"."{name}"'
+    return f'"{name}"'
+
+
+async def create_partition(table, start):
+    """Creates the partition of the table for the month starting at the given date, if not done before."""
+    if (table.name, start) in partitions_created:
+        return
+    partition = qualified_name(f"{table.name}_{start:%Y_%m}")
+    await database.execute(f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {qualified_name(table.name)} "
+                           f"FOR VALUES FROM ('{start}') TO ('{month_start(start, 1)}')")
+    partitions_created.add((table.name, start))
+
+
+async def create_partitions():
+    """Creates the monthly partitions of the event tables for the current and the upcoming months."""
+    now = datetime.datetime.now()
+    for table in event_tables:
+        for offset in range(PARTITIONS_AHEAD+1):
+            await create_partition(table, month_start(now, offset))
+
+
+async def drop_partitions(cutoff):
+    """Drops all partitions of the event tables that only contain rows older than the cutoff time."""
+    query = """SELECT child.relname FROM pg_inherits 
+               JOIN pg_class parent ON pg_inherits.inhparent = parent.oid 
+               JOIN pg_class child ON pg_inherits.inhrelid = child.oid 
+               JOIN pg_namespace ON parent.relnamespace = pg_namespace.oid 
+               WHERE parent.relname = :table AND pg_namespace.nspname = :schema"""
+    for table in event_tables:
+        partitions = await database.fetch_all(query, { "table": table.name, "schema": DATABASE_SCHEMA or "public" })
+        for partition in partitions:
+            try:
+                start = datetime.datetime.strptime(partition[0][len(table.name)+1:], "%Y_%m")
+            except ValueError:
+                continue
+            if month_start(start, 1) <= cutoff:
+                logger.info(f"Dropping partition {partition[0]}")
+                await database.execute(f"DROP TABLE {qualified_name(partition[0])}")
+                partitions_created.discard((table.name, start))
+
+
+async def maintain_tables():
+    """Creates upcoming partitions and removes data that is older than the retention period. Without
+       partitioning, the old rows are deleted (using the index on the time column)."""
+    try:
+        if DATABASE_PARTITIONING:
+            await create_partitions()
+        if RETENTION_DAYS > 0:
+            cutoff = datetime.datetime.now() - datetime.timedelta(days=RETENTION_DAYS)
+            if DATABASE_PARTITIONING:
+                await drop_partitions(cutoff)
+            else:
+                for table in event_tables:
+                    await database.execute(table.delete().where(table.c.time < cutoff))
+    except Exception as e:
+        logger.error(f"Unable to perform database maintenance: {e}")
+
+
+async def maintain_tables_periodically():
+    """Performs the database maintenance in the configured interval."""
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+        await maintain_tables()
 
 
 @app.on_event("startup")
 async def startup():
     """Connects to database on startup. If the database does not exist, it will 
        be created."""
-    global connection
-    connection = engine.connect()
     create_database()
+    await database.connect()
+    await maintain_tables()
+    asyncio.ensure_future(flush_buffers_periodically())
+    asyncio.ensure_future(maintain_tables_periodically())
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    """Disconnect from database on shutdown."""
-    engine.disconnect()
+    """Writes the buffered rows and disconnects from database on shutdown."""
+    await flush_buffers()
+    await database.disconnect()
 
 
 ###################################################################################
@@ -195,11 +331,201 @@ async def shutdown():
 async def execute_db_operation(operation):
     """Executes a previously prepared database operation."""
     try:
-        connection.execute(operation)
+        await database.execute(operation)
     except:
         pass
 
 
+class WriteBuffer:
+    """Write-behind buffer for the rows of one table. Instead of executing one INSERT per request, the
+       rows are collected and written with multi-row INSERT statements once the buffer is full or the 
+       flush interval has passed. For tables with unique keys (unique=True), the rows of a failing 
+       statement are inserted individually, so that a duplicate row does not discard the other rows."""
+    def __init__(self, table, unique=False):
+        self.table = table
+        self.unique = unique
+        self.rows = []
+
+    def add(self, rows):
+        """Adds the rows to the buffer. Returns True if the buffer should be flushed."""
+        self.rows.extend(rows)
+        return len(self.rows) >= BUFFER_SIZE
+
+    async def flush(self):
+        """Writes all buffered rows into the database. If a multi-row statement fails, the rows are inserted 
+           individually, so that an invalid row does not discard the other rows."""
+        rows, self.rows = self.rows, []
+        for i in range(0, len(rows), BUFFER_SIZE):
+            chunk = rows[i:i+BUFFER_SIZE]
+            try:
+                if DATABASE_PARTITIONING and self.table in event_tables:
+                    await self.create_partitions(chunk)
+                await database.execute(self.table.insert().values(chunk))
+            except Exception as e:
+                if not self.unique:
+                    logger.error(f"Unable to write {len(chunk)} rows into {self.table.name}: {e}")
+                for row in chunk:
+                    await execute_db_operation(self.table.insert().values(**row))
+
+    async def create_partitions(self, rows):
+        """Creates the partitions for the rows, which can be outside of the regularly created partitions 
+           (e.g., events replayed from the journal of a service after a longer outage)."""
+        for start in set(month_start(row["time"]) for row in rows):
+            await create_partition(self.table, start)
+
+
+buffers = { table.name: WriteBuffer(table) for table in [mercure_events, webgui_events, dicom_files, series_events, processing_jobs] }
+buffers[dicom_series.name] = WriteBuffer(dicom_series, unique=True)
+buffers[series_sequence_data.name] = WriteBuffer(series_sequence_data, unique=True)
+
+
+async def flush_buffers():
+    """Writes the rows of all buffers into the database. The buffers are written in parallel using
+       the connections of the pool."""
+    await asyncio.gather(*[buffers[table].flush() for table in buffers])
+
+
+async def flush_buffers_periodically():
+    """Flushes the buffers in the configured interval, so that rows do not wait longer in the buffer."""
+    while True:
+        await asyncio.sleep(BUFFER_INTERVAL)
+        await flush_buffers()
+
+
+def store_rows(table, row_function, payloads):
+    """Converts the events into rows, places them into the write buffer of the table, and returns the response 
+       for the request. If the buffer is full, it will be flushed after the response has been sent. Events with
+       invalid values are rejected as a whole, so that the sender does not retry them."""
+    try:
+        rows = [row_function(payload) for payload in payloads]
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Invalid event for table {table.name}: {e}")
+        return JSONResponse({'error': 'invalid event'}, status_code=400)
+    tasks = BackgroundTasks()
+    if buffers[table.name].add(rows):
+        tasks.add_task(buffers[table.name].flush)
+    return JSONResponse({'ok': ''}, background=tasks)
+
+
+async def read_bulk_payload(request):
+    """Reads the list of events sent to a bulk endpoint. Returns None if the request body is invalid."""
+    try:
+        payload = await request.json()
+    except:
+        return None
+    if not isinstance(payload, list):
+        return None
+    return payload
+
+
+def event_time(payload):
+    """Returns the time when the event occurred, as sent by the mercure services. Events of older versions
+       do not contain the time, so that the time of arrival is used instead."""
+    try:
+        return datetime.datetime.fromtimestamp(float(payload["event_time"]))
+    except (KeyError, TypeError, ValueError, OverflowError, OSError):
+        return datetime.datetime.now()
+
+
+def mercure_event_row(payload):
+    return dict(
+        sender      =payload.get("sender","Unknown"), 
+        event       =payload.get("event",monitor.h_events.UNKNOWN), 
+        severity    =int(payload.get("severity",monitor.severity.INFO)), 
+        description =payload.get("description",""), 
+        time        =event_time(payload)
+    )
+
+
+def webgui_event_row(payload):
+    return dict(
+        sender      =payload.get("sender","Unknown"), 
+        event       =payload.get("event",monitor.w_events.UNKNOWN), 
+        user        =payload.get("user","UNKNOWN"), 
+        description =payload.get("description",""), 
+        time        =event_time(payload)
+    )
+
+
+def dicom_file_row(payload):
+    return dict(
+        filename    =payload.get("filename",""), 
+        file_uid    =payload.get("file_uid",""), 
+        series_uid  =payload.get("series_uid",""), 
+        time        =event_time(payload)
+    )
+
+
+def series_event_row(payload):
+    return dict(
+        sender      =payload.get("sender","Unknown"), 
+        event       =payload.get("event",monitor.s_events.UNKNOWN), 
+        series_uid  =payload.get("series_uid",""), 
+        file_count  =int(payload.get("file_count",0)), 
+        target      =payload.get("target",""), 
+        info        =payload.get("info",""), 
+        time        =event_time(payload)
+    )
+
+
+def processing_job_row(payload):
+    def optional(key, cast):
+        # Resource statistics are not available for all jobs (e.g., for warm containers)
+        return cast(payload[key]) if payload.get(key) is not None else None
+    return dict(
+        sender      =payload.get("sender","Unknown"), 
+        series_uid  =payload.get("series_uid",""), 
+        module      =payload.get("module",""), 
+        success     =str(payload.get("success","")).lower() in ("true","1"), 
+        wall_time   =optional("wall_time",float), 
+        cpu_time    =optional("cpu_time",float), 
+        peak_memory =optional("peak_memory",int), 
+        read_bytes  =optional("read_bytes",int), 
+        write_bytes =optional("write_bytes",int), 
+        time        =event_time(payload)
+    )
+
+
+def dicom_series_row(payload):
+    return dict(
+        time                      =event_time(payload), 
+        series_uid                =payload.get("SeriesInstanceUID",""),
+        tag_patientname           =payload.get("PatientName",""),
+        tag_patientid             =payload.get("PatientID",""),
+        tag_accessionnumber       =payload.get("AccessionNumber",""),
+        tag_seriesnumber          =payload.get("SeriesNumber",""),
+        tag_studyid               =payload.get("StudyID",""),
+        tag_patientbirthdate      =payload.get("PatientBirthDate",""),
+        tag_patientsex            =payload.get("PatientSex",""),
+        tag_acquisitiondate       =payload.get("AcquisitionDate",""),
+        tag_acquisitiontime       =payload.get("AcquisitionTime",""),
+        tag_modality              =payload.get("Modality",""),
+        tag_bodypartexamined      =payload.get("BodyPartExamined",""),
+        tag_studydescription      =payload.get("StudyDescription",""),
+        tag_seriesdescription     =payload.get("SeriesDescription",""),
+        tag_protocolname          =payload.get("ProtocolName",""),
+        tag_codevalue             =payload.get("CodeValue",""),
+        tag_codemeaning           =payload.get("CodeMeaning",""),
+        tag_sequencename          =payload.get("SequenceName",""),
+        tag_scanningsequence      =payload.get("ScanningSequence",""),
+        tag_sequencevariant       =payload.get("SequenceVariant",""),
+        tag_slicethickness        =payload.get("SliceThickness",""),
+        tag_contrastbolusagent    =payload.get("ContrastBolusAgent",""),
+        tag_referringphysicianname=payload.get("ReferringPhysicianName",""),
+        tag_manufacturer          =payload.get("Manufacturer",""),
+        tag_manufacturermodelname =payload.get("ManufacturerModelName",""),
+        tag_magneticfieldstrength =payload.get("MagneticFieldStrength",""),
+        tag_deviceserialnumber    =payload.get("DeviceSerialNumber",""),
+        tag_softwareversions      =payload.get("SoftwareVersions",""),
+        tag_stationname           =payload.get("StationName","")
+    )
+
+
+def sequence_data_row(payload):
+    event = payload.get("event",{})
+    return dict(uid=event.get("series_uid",""), data=event.get("data",""))
+
+
 @app.route('/test', methods=["GET","POST"])
 async def test_endpoint(request):
     """Endpoint for testing that the bookkeeper is active."""
@@ -209,137 +535,113 @@ async def test_endpoint(request):
 @app.route('/mercure-event', methods=["POST"])
 async def post_mercure_event(request):
     """Endpoint for receiving mercure system events."""
-    payload     = dict(await request.form())
-    sender      = payload.get("sender","Unknown")
-    event       = payload.get("event",monitor.h_events.UNKNOWN)
-    severity    = int(payload.get("severity",monitor.severity.INFO))    
-    description = payload.get("description","")       
-
-    query = mercure_events.insert().values(
-        sender=sender, event=event, severity=severity, description=description, time=datetime.datetime.now()
-    )
-    tasks = BackgroundTasks()
-    tasks.add_task(execute_db_operation, operation=query)
-    return JSONResponse({'ok': ''}, background=tasks)
+    payload = dict(await request.form())
+    return store_rows(mercure_events, mercure_event_row, [payload])
+
+
+@app.route('/mercure-event/bulk', methods=["POST"])
+async def post_mercure_event_bulk(request):
+    """Endpoint for receiving a list of mercure system events."""
+    payload = await read_bulk_payload(request)
+    if payload is None:
+        return JSONResponse({'error': 'invalid request'}, status_code=400)
+    return store_rows(mercure_events, mercure_event_row, payload)
 
 
 @app.route('/webgui-event', methods=["POST"])
 async def post_webgui_event(request):
     """Endpoint for logging relevant events of the webgui."""
-    payload     = dict(await request.form())
-    sender      = payload.get("sender","Unknown")
-    event       = payload.get("event",monitor.w_events.UNKNOWN)
-    user        = payload.get("user","UNKNOWN")
-    description = payload.get("description","")       
-
-    query = webgui_events.insert().values(
-        sender=sender, event=event, user=user, description=description, time=datetime.datetime.now()
-    )
-    tasks = BackgroundTasks()
-    tasks.add_task(execute_db_operation, operation=query)
-    return JSONResponse({'ok': ''}, background=tasks)
+    payload = dict(await request.form())
+    return store_rows(webgui_events, webgui_event_row, [payload])
+
+
+@app.route('/webgui-event/bulk', methods=["POST"])
+async def post_webgui_event_bulk(request):
+    """Endpoint for logging a list of webgui events."""
+    payload = await read_bulk_payload(request)
+    if payload is None:
+        return JSONResponse({'error': 'invalid request'}, status_code=400)
+    return store_rows(webgui_events, webgui_event_row, payload)
 
     
 @app.route('/register-dicom', methods=["POST"])
 async def register_dicom(request):
     """Endpoint for registering newly received DICOM files. Called by the getdcmtags module."""
-    payload    = dict(await request.form())
-    filename   = payload.get("filename","")
-    file_uid   = payload.get("file_uid","")
-    series_uid = payload.get("series_uid","")
-
-    query = dicom_files.insert().values(
-        filename=filename, file_uid=file_uid, series_uid=series_uid, time=datetime.datetime.now()
-    )
-    tasks = BackgroundTasks()
-    tasks.add_task(execute_db_operation, operation=query)    
-    return JSONResponse({'ok': ''}, background=tasks)
+    payload = dict(await request.form())
+    return store_rows(dicom_files, dicom_file_row, [payload])
 
 
-async def parse_and_submit_tags(payload):
-    """Helper function that reads series information from the request body."""
-    try:
-        query = dicom_series.insert().values(
-            time                      =datetime.datetime.now(), 
-            series_uid                =payload.get("SeriesInstanceUID",""),
-            tag_patientname           =payload.get("PatientName",""),
-            tag_patientid             =payload.get("PatientID",""),
-            tag_accessionnumber       =payload.get("AccessionNumber",""),
-            tag_seriesnumber          =payload.get("SeriesNumber",""),
-            tag_studyid               =payload.get("StudyID",""),
-            tag_patientbirthdate      =payload.get("PatientBirthDate",""),
-            tag_patientsex            =payload.get("PatientSex",""),
-            tag_acquisitiondate       =payload.get("AcquisitionDate",""),
-            tag_acquisitiontime       =payload.get("AcquisitionTime",""),
-            tag_modality              =payload.get("Modality",""),
-            tag_bodypartexamined      =payload.get("BodyPartExamined",""),
-            tag_studydescription      =payload.get("StudyDescription",""),
-            tag_seriesdescription     =payload.get("SeriesDescription",""),
-            tag_protocolname          =payload.get("ProtocolName",""),
-            tag_codevalue             =payload.get("CodeValue",""),
-            tag_codemeaning           =payload.get("CodeMeaning",""),
-            tag_sequencename          =payload.get("SequenceName",""),
-            tag_scanningsequence      =payload.get("ScanningSequence",""),
-            tag_sequencevariant       =payload.get("SequenceVariant",""),
-            tag_slicethickness        =payload.get("SliceThickness",""),
-            tag_contrastbolusagent    =payload.get("ContrastBolusAgent",""),
-            tag_referringphysicianname=payload.get("ReferringPhysicianName",""),
-            tag_manufacturer          =payload.get("Manufacturer",""),
-            tag_manufacturermodelname =payload.get("ManufacturerModelName",""),
-            tag_magneticfieldstrength =payload.get("MagneticFieldStrength",""),
-            tag_deviceserialnumber    =payload.get("DeviceSerialNumber",""),
-            tag_softwareversions      =payload.get("SoftwareVersions",""),
-            tag_stationname           =payload.get("StationName","")
-        )
-        connection.execute(query)
-    except Exception as e:
-        print(e)
-        # TODO: Implement differentiation between IntegrityError and other exceptions
-        pass
+@app.route('/register-dicom/bulk', methods=["POST"])
+async def register_dicom_bulk(request):
+    """Endpoint for registering a list of received DICOM files."""
+    payload = await read_bulk_payload(request)
+    if payload is None:
+        return JSONResponse({'error': 'invalid request'}, status_code=400)
+    return store_rows(dicom_files, dicom_file_row, payload)
 
 
 @app.route('/register-series', methods=["POST"])
 async def register_series(request):
     """Endpoint that is called by the router whenever a new series arrives."""
     payload = dict(await request.form())
-    tasks = BackgroundTasks()
-    tasks.add_task(parse_and_submit_tags, payload=payload)    
-    return JSONResponse({'ok': ''}, background=tasks)
+    return store_rows(dicom_series, dicom_series_row, [payload])
+
+
+@app.route('/register-series/bulk', methods=["POST"])
+async def register_series_bulk(request):
+    """Endpoint for registering a list of series."""
+    payload = await read_bulk_payload(request)
+    if payload is None:
+        return JSONResponse({'error': 'invalid request'}, status_code=400)
+    return store_rows(dicom_series, dicom_series_row, payload)
+
 
 @app.route('/series-sequences', methods=["POST"])
 async def store_sequence_data(request):
     """Store sequence details."""
-    payload = dict(await request.json()).get('event')
-    series_uid = payload.get("series_uid","")
-    data       = payload.get("data","")
+    payload = dict(await request.json())
+    return store_rows(series_sequence_data, sequence_data_row, [payload])
+
+
+@app.route('/series-sequences/bulk', methods=["POST"])
+async def store_sequence_data_bulk(request):
+    """Store the sequence details of a list of series."""
+    payload = await read_bulk_payload(request)
+    if payload is None:
+        return JSONResponse({'error': 'invalid request'}, status_code=400)
+    return store_rows(series_sequence_data, sequence_data_row, payload)
 
-    logger.info("sequence data")
-    tasks = BackgroundTasks()
-    
-    query = series_sequence_data.insert().values(
-        uid=series_uid, data=data
-    )
-    tasks.add_task(execute_db_operation, operation=query)
-    return JSONResponse({'ok': ''}, background=tasks)
 
 @app.route('/series-event', methods=["POST"])
 async def post_series_event(request):
     """Endpoint for logging all events related to one series."""
-    payload    = dict(await request.form())
-    sender     = payload.get("sender","Unknown")
-    event      = payload.get("event",monitor.s_events.UNKNOWN)
-    series_uid = payload.get("series_uid","")
-    file_count = payload.get("file_count",0)
-    target     = payload.get("target","")
-    info       = payload.get("info","")
-
-    query = series_events.insert().values(
-        sender=sender, event=event, series_uid=series_uid, file_count=file_count, 
-        target=target, info=info, time=datetime.datetime.now()
-    )
-    tasks = BackgroundTasks()
-    tasks.add_task(execute_db_operation, operation=query)
-    return JSONResponse({'ok': ''}, background=tasks)
+    payload = dict(await request.form())
+    return store_rows(series_events, series_event_row, [payload])
+
+
+@app.route('/series-event/bulk', methods=["POST"])
+async def post_series_event_bulk(request):
+    """Endpoint for logging a list of series events."""
+    payload = await read_bulk_payload(request)
+    if payload is None:
+        return JSONResponse({'error': 'invalid request'}, status_code=400)
+    return store_rows(series_events, series_event_row, payload)
+
+
+@app.route('/processing-metrics', methods=["POST"])
+async def post_processing_metrics(request):
+    """Endpoint for storing the resource usage of a processing job."""
+    payload = dict(await request.form())
+    return store_rows(processing_jobs, processing_job_row, [payload])
+
+
+@app.route('/processing-metrics/bulk', methods=["POST"])
+async def post_processing_metrics_bulk(request):
+    """Endpoint for storing the resource usage of a list of processing jobs."""
+    payload = await read_bulk_payload(request)
+    if payload is None:
+        return JSONResponse({'error': 'invalid request'}, status_code=400)
+    return store_rows(processing_jobs, processing_job_row, payload)
 
 
 ###################################################################################
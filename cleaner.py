@@ -80,18 +80,8 @@ def clean(args):
         clean_dir(discard_folder, retention)
 
 
-def _is_offpeak(offpeak_start, offpeak_end, current_time):
-    try:
-        start_time = datetime.strptime(offpeak_start, "%H:%M").time()
-        end_time = datetime.strptime(offpeak_end, "%H:%M").time()
-    except ValueError as e:
-        logger.error("Error parsing offpeak time, please check configuration", e)
-        return True
-
-    if start_time < end_time:
-        return current_time >= start_time and current_time <= end_time
-    # End time is after midnight
-    return current_time >= start_time or current_time <= end_time
+# The off-peak check is shared with the dispatch scheduler
+_is_offpeak = helper.is_offpeak
 
 
 def clean_dir(discard_folder, retention):
@@ -175,7 +165,7 @@ if __name__ == "__main__":
     logger.info(f"Instance  PID  = {os.getpid()}")
     logger.info(sys.version)
 
-    monitor.configure("cleaner", instance_name, config.mercure["bookkeeper"])
+    monitor.configure("cleaner", instance_name, config.mercure["bookkeeper"], config.mercure["bookkeeper_journal_folder"])
     monitor.send_event(
         monitor.h_events.BOOT, monitor.severity.INFO, f"PID = {os.getpid()}"
     )
@@ -24,7 +24,18 @@ mercure_defaults = {
     'discard_folder'             :             './discard',
     'processing_folder'          :          './processing',
     'router_scan_interval'       :                       1, # in seconds
+    'router_watch_incoming'      :                   False,
+    'router_reconcile_interval'  :                     300, # in seconds
     'dispatcher_scan_interval'   :                       1, # in seconds
+    'dispatcher_max_workers'     :                       1,
+    'dispatcher_target_workers'  :                       1,
+    'dispatcher_aging_time'      :                    3600, # in seconds
+    'dispatcher_batch_size'      :                       1,
+    'dispatcher_sender'          :               'dcmsend',
+    'processor_slots'            :                       1,
+    'processor_slot_cpus'        :                       0, # 0 = no limit
+    'processor_slot_memory'      :                      '', # e.g. '4g', empty = no limit
+    'processor_aging_time'       :                    3600, # in seconds
     'cleaner_scan_interval'      :                      60, # in seconds
     'retention'                  :                  259200, # in seconds (3 days)
     'retry_delay'                :                     900, # in seconds (15 min)
@@ -35,6 +46,7 @@ mercure_defaults = {
     'graphite_ip'                :                      '',
     'graphite_port'              :                    2003,
     'bookkeeper'                 :          '0.0.0.0:8080',
+    'bookkeeper_journal_folder'  :             './journal',
     'offpeak_start'              :                 '22:00',
     'offpeak_end'                :                 '06:00',
     'targets'                    :                      {},
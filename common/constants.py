@@ -13,6 +13,8 @@ class mercure_names:
     SENDLOG      = "sent.txt"
     DCM          = ".dcm"
     DCMFILTER    = "*.dcm"
+    SPOOL        = "registration.spool"
+    SENT         = ".sent"
 
 class mercure_sections:
     INFO         = "info"
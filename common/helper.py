@@ -1,7 +1,15 @@
 import asyncio
 import threading
+from datetime import datetime
+from pathlib import Path
+import daiquiri
 import graphyte
 
+from common.constants import mercure_names, mercure_sections
+
+
+logger = daiquiri.getLogger("helper")
+
 
 # Global variable to broadcast when the process should terminate
 terminate = False
@@ -31,6 +39,31 @@ def g_log(*args, **kwargs):
     asyncio.run_coroutine_threadsafe(send_to_graphite(*args, **kwargs), loop)
 
 
+def is_offpeak(offpeak_start, offpeak_end, current_time):
+    """Checks if the given time is inside the off-peak window (times given in 24h format). If the window
+       cannot be parsed, it is treated as off-peak."""
+    try:
+        start_time = datetime.strptime(offpeak_start, "%H:%M").time()
+        end_time = datetime.strptime(offpeak_end, "%H:%M").time()
+    except ValueError as e:
+        logger.error(f"Error parsing offpeak time, please check configuration: {e}")
+        return True
+
+    if start_time < end_time:
+        return current_time >= start_time and current_time <= end_time
+    # End time is after midnight
+    return current_time >= start_time or current_time <= end_time
+
+
+def get_file_count(folder, task):
+    """Returns the number of DICOM files in the folder. The number is taken from the file manifest of the 
+       task file, so that the folder only needs to be scanned for task files without manifest."""
+    manifest = (task or {}).get(mercure_sections.FILES, {})
+    if "count" in manifest:
+        return manifest["count"]
+    return len(list(Path(folder).glob(mercure_names.DCMFILTER)))
+
+
 class RepeatedTimer(object):
     """
     Helper class for running a continuous timer that is suspended
@@ -1,11 +1,20 @@
 import requests
 import daiquiri
 import logging
+import threading
+import queue
+import atexit
+import json
+import os
+import time
+import fcntl
 
 logger = daiquiri.getLogger("config")
 
 sender_name       =""
 bookkeeper_address=""
+event_sender      =None
+registration_forwarder=None
 
 
 class h_events:
@@ -58,35 +67,278 @@ class severity:
     CRITICAL         = 3
 
 
-def configure(module,instance,address):
+class EventSender(threading.Thread):
+    """Background thread that transmits the events to the bookkeeper, so that the calling services never
+       block on monitoring I/O. Events are placed into a bounded queue and sent in batches to the bulk
+       endpoints of the bookkeeper, using a session with persistent connections. If the bookkeeper is 
+       unreachable, the events are appended to a journal file on the local disk and replayed once the
+       bookkeeper is available again."""
+    QUEUE_SIZE     = 10000
+    BATCH_SIZE     = 500
+    BATCH_DELAY    = 0.05 # in seconds
+    RETRY_INTERVAL = 10   # in seconds
+    TIMEOUT        = 5    # in seconds
+
+    def __init__(self, address, journal_file):
+        super().__init__(daemon=True)
+        self.address = address
+        self.journal_file = journal_file
+        self.journal_lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.session = requests.Session()
+        self.next_attempt = 0
+
+    def submit(self, endpoint, payload):
+        """Queues the event for transmission. Never blocks; if the queue is full, the event is journaled."""
+        try:
+            self.queue.put_nowait((endpoint, payload))
+        except queue.Full:
+            self._write_journal([(endpoint, payload)])
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # Give further events the chance to arrive, so that they can be transmitted together
+            deadline = time.time() + self.BATCH_DELAY
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    item = self.queue.get(timeout=max(deadline-time.time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._send_batch(batch)
+                    return
+                batch.append(item)
+            self._send_batch(batch)
+
+    def stop(self, timeout=5):
+        """Transmits the queued events and stops the thread. Events that cannot be transmitted within the
+           timeout remain in the queue and are written to the journal."""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.join(timeout)
+        remaining = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                remaining.append(item)
+        if remaining:
+            self._write_journal(remaining)
+
+    def _send_batch(self, batch):
+        """Sends the events of the batch grouped by endpoint. If the bookkeeper is unreachable, the events
+           are journaled. Journaled events are replayed before new events are sent to maintain the order."""
+        if time.time() < self.next_attempt or not self._replay_journal():
+            self._write_journal(batch)
+            return
+        undelivered = self._post_batch(batch)
+        if undelivered:
+            self.next_attempt = time.time() + self.RETRY_INTERVAL
+            self._write_journal(undelivered)
+
+    def _post_batch(self, batch):
+        """Posts the events to the bulk endpoints. Returns the events that could not be delivered because the 
+           bookkeeper is unreachable or failing (connection errors, timeouts, and server errors). Events that
+           are rejected by the bookkeeper as invalid are dropped, as they would be rejected again."""
+        groups = {}
+        for endpoint, payload in batch:
+            groups.setdefault(endpoint, []).append(payload)
+        endpoints = list(groups)
+        for i, endpoint in enumerate(endpoints):
+            try:
+                response = self.session.post(self.address+endpoint+"/bulk", json=groups[endpoint], timeout=self.TIMEOUT)
+                failed = response.status_code >= 500
+            except requests.exceptions.RequestException:
+                failed = True
+            if failed:
+                logger.error("Failed request to bookkeeper")
+                # Groups that have been delivered already are not returned, so that they are not stored twice
+                return [(endpoint, payload) for endpoint in endpoints[i:] for payload in groups[endpoint]]
+            if response.status_code >= 400:
+                logger.error(f"Bookkeeper rejected {len(groups[endpoint])} events for {endpoint} "
+                             f"(status {response.status_code}). Dropping events")
+        return []
+
+    def _write_journal(self, batch):
+        if not self.journal_file:
+            logger.error(f"Unable to reach bookkeeper. Dropping {len(batch)} events")
+            return
+        try:
+            with self.journal_lock, open(self.journal_file, "a") as f:
+                for endpoint, payload in batch:
+                    f.write(json.dumps({ "endpoint": endpoint, "payload": payload })+"\n")
+        except Exception:
+            logger.exception(f"Unable to write bookkeeper journal {self.journal_file}")
+
+    def _replay_journal(self):
+        """Sends all events from the journal to the bookkeeper. Returns False if not successful."""
+        if not self.journal_file:
+            return True
+        replay_file = self.journal_file + ".replay"
+        while True:
+            # Move the journal aside, so that new events can be journaled while the replay is running
+            with self.journal_lock:
+                if not os.path.exists(replay_file):
+                    if not os.path.exists(self.journal_file):
+                        return True
+                    os.rename(self.journal_file, replay_file)
+            if not self._replay_file(replay_file):
+                self.next_attempt = time.time() + self.RETRY_INTERVAL
+                return False
+            os.remove(replay_file)
+            logger.info("Replayed bookkeeper journal")
+
+    def _replay_file(self, replay_file):
+        """Sends the events of the replay file in batches. If the bookkeeper becomes unreachable, the replay file
+           is replaced by the events that have not been delivered yet, so that the next replay continues there.
+           Returns False if not all events could be delivered."""
+        batch = []
+        with open(replay_file, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                batch.append((entry["endpoint"], entry["payload"]))
+                if len(batch) >= self.BATCH_SIZE:
+                    undelivered = self._post_batch(batch)
+                    if undelivered:
+                        self._keep_undelivered(replay_file, undelivered, f)
+                        return False
+                    batch = []
+            undelivered = self._post_batch(batch) if batch else []
+            if undelivered:
+                self._keep_undelivered(replay_file, undelivered, f)
+                return False
+        return True
+
+    def _keep_undelivered(self, replay_file, undelivered, remaining_lines):
+        """Replaces the replay file with the undelivered events, followed by the remaining lines of the file."""
+        temp_file = replay_file + ".tmp"
+        with open(temp_file, "w") as f:
+            for endpoint, payload in undelivered:
+                f.write(json.dumps({ "endpoint": endpoint, "payload": payload })+"\n")
+            for line in remaining_lines:
+                f.write(line)
+        os.replace(temp_file, replay_file)
+
+
+class RegistrationForwarder(threading.Thread):
+    """Background thread that forwards the registrations of received DICOM files to the bookkeeper. Instead
+       of starting a wget process for every received file, the getdcmtags module appends one line per file
+       to a spool file. The forwarder periodically moves the spool file aside and hands the entries over
+       to the event sender, which transmits them in batches to the bulk endpoint."""
+    INTERVAL = 1 # in seconds
+
+    def __init__(self, spool_file):
+        super().__init__(daemon=True)
+        self.spool_file = spool_file
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.INTERVAL):
+            self.forward()
+
+    def stop(self):
+        """Forwards the remaining entries and stops the thread."""
+        self.stopped.set()
+        self.join()
+        self.forward()
+
+    def forward(self):
+        """Submits all entries of the spool file. Returns the number of forwarded entries."""
+        forward_file = self.spool_file + ".forward"
+        # If the forward file still exists, the previous run has been interrupted and the file is
+        # forwarded first (entries might be registered twice in this case)
+        if not os.path.exists(forward_file):
+            try:
+                os.rename(self.spool_file, forward_file)
+            except FileNotFoundError:
+                return 0
+        count = 0
+        try:
+            with open(forward_file, "r") as f:
+                # getdcmtags holds a shared lock while appending to the spool file. Acquiring the exclusive 
+                # lock waits for processes that opened the file before it has been moved aside
+                fcntl.flock(f, fcntl.LOCK_EX)
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 3:
+                        continue
+                    submit("/register-dicom", { "filename": fields[0], "file_uid": fields[1], "series_uid": fields[2] })
+                    count += 1
+            os.remove(forward_file)
+        except Exception:
+            logger.exception(f"Unable to forward registrations from {forward_file}")
+        return count
+
+
+def configure(module,instance,address,journal_folder=""):
     """Configures the connection to the bookkeeper module. If not called, events
-       will not be transmitted to the bookkeeper."""
+       will not be transmitted to the bookkeeper. If a journal folder is given, events
+       are stored in the folder while the bookkeeper is unreachable."""
     global sender_name
     global bookkeeper_address
+    global event_sender
     sender_name=module+"."+instance
     bookkeeper_address='http://'+address
 
+    journal_file=""
+    if journal_folder:
+        try:
+            os.makedirs(journal_folder, exist_ok=True)
+            journal_file=os.path.join(journal_folder, sender_name+".journal")
+        except Exception:
+            logger.exception(f"Unable to create journal folder {journal_folder}")
+
+    event_sender=EventSender(bookkeeper_address, journal_file)
+    event_sender.start()
+    atexit.register(event_sender.stop)
+
+
+def forward_registrations(spool_file):
+    """Starts forwarding the file registrations written by getdcmtags into the given spool file. Needs 
+       to be called after configure()."""
+    global registration_forwarder
+    registration_forwarder=RegistrationForwarder(spool_file)
+    registration_forwarder.start()
+    # The exit handlers are called in reverse order, so that the remaining entries are forwarded 
+    # before the event sender is stopped
+    atexit.register(registration_forwarder.stop)
+
+
+def submit(endpoint, payload):
+    """Hands the event over to the background sender. The time of the event is added to the payload, as 
+       the event might reach the bookkeeper much later (e.g., when replayed from the journal)."""
+    if not event_sender:
+        return
+    if "event_time" not in payload:
+        payload = dict(payload, event_time=time.time())
+    event_sender.submit(endpoint, payload)
+
 
 def send_event(event, severity = severity.INFO, description = ""):
     """Sends information about general mercure events to the bookkeeper (e.g., during module start)."""
     if not bookkeeper_address:
         return
-    try:
-        payload = {'sender': sender_name, 'event': event, 'severity': severity, 'description': description }
-        requests.post(bookkeeper_address+"/mercure-event", data=payload, timeout=1)
-    except requests.exceptions.RequestException:
-        logger.error("Failed request to bookkeeper")
+    payload = {'sender': sender_name, 'event': event, 'severity': severity, 'description': description }
+    submit("/mercure-event", payload)
 
 
 def send_webgui_event(event, user, description = ""):
     """Sends information about an event on the webgui to the bookkeeper."""
     if not bookkeeper_address:
         return
-    try:
-        payload = {'sender': sender_name, 'event': event, 'user': user, 'description': description }
-        requests.post(bookkeeper_address+"/webgui-event", data=payload, timeout=1)
-    except requests.exceptions.RequestException:
-        logger.error("Failed request to bookkeeper")
+    payload = {'sender': sender_name, 'event': event, 'user': user, 'description': description }
+    submit("/webgui-event", payload)
 
 
 def send_register_series(tags):
@@ -94,32 +346,30 @@ def send_register_series(tags):
        fully received and the DICOM tags have been parsed."""
     if not bookkeeper_address:
         return
-    try:
-        requests.post(bookkeeper_address+"/register-series", data=tags, timeout=1)
-    except requests.exceptions.RequestException:
-        logger.error("Failed request to bookkeeper")
+    submit("/register-series", tags)
 
 
 def send_series_event(event, series_uid, file_count, target, info):
     """Send an event related to a specific series to the bookkeeper."""
     if not bookkeeper_address:
         return
-    try:
-        payload = {'sender': sender_name, 'event': event, 'series_uid': series_uid,
-                   'file_count': file_count, 'target': target, 'info': info }
-        requests.post(bookkeeper_address+"/series-event", data=payload, timeout=1)
-    except requests.exceptions.RequestException:
-        logger.error("Failed request to bookkeeper")
+    payload = {'sender': sender_name, 'event': event, 'series_uid': series_uid,
+               'file_count': file_count, 'target': str(target), 'info': info }
+    submit("/series-event", payload)
+
+
+def send_processing_metrics(series_uid, module, success, metrics):
+    """Sends the resource usage of a processing job to the bookkeeper."""
+    if not bookkeeper_address:
+        return
+    payload = {'sender': sender_name, 'series_uid': series_uid, 'module': module, 'success': success }
+    payload.update(metrics)
+    submit("/processing-metrics", payload)
 
 
 def send_series_sequence_data(series_UID, data):
     """Send sequence details."""
     if not bookkeeper_address:
         return
-    try:
-        payload = {'sender': sender_name, 'event': dict(series_uid=series_UID, data=data) }
-        logger.info("Payload:")
-        #logger.info(payload)
-        requests.post(bookkeeper_address+"/series-sequences", json=payload, timeout=1)
-    except requests.exceptions.RequestException:
-        logger.error("Failed request to bookkeeper")
+    payload = {'sender': sender_name, 'event': dict(series_uid=series_UID, data=data) }
+    submit("/series-sequences", payload)
@@ -1,53 +1,55 @@
 import logging
+import re
+import ast
+import functools
 import common.monitor as monitor
 import daiquiri
+from common.constants import mercure_rule, mercure_options
 
 logger = daiquiri.getLogger("rule_evaluation")
 
 
 safe_eval_cmds={"float": float, "int": int, "str": str}
 
+# Name of the variable that holds the tags dictionary when evaluating compiled rules
+TAGS_VARIABLE="_tags"
 
-def replace_tags(rule,tags):
-    """Replaces all tags with format @tagname@ in the given rule string with
-       the corresponding values from the currently processed series (stored
-       in the second argument)."""
-    # Run the substitue operation manually instead of using
-    # the standard string function to enforce that the values
-    # read from the tags are treated as strings by default
-    tags_found = []  
-    i=0
-    while i < len(rule):
-        opening=rule.find("@",i)
-        if opening<0:
-            break
-        closing=rule.find("@",opening+1)
-        if closing<0:
-            break
-        tagstring=rule[opening+1:closing]
-        if tagstring in tags:
-            tags_found.append(tagstring)
-        i=closing+1
-
-    for tag in tags_found:
-        rule=rule.replace("@"+tag+"@","'"+tags[tag]+"'")
-
-    return rule
+tag_pattern=re.compile(r"@([A-Za-z0-9_]+)@")
+
+
+def translate_rule(rule):
+    """Translates the tag placeholders with format @tagname@ of the given rule into lookups of the tags
+       dictionary and returns the resulting Python expression."""
+    return tag_pattern.sub(lambda match: TAGS_VARIABLE+"["+repr(match.group(1))+"]", rule)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_rule(rule):
+    """Compiles the given rule into a code object. The tag placeholders are translated into lookups of
+       the tags dictionary, so that the rule needs to be parsed only once and the tag values do not 
+       need to be quoted. Compiled rules are cached, so that each rule is compiled only once per 
+       configuration version. Raises an exception if the rule is invalid."""
+    return compile(translate_rule(rule), "<rule>", "eval")
+
+
+def evaluate_rule(compiled_rule,tags):
+    """Evaluates a rule that has been compiled with compile_rule for the given tags dictionary. Raises
+       a KeyError if the rule refers to a tag that is not contained in the dictionary."""
+    variables=dict(safe_eval_cmds)
+    variables[TAGS_VARIABLE]=tags
+    return eval(compiled_rule,{"__builtins__": {}},variables)
 
 
 def parse_rule(rule,tags):
-    """Parses the given rule, replaces all tag variables with values from the given tags dictionary, and
-       evaluates the rule. If the rule is invalid, an exception will be raised."""
+    """Evaluates the given rule for the tags dictionary, using the cached compiled version of the rule. 
+       If the rule is invalid, an error event is sent and False is returned."""
     try:
-        logger.info(f"Rule: {rule}")
-        rule=replace_tags(rule,tags)
-        logger.info(f"Evaluated: {rule}")
-        result=eval(rule,{"__builtins__": {}},safe_eval_cmds)
-        logger.info(f"Result: {result}")
+        result=evaluate_rule(compile_rule(rule),tags)
+        logger.debug(f"Rule: {rule} Result: {result}")
         return result
     except Exception as e: 
         logger.error(f"ERROR: {e}")
-        logger.warn(f"WARNING: Invalid rule expression {rule}",'"'+rule+'"')
+        logger.warning(f"WARNING: Invalid rule expression {rule}")
         monitor.send_event(monitor.h_events.CONFIG_UPDATE,monitor.severity.ERROR,f"Invalid rule encountered {rule}")
         return False
 
@@ -57,24 +59,130 @@ def test_rule(rule,tags):
        more diagnostic output format for the testing dialog. Also warns about invalid tags."""
     try:
         logger.info(f"Rule: {rule}")
-        rule=replace_tags(rule,tags)
-        logger.info(f"Evaluated: {rule}")
-        if ("MissingTag" in rule):
+        compiled_rule=compile_rule(rule)
+        # Tags that are not contained in the series have the value "MissingTag"
+        if any(tags.get(tag)=="MissingTag" for tag in tag_pattern.findall(rule)):
             return "Rule contains invalid tag"
-        result=eval(rule,{"__builtins__": {}},safe_eval_cmds)
+        result=evaluate_rule(compiled_rule,tags)
         logger.info(f"Result: {result}")
         if result:
             return "True"
         else:
             return "False"
+    except KeyError as e:
+        return f"Rule contains invalid tag {e}"
     except Exception as e: 
         return str(e)    
 
 
+def _get_tag_lookup(node):
+    """Returns the tag name if the node is a lookup of the tags dictionary, otherwise None."""
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id==TAGS_VARIABLE:
+        return _get_string_constant(node.slice)
+    return None
+
+
+def _get_string_constant(node):
+    """Returns the value if the node is a string constant, otherwise None."""
+    # Python < 3.9 wraps subscripts into an Index node, and Python < 3.8 uses Str nodes for strings
+    if type(node).__name__=="Index":
+        node = node.value
+    if isinstance(node, ast.Constant):
+        return node.value if isinstance(node.value, str) else None
+    if type(node).__name__=="Str":
+        return node.s
+    return None
+
+
+def _get_index_predicate(node):
+    """Returns a tuple (tag, values) if the expression can only be true when the given tag has one of 
+       the values, otherwise None. Equality tests and "in" tests with constant lists are considered,
+       as well as conjunctions and disjunctions of these tests."""
+    if isinstance(node, ast.Expression):
+        return _get_index_predicate(node.body)
+
+    if isinstance(node, ast.Compare) and len(node.ops)==1:
+        left, right = node.left, node.comparators[0]
+        if isinstance(node.ops[0], ast.Eq):
+            for tag_node, value_node in ((left, right), (right, left)):
+                tag, value = _get_tag_lookup(tag_node), _get_string_constant(value_node)
+                if tag is not None and value is not None:
+                    return (tag, frozenset([value]))
+        if isinstance(node.ops[0], ast.In) and isinstance(right, (ast.Tuple, ast.List, ast.Set)):
+            tag = _get_tag_lookup(left)
+            values = [_get_string_constant(element) for element in right.elts]
+            if tag is not None and not None in values:
+                return (tag, frozenset(values))
+        return None
+
+    if isinstance(node, ast.BoolOp):
+        operands, is_conjunction = node.values, isinstance(node.op, ast.And)
+    elif isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+        operands, is_conjunction = [node.left, node.right], isinstance(node.op, ast.BitAnd)
+    else:
+        return None
+
+    predicates = [_get_index_predicate(operand) for operand in operands]
+    if is_conjunction:
+        # The expression can only be true if every operand is true, so any of the predicates can be used
+        for predicate in predicates:
+            if predicate is not None:
+                return predicate
+        return None
+    # For a disjunction, all operands need to test the same tag
+    if None in predicates or len(set(predicate[0] for predicate in predicates))!=1:
+        return None
+    return (predicates[0][0], frozenset().union(*[predicate[1] for predicate in predicates]))
+
+
+def get_index_predicate(rule):
+    """Analyzes the given rule and returns a tuple (tag, values) with a tag that needs to have one of
+       the values for the rule to trigger. Returns None if the rule does not contain such a test."""
+    try:
+        return _get_index_predicate(ast.parse(translate_rule(rule), mode="eval"))
+    except SyntaxError:
+        return None
+
+
+class RuleIndex:
+    """Index of the enabled rules that is keyed by the equality and "in" tests of the rules. Only the
+       rules that can possibly trigger for a given tags dictionary need to be evaluated, so that the
+       evaluation time depends on the number of candidate rules instead of the total number of rules.
+       Rules that cannot be indexed are always returned as candidates."""
+    def __init__(self, rules):
+        self.position = {}
+        self.unindexed = []
+        self.index = {}
+
+        for position, name in enumerate(rules):
+            if rules[name].get(mercure_rule.DISABLED,mercure_options.FALSE)==mercure_options.TRUE:
+                continue
+            self.position[name] = position
+            predicate = get_index_predicate(rules[name].get(mercure_rule.RULE,"False"))
+            if predicate is None:
+                self.unindexed.append(name)
+                continue
+            tag, values = predicate
+            for value in values:
+                self.index.setdefault(tag,{}).setdefault(value,[]).append(name)
+
+    def get_candidates(self, tags):
+        """Returns the rules that need to be evaluated for the given tags, in the order of the configuration."""
+        candidates = set(self.unindexed)
+        for tag in self.index:
+            if tag in tags:
+                candidates.update(self.index[tag].get(tags[tag],[]))
+            else:
+                # If the tag is missing, the rules are evaluated so that they are reported as invalid
+                for names in self.index[tag].values():
+                    candidates.update(names)
+        return sorted(candidates, key=lambda name: self.position[name])
+
+
 #if __name__ == "__main__":
 #    tags = { "Tag1": "One", "TestTag": "Two", "AnotherTag": "Three" }
 #    result = "('Tr' in @Tag1@) | (@Tag1@ == 'Trio') @Three@ @AnotherTag@"
-#    parsed=replace_tags(result,tags)
+#    parsed=parse_rule(result,tags)
 #    print(result)
 #    print(parsed)
 
@@ -0,0 +1,74 @@
+"""
+storage.py
+==========
+Functions for handing over series between the stage folders (incoming, outgoing, processing, success,
+error) without copying the DICOM files, as far as supported by the filesystem.
+"""
+import errno
+import fcntl
+import os
+import shutil
+import threading
+
+import daiquiri
+
+import common.monitor as monitor
+
+
+logger = daiquiri.getLogger("storage")
+
+# ioctl request for cloning a file on filesystems that support reflinks (e.g., btrfs, XFS)
+FICLONE = 0x40049409
+
+# Pairs of filesystems for which a warning about copied folders has already been given
+warned_devices = set()
+warned_lock = threading.Lock()
+
+
+def link_or_copy(source, target):
+    """Places the file at the target path as hard link to the source file, or copies the file if
+       this is not possible (e.g., different filesystems). Only for files that are not modified
+       afterwards, as both paths refer to the same data."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy(source, target)
+
+
+def clone_or_copy(source, target):
+    """Copies the file, using a reflink if supported by the filesystem. Reflinked files share the data
+       until one of the files is modified, so that the copy is made in constant time."""
+    try:
+        with open(source, "rb") as source_file, open(target, "wb") as target_file:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        shutil.copymode(source, target)
+    except OSError:
+        shutil.copy(source, target)
+
+
+def move_folder(source, target):
+    """Moves the folder to the target path. If the target is on the same filesystem, the folder is renamed,
+       which takes constant time independent of the size of the series. Otherwise, all files need to be
+       copied, which is reported once, as the stage folders should be placed on the same filesystem."""
+    try:
+        os.rename(source, target)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    _warn_copy(source, target)
+    shutil.move(str(source), str(target), copy_function=shutil.copy2)
+
+
+def _warn_copy(source, target):
+    try:
+        devices = (os.stat(source).st_dev, os.stat(os.path.dirname(os.path.abspath(str(target)))).st_dev)
+    except OSError:
+        devices = (str(source), str(target))
+    with warned_lock:
+        if devices in warned_devices:
+            return
+        warned_devices.add(devices)
+    logger.warning(f"Folder {source} is copied to {target}, as the folders are on different filesystems")
+    monitor.send_event(monitor.h_events.PROCESSING, monitor.severity.WARNING,
+                       f"Series are copied between different filesystems ({source} -> {target}). Performance is reduced")
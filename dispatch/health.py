@@ -0,0 +1,100 @@
+"""
+health.py
+=========
+Circuit breaker that tracks the health of the targets, so that transfers to unreachable targets
+are paused instead of failing one by one after the connection timeout.
+"""
+import threading
+import time
+
+import daiquiri
+
+from common.monitor import send_event, h_events, severity
+
+
+logger = daiquiri.getLogger("health")
+
+# Exit codes of dcmsend that indicate that the target cannot be reached (instead of a problem with the series)
+CONNECTION_ERROR_CODES = [61, 62]
+
+
+class TargetHealth:
+    """Tracks the consecutive connection failures of every target. After FAILURE_THRESHOLD failures, the
+       circuit of the target opens and no transfers are started until the open time has passed. Then, a
+       single transfer is allowed as probe. If the probe succeeds, the circuit closes again. Otherwise, it 
+       opens again with doubled open time (up to MAX_OPEN_TIME)."""
+    FAILURE_THRESHOLD = 3
+    OPEN_TIME         = 30  # in seconds
+    MAX_OPEN_TIME     = 900 # in seconds
+    PROBE_TIMEOUT     = 300 # in seconds
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.targets = {}
+
+    def _get_state(self, target_key):
+        return self.targets.setdefault(target_key, { "failures": 0, "open_time": 0, "open_until": 0, "probe_started": None })
+
+    def is_open(self, target_key):
+        """Checks if the circuit of the target is open, i.e. if transfers to the target are paused."""
+        with self.lock:
+            state = self.targets.get(target_key)
+            return bool(state) and state["failures"] >= self.FAILURE_THRESHOLD
+
+    def allow(self, target_key, now=None):
+        """Checks if a transfer to the target can be started. If the open time of the circuit has passed, 
+           the transfer is allowed as probe and further transfers are held back until the probe has finished."""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            state = self.targets.get(target_key)
+            if not state or state["failures"] < self.FAILURE_THRESHOLD:
+                return True
+            if now < state["open_until"]:
+                return False
+            # The probe timeout ensures that the circuit does not remain blocked if the probe was not executed
+            if state["probe_started"] is not None and now < state["probe_started"] + self.PROBE_TIMEOUT:
+                return False
+            state["probe_started"] = now
+            return True
+
+    def release(self, target_key):
+        """Releases the probe granted by allow() if the transfer has not been started (e.g., because it has
+           been held back by the throttle), so that the next transfer can be used as probe."""
+        with self.lock:
+            state = self.targets.get(target_key)
+            if state:
+                state["probe_started"] = None
+
+    def record_success(self, target_key):
+        """Closes the circuit after a successful transfer to the target."""
+        with self.lock:
+            state = self.targets.pop(target_key, None)
+        if state and state["failures"] >= self.FAILURE_THRESHOLD:
+            logger.info(f"Target {target_key} is reachable again")
+            send_event(h_events.PROCESSING, severity.INFO, f"Resuming transfers to target {target_key}")
+
+    def record_failure(self, target_key, exit_code, now=None):
+        """Registers a failed transfer to the target. Only failures that indicate a connection problem count."""
+        if exit_code not in CONNECTION_ERROR_CODES:
+            return
+        if now is None:
+            now = time.time()
+        with self.lock:
+            state = self._get_state(target_key)
+            state["failures"] += 1
+            if state["failures"] < self.FAILURE_THRESHOLD:
+                return
+            if state["open_time"]:
+                state["open_time"] = min(state["open_time"] * 2, self.MAX_OPEN_TIME)
+            else:
+                state["open_time"] = self.OPEN_TIME
+            state["open_until"] = now + state["open_time"]
+            state["probe_started"] = None
+            open_time = state["open_time"]
+        logger.warning(f"Target {target_key} is unreachable. Pausing transfers for {open_time} sec")
+        send_event(h_events.PROCESSING, severity.WARNING, f"Target {target_key} unreachable. Pausing transfers for {open_time} sec")
+
+
+# Shared health state of all targets of the dispatcher instance
+target_health = TargetHealth()
@@ -0,0 +1,76 @@
+"""
+pool.py
+=======
+Pool of worker threads for sending multiple series in parallel. The actual transfer is done by
+the dcmsend process, so that the worker threads mainly wait for the subprocesses to finish.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import daiquiri
+
+
+logger = daiquiri.getLogger("pool")
+
+
+class DispatchPool:
+    """Runs the transfers of outgoing folders in a pool of worker threads. Each transfer can consist of 
+       multiple folders that are sent to the same target. The number of transfers that
+       run in parallel is limited overall (max_workers) and for every target (max_per_target), so that a
+       target never receives more parallel associations than configured. Slow or unreachable targets
+       therefore only block their own transfers, while the other targets are served in parallel."""
+    def __init__(self, max_workers, max_per_target):
+        self.max_workers = max_workers
+        self.max_per_target = max_per_target
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.active = {}
+        self.jobs = 0
+        self.target_counts = {}
+
+    def is_active(self, folder):
+        """Checks if the given folder is currently being sent."""
+        with self.lock:
+            return str(folder) in self.active
+
+    def is_full(self):
+        """Checks if all workers are busy."""
+        with self.lock:
+            return self.jobs >= self.max_workers
+
+    def can_submit(self, target_key):
+        """Checks if another transfer can be started for the given target."""
+        with self.lock:
+            return (self.jobs < self.max_workers
+                    and self.target_counts.get(target_key, 0) < self.max_per_target)
+
+    def submit(self, folders, target_key, function, *args):
+        """Starts the function for the given list of folders in the pool. Returns False if one of the folders
+           is already active or if the limits for the pool or the target have been reached."""
+        folders = [str(folder) for folder in folders]
+        with self.lock:
+            if (any(folder in self.active for folder in folders) or self.jobs >= self.max_workers
+                    or self.target_counts.get(target_key, 0) >= self.max_per_target):
+                return False
+            for folder in folders:
+                self.active[folder] = target_key
+            self.jobs += 1
+            self.target_counts[target_key] = self.target_counts.get(target_key, 0) + 1
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda f: self._finished(folders, target_key, f))
+        return True
+
+    def _finished(self, folders, target_key, future):
+        with self.lock:
+            for folder in folders:
+                del self.active[folder]
+            self.jobs -= 1
+            self.target_counts[target_key] -= 1
+            if not self.target_counts[target_key]:
+                del self.target_counts[target_key]
+        if future.exception():
+            logger.error(f"Error while sending folders {folders}: {future.exception()}")
+
+    def shutdown(self):
+        """Waits until all active transfers have been completed."""
+        self.executor.shutdown(wait=True)
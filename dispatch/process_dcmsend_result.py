@@ -1,55 +1,118 @@
 import argparse
 import json
+import os
+import re
 import sys
 import logging
 from pathlib import Path
 import daiquiri
 
-daiquiri.setup(level=logging.INFO)
 logger = daiquiri.getLogger("process_dcmsend_result")
 
+# Status of the individual files listed in the transfer list of the report
+FILE_SUCCESS  = "SUCCESS"
+FILE_WARNING  = "WARNING"
+FILE_ERROR    = "ERROR"
+FILE_NOT_SENT = "NOT_SENT"
 
-def _parse_header(header):
-    result = {}
-    for line in header:
-        if line.startswith("Communication Peer"):
-            result["communication_peer"] = line.split(":")[1].strip()
-        elif line.startswith("AE Titles used"):
-            result["ae_titles_used"] = line.split(":")[1].strip()
-        elif line.startswith("Current Date/Time"):
-            result["current_datetime"] = line.split(":", 1)[1].strip()
-    return result
-
-
-def _parse_summary(summary):
-    result = {}
-    for line in summary:
-        if line.startswith("Number of SOP instances"):
-            result["sop_instances"] = int(line.split(":")[1])
-        elif line.startswith("- sent to the peer"):
-            result["sent_to_peer"] = int(line.split(":")[1])
-        elif line.startswith("  * with status SUCCESS"):
-            result["successfull"] = int(line.split(":")[1])
-        elif line.startswith("  * with status SUCCESS"):
-            result["error"] = int(line.split(":")[1])
-    return result
+file_pattern = re.compile(r"(\S+\.dcm)\b")
 
+# Keys of the header and summary entries of the report
+HEADER_KEYS = {
+    "Communication Peer": "communication_peer",
+    "AE Titles used":     "ae_titles_used",
+    "Current Date/Time":  "current_datetime",
+}
+SUMMARY_KEYS = {
+    "Number of associations":   "associations",
+    "Number of pres. contexts": "presentation_contexts",
+    "Number of SOP instances":  "sop_instances",
+    "- sent to the peer":       "sent_to_peer",
+    "* with status SUCCESS":    "successfull",
+    "* with status WARNING":    "warning",
+    "* with status ERROR":      "error",
+    "- not sent to the peer":   "not_sent",
+}
+
+
+class TransferReport:
+    """Content of a dcmsend result file: the header entries, the numbers of the status summary and the 
+       status of the individual files (with the normalized file path as key)."""
+    def __init__(self):
+        self.header = {}
+        self.summary = {}
+        self.file_status = {}
+
+    def to_dict(self):
+        return { "header": self.header, "summary": self.summary, "files": self.file_status }
+
+
+def _get_file_status(text):
+    """Determines the status of a file from the text of its entry in the transfer list."""
+    text = text.lower()
+    if "not sent" in text:
+        return FILE_NOT_SENT
+    if "error" in text or "fail" in text:
+        return FILE_ERROR
+    if "warning" in text:
+        return FILE_WARNING
+    if "success" in text:
+        return FILE_SUCCESS
+    return None
 
-def parse(result_file):
-    """Parses the dcmsend result file and returns a python dictionary."""
-    with result_file.open() as f:
-        content = f.readlines()
 
-    result = {}
-    for index, element in enumerate(content):
-        if element.startswith("Status Summary"):
-            summary_start = index
+def _split_entry(line, keys):
+    """Returns the key and value if the line is one of the given "label : value" entries."""
+    label, separator, value = line.partition(":")
+    if not separator:
+        return None, None
+    return keys.get(label.strip()), value.strip()
 
-    result["summary"] = _parse_summary(content[summary_start:])
-    # Just take the first 8 lines of the result file,
-    # optimistic guessing length of the header
-    result["header"] = _parse_header(content[:8])
-    return result
+
+def parse_report(result_file):
+    """Reads the dcmsend result file line by line, so that reports of large series do not need to be 
+       loaded completely. The status of a file is taken from the line containing the filename and the 
+       following lines until the next file is listed. Everything after the line "Status Summary" belongs
+       to the summary."""
+    report = TransferReport()
+    current_file = None
+    in_summary = False
+    with Path(result_file).open() as f:
+        for line in f:
+            if line.startswith("Status Summary"):
+                in_summary = True
+                current_file = None
+                continue
+            if in_summary:
+                key, value = _split_entry(line, SUMMARY_KEYS)
+                if key:
+                    try:
+                        report.summary[key] = int(value)
+                    except ValueError:
+                        pass
+                continue
+            match = file_pattern.search(line)
+            if match:
+                current_file = os.path.normpath(match.group(1))
+                report.file_status[current_file] = _get_file_status(line[match.end():])
+            elif current_file:
+                if not report.file_status[current_file]:
+                    report.file_status[current_file] = _get_file_status(line)
+            else:
+                key, value = _split_entry(line, HEADER_KEYS)
+                if key:
+                    report.header[key] = value
+    return report
+
+
+def parse_transfer_list(result_file):
+    """Returns the status of the individual files from the dcmsend result file."""
+    return parse_report(result_file).file_status
+
+
+def parse(result_file):
+    """Parses the dcmsend result file and returns a python dictionary."""
+    return parse_report(result_file).to_dict()
 
 
 def create_arg_parser():
@@ -62,6 +125,7 @@ def create_arg_parser():
 
 
 if __name__ == "__main__":
+    daiquiri.setup(level=logging.INFO)
     arg_parser = create_arg_parser()
     parsed_args = arg_parser.parse_args(sys.argv[1:])
     result_file = parsed_args.resultFile
@@ -1,13 +1,24 @@
+import heapq
 import json
+import os
+import threading
 import time
 from pathlib import Path
 
+import daiquiri
+
 from common.constants import mercure_names
 
 
+logger = daiquiri.getLogger("retry")
+
+# Upper limit for the delay between two retries
+MAX_RETRY_DELAY = 86400 # in seconds
+
+
 def increase_retry(source_folder, retry_max, retry_delay):
     """ Increases the retries counter and set the wait counter to a new time
-    in the future.
+    in the future. The delay doubles with every retry (exponential backoff).
     :return True if increase has been successful or False if maximum retries
     has been reached
     """
@@ -19,7 +30,8 @@ def increase_retry(source_folder, retry_max, retry_delay):
         target_json["dispatch"]={}    
 
     target_json["dispatch"]["retries"] = target_json.get("dispatch",{}).get("retries", 0) + 1
-    target_json["dispatch"]["next_retry_at"] = time.time() + retry_delay
+    delay = min(retry_delay * 2 ** (target_json["dispatch"]["retries"] - 1), MAX_RETRY_DELAY)
+    target_json["dispatch"]["next_retry_at"] = time.time() + delay
 
     if target_json["dispatch"]["retries"] >= retry_max:
         return False
@@ -27,3 +39,66 @@ def increase_retry(source_folder, retry_max, retry_delay):
     with open(target_json_path, "w") as file:
         json.dump(target_json, file)
     return True
+
+
+class RetryQueue:
+    """Folders of the outgoing folder that are waiting for the next retry, kept in a heap ordered by the
+       retry time. Waiting folders can be skipped by the dispatcher without reading their task files, until
+       the retry time has passed. The queue is stored in a small state file (if given), so that the waiting
+       folders do not need to be parsed again after a restart."""
+    def __init__(self, state_file=None):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.heap = []
+        self.retry_at = {}
+        self.load()
+
+    def add(self, folder_name, next_retry_at):
+        """Places the folder into the queue until the given retry time."""
+        with self.lock:
+            self.retry_at[folder_name] = next_retry_at
+            heapq.heappush(self.heap, (next_retry_at, folder_name))
+            self.save()
+
+    def is_waiting(self, folder_name):
+        """Checks if the folder is waiting for the next retry."""
+        return folder_name in self.retry_at
+
+    def release_due(self, now=None):
+        """Removes all folders from the queue whose retry time has passed. Returns the names of the folders."""
+        if now is None:
+            now = time.time()
+        released = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                next_retry_at, folder_name = heapq.heappop(self.heap)
+                # Entries of folders that have been added again with a different time are outdated
+                if self.retry_at.get(folder_name) == next_retry_at:
+                    del self.retry_at[folder_name]
+                    released.append(folder_name)
+            if released:
+                self.save()
+        return released
+
+    def load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r") as f:
+                self.retry_at = json.load(f)
+        except Exception:
+            logger.exception(f"Unable to read retry queue {self.state_file}")
+            self.retry_at = {}
+        self.heap = [(self.retry_at[folder_name], folder_name) for folder_name in self.retry_at]
+        heapq.heapify(self.heap)
+
+    def save(self):
+        if not self.state_file:
+            return
+        try:
+            temp_file = self.state_file + ".tmp"
+            with open(temp_file, "w") as f:
+                json.dump(self.retry_at, f)
+            os.replace(temp_file, self.state_file)
+        except Exception:
+            logger.exception(f"Unable to write retry queue {self.state_file}")
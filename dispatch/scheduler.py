@@ -0,0 +1,57 @@
+"""
+scheduler.py
+============
+Determines the order in which the series of the outgoing folder are dispatched.
+"""
+import os
+import time
+from datetime import datetime
+
+import common.helper as helper
+from common.constants import mercure_options
+
+
+# Number of aging periods by which the series of each priority class are moved backward in the queue
+# (urgent series are always sent first and are not aged)
+PRIORITY_DELAY = {
+    mercure_options.NORMAL:   0,
+    mercure_options.OFFPEAK:  1,
+}
+
+
+def get_queue_time(folder, target_info):
+    """Returns the time when the series has been placed into the queue. For task files created by earlier
+       versions, the modification time of the folder is used instead."""
+    if "queued_at" in target_info:
+        return target_info["queued_at"]
+    try:
+        return os.stat(folder).st_mtime
+    except OSError:
+        return time.time()
+
+
+def order_folders(candidates, aging_time, offpeak_start, offpeak_end, now=None):
+    """Returns the list of ready folders (tuples of folder and dispatch information) in the order in which
+       they should be sent. Urgent series are always sent first, in the order of their arrival. The other
+       series are sorted by a virtual queue time, which is the time when the series was queued, moved backward 
+       by the aging time for off-peak series. Thus, normal series are sent before all off-peak series that have
+       arrived within the aging time, but off-peak series cannot starve, as they will be sent first once they 
+       have waited long enough. Off-peak series are only sent during the configured off-peak window."""
+    if now is None:
+        now = time.time()
+    is_offpeak = helper.is_offpeak(offpeak_start, offpeak_end, datetime.fromtimestamp(now).time())
+
+    queue = []
+    for folder, target_info in candidates:
+        priority = target_info.get("priority", mercure_options.NORMAL)
+        if priority == mercure_options.OFFPEAK and not is_offpeak:
+            continue
+        queue_time = get_queue_time(folder, target_info)
+        if priority == mercure_options.URGENT:
+            queue.append((0, queue_time, str(folder), folder, target_info))
+        else:
+            virtual_time = queue_time + PRIORITY_DELAY.get(priority, 0) * aging_time
+            queue.append((1, virtual_time, str(folder), folder, target_info))
+
+    queue.sort(key=lambda item: item[:3])
+    return [(folder, target_info) for _, _, _, folder, target_info in queue]
@@ -4,18 +4,22 @@ send.py
 The functions for sending DICOM series
 to target destinations.
 """
+import os
 import shutil
 import time
 from datetime import datetime
 from pathlib import Path
-from shlex import split
+from shlex import split, quote
 from subprocess import CalledProcessError, run
 
 import daiquiri
 
+import common.storage as storage
 from common.monitor import s_events, send_series_event, send_event, h_events, severity
 from dispatch.retry import increase_retry
-from dispatch.status import is_ready_for_sending
+from dispatch.status import is_ready_for_sending, get_target_key
+from dispatch.health import target_health
+from dispatch.process_dcmsend_result import parse_report, FILE_SUCCESS, FILE_WARNING, FILE_ERROR, FILE_NOT_SENT
 from common.constants import mercure_names
 
 
@@ -34,18 +38,19 @@ DCMSEND_ERROR_CODES = {
 }
 
 
-def _create_command(target_info, folder):
-    """Composes the command for calling the dcmsend tool from DCMTK, which is used for sending out the DICOMS."""
-    target_ip         = target_info.get("dispatch",{}).get("target_ip","")
-    target_port       = target_info.get("dispatch",{}).get("target_port","")
-    target_aet_target = target_info.get("dispatch",{}).get("target_aet_target","")
-    target_aet_source = target_info.get("dispatch",{}).get("target_aet_source","")
-    
-    dcmsend_status_file = Path(folder) / mercure_names.SENDLOG
+def _create_command(target_info, folders, report_file):
+    """Composes the command for calling the dcmsend tool from DCMTK, which is used for sending out the DICOMS.
+       All given folders are sent using the same association."""
+    target_ip         = target_info.get("target_ip","")
+    target_port       = target_info.get("target_port","")
+    target_aet_target = target_info.get("target_aet_target","")
+    target_aet_source = target_info.get("target_aet_source","")
+
+    folder_list = " ".join(quote(str(folder)) for folder in folders)
 
-    command = f"""dcmsend {target_ip} {target_port} +sd {folder}
+    command = f"""dcmsend {target_ip} {target_port} +sd {folder_list}
             -aet {target_aet_source} -aec {target_aet_target} -nuc
-            +sp '*.dcm' -to 60 +crf {dcmsend_status_file}"""
+            +sp '*.dcm' -to 60 +crf {quote(str(report_file))}"""
     
     return command
 
@@ -56,74 +61,277 @@ def execute(
     error_folder: Path,
     retry_max,
     retry_delay,
+    target_info=None,
 ):
     """
     Execute the dcmsend command. It will create a .sending file to indicate that
     the folder is being sent. This is to prevent double sending. If there
     happens any error the .lock file is deleted and an .error file is created.
-    Folder with .error files are _not_ ready for sending.
+    Folder with .error files are _not_ ready for sending. If the caller has 
+    already checked the folder, the dispatch information can be passed as
+    target_info, so that the folder does not need to be checked again.
     """
-    target_info = is_ready_for_sending(source_folder)
-    delay = target_info.get("next_retry_at", 0)
+    if target_info is None:
+        target_info = is_ready_for_sending(source_folder)
+
+    if target_info and time.time() >= target_info.get("next_retry_at", 0):
+        execute_batch([(Path(source_folder), target_info)], success_folder, error_folder, retry_max, retry_delay)
+    else:
+        pass
+        #logger.warning(f"Folder {source_folder} is *not* ready for sending")
 
-    if target_info and time.time() >= delay:
-        logger.info(f"Folder {source_folder} is ready for sending")
 
-        series_uid=target_info.get("series_uid", "series_uid-missing") 
-        target_name=target_info.get("target_name", "target_name-missing")
+class SendResult:
+    """Outcome of a transfer. The error code is None if the transfer could be executed, otherwise it contains
+       the exit code of dcmsend (or the corresponding code for other senders). The file status contains the 
+       status of the individual files, as far as known, with the normalized file path as key. The summary
+       contains the numbers of the status summary of the report (e.g., "error" and "not_sent")."""
+    def __init__(self, error_code=None, error_message=None, file_status=None, summary=None):
+        self.error_code = error_code
+        self.error_message = error_message
+        self.file_status = file_status or {}
+        self.summary = summary or {}
 
-        if (series_uid=="series_uid-missing") or (target_name=="target_name-missing"):
-            send_event(h_events.PROCESSING, severity.WARNING, f"Missing information for folder {source_folder}")    
 
-        # Create a .sending file to indicate that this folder is being sent,
-        # otherwise the dispatcher would pick it up again if the transfer is
-        # still going on
-        lock_file = Path(source_folder) / mercure_names.PROCESSING
-        try:
-            lock_file.touch()            
-        except:
-            send_event(h_events.PROCESSING, severity.ERROR, f"Error sending {series_uid} to {target_name}")
-            send_series_event(s_events.ERROR, series_uid, 0, target_name, "Unable to create lock file")
-            logger.exception(f"Unable to create lock file {lock_file.name}")            
-            return
-
-        command = _create_command(target_info, source_folder)
+class DcmsendSender:
+    """Sends the folders by calling the dcmsend tool from DCMTK. As dcmsend cannot limit the data rate, the
+       bandwidth limit is only enforced between the transfers (by the dispatcher)."""
+    def send(self, target_info, folders, report_file, bandwidth_limit=None):
+        command = _create_command(target_info, folders, report_file)
         logger.debug(f"Running command {command}")
         try:
             run(split(command), check=True)
-            logger.info(
-                f"Folder {source_folder} successfully sent, moving to {success_folder}"
-            )
-            # Send bookkeeper notification
-            file_count = len(list(Path(source_folder).glob(mercure_names.DCMFILTER)))
-            send_series_event(
-                s_events.DISPATCH,
-                target_info.get("series_uid", "series_uid-missing"),
-                file_count,
-                target_info.get("target_name", "target_name-missing"),
-                "",
-            )
-            _move_sent_directory(source_folder, success_folder)
-            send_series_event(s_events.MOVE, series_uid, 0, success_folder, "")
         except CalledProcessError as e:
             dcmsend_error_message = DCMSEND_ERROR_CODES.get(e.returncode, None)
             logger.exception(
                 f"Failed command:\n {command} \nbecause of {dcmsend_error_message}"
             )
-            send_event(h_events.PROCESSING, severity.ERROR, f"Error sending {series_uid} to {target_name}")
-            send_series_event(s_events.ERROR, series_uid, 0, target_name, dcmsend_error_message)
-            retry_increased = increase_retry(source_folder, retry_max, retry_delay)
-            if retry_increased:
-                lock_file.unlink()
+            # If the transfer has been aborted, the report still lists the files that have been sent
+            if report_file.exists():
+                report = parse_report(report_file)
+                return SendResult(e.returncode, dcmsend_error_message, report.file_status, report.summary)
+            return SendResult(e.returncode, dcmsend_error_message)
+
+        if report_file.exists():
+            report = parse_report(report_file)
+            return SendResult(file_status=report.file_status, summary=report.summary)
+        return SendResult()
+
+    def close(self):
+        pass
+
+
+# Instances of the senders, which are created on first use (so that the pynetdicom 
+# library is only needed if the native sender is selected)
+senders = {}
+
+
+def get_sender(name):
+    """Returns the sender with the given name ("dcmsend" or "pynetdicom")."""
+    if name not in senders:
+        if name == "pynetdicom":
+            from dispatch.store_scu import StoreSCUSender
+            senders[name] = StoreSCUSender()
+        else:
+            senders[name] = DcmsendSender()
+    return senders[name]
+
+
+def close_senders():
+    """Releases the resources of all senders, e.g. open associations."""
+    for name in senders:
+        senders[name].close()
+
+
+def execute_batch(folders, success_folder: Path, error_folder: Path, retry_max, retry_delay, sender_name="dcmsend",
+                  bandwidth_limit=None):
+    """
+    Sends multiple folders with the same target (given as list of tuples of folder and dispatch
+    information) with one transfer, so that only one association is needed. The success of 
+    the individual folders is determined from the status of the individual files reported by 
+    the sender. Folders with files that could not be sent are retried later. The bandwidth limit
+    (in MB/s) is passed to the sender. Files that have
+    already been sent are moved into a subfolder, so that the retry only sends the remaining files.
+    """
+    locked_folders = []
+    for folder, folder_info in folders:
+        if not _lock_folder(folder, folder_info):
+            continue
+        # If a failed transfer has sent all files of the folder, nothing remains to be sent
+        if _is_completed(folder):
+            _handle_success(folder, folder_info, None, success_folder)
+        else:
+            locked_folders.append((folder, folder_info))
+    if not locked_folders:
+        return
+
+    first_folder, target_info = locked_folders[0]
+    target_key = get_target_key(target_info)
+    for folder, _ in locked_folders:
+        logger.info(f"Folder {folder} is ready for sending")
+
+    # The report is written into the outgoing folder and linked into the sent folders afterwards
+    report_file = first_folder.parent / ("." + first_folder.name + "_" + mercure_names.SENDLOG)
+    result = get_sender(sender_name).send(target_info, [folder for folder, _ in locked_folders], report_file, bandwidth_limit)
+
+    if result.error_code is not None:
+        target_health.record_failure(target_key, result.error_code)
+        for folder, folder_info in locked_folders:
+            if _keep_sent_files(folder, result.file_status):
+                _handle_success(folder, folder_info, report_file, success_folder)
             else:
-                logger.info(f"Max retries reached, moving to {error_folder}")
-                send_series_event(s_events.SUSPEND, series_uid, 0, target_name, "Max retries reached")
-                _move_sent_directory(source_folder, error_folder)
-                send_series_event(s_events.MOVE, series_uid, 0, error_folder, "")
-                send_event(h_events.PROCESSING, severity.ERROR, f"Series suspended after reaching max retries")
+                _handle_failure(folder, folder_info, result.error_message, error_folder, retry_max, retry_delay)
+        _remove_report(report_file)
+        return
+
+    target_health.record_success(target_key)
+
+    # Files are only considered as failed if listed as failed in the report, so that reports without 
+    # transfer list are treated as complete success. However, if the summary of the report counts failed 
+    # files that are not listed, all files without confirmed transfer are considered as failed
+    unlisted_failures = ((result.summary.get("error", 0) + result.summary.get("not_sent", 0)) > 0
+                         and not any(status in (FILE_ERROR, FILE_NOT_SENT) for status in result.file_status.values()))
+
+    # The report is grouped by folder, so that the folders do not need to be scanned
+    folder_status = {}
+    for name, status in result.file_status.items():
+        folder_status.setdefault(os.path.dirname(name), []).append(status)
+
+    for folder, folder_info in locked_folders:
+        statuses = folder_status.get(os.path.normpath(str(folder)), [])
+        sent = sum(1 for status in statuses if status in (FILE_SUCCESS, FILE_WARNING))
+        if unlisted_failures:
+            failed = len(list(folder.glob(mercure_names.DCMFILTER))) - sent
+        else:
+            failed = sum(1 for status in statuses if status in (FILE_ERROR, FILE_NOT_SENT))
+        if failed > 0 and not _keep_sent_files(folder, result.file_status):
+            _handle_failure(folder, folder_info, f"{failed} files not sent", 
+                            error_folder, retry_max, retry_delay, sent)
+        else:
+            _handle_success(folder, folder_info, report_file, success_folder)
+
+    _remove_report(report_file)
+
+
+def _lock_folder(folder, target_info):
+    """Creates a .processing file to indicate that this folder is being sent, otherwise the 
+       dispatcher would pick it up again if the transfer is still going on."""
+    series_uid=target_info.get("series_uid", "series_uid-missing") 
+    target_name=target_info.get("target_name", "target_name-missing")
+
+    if (series_uid=="series_uid-missing") or (target_name=="target_name-missing"):
+        send_event(h_events.PROCESSING, severity.WARNING, f"Missing information for folder {folder}")    
+
+    lock_file = Path(folder) / mercure_names.PROCESSING
+    try:
+        lock_file.touch()            
+    except:
+        send_event(h_events.PROCESSING, severity.ERROR, f"Error sending {series_uid} to {target_name}")
+        send_series_event(s_events.ERROR, series_uid, 0, target_name, "Unable to create lock file")
+        logger.exception(f"Unable to create lock file {lock_file.name}")            
+        return False
+    return True
+
+
+def _handle_success(folder, target_info, report_file, success_folder):
+    """Notifies the bookkeeper about the sent series and moves the folder into the success folder. The 
+       number of files is taken from the file manifest, if available. The report is placed into the 
+       folder, if given."""
+    series_uid=target_info.get("series_uid", "series_uid-missing") 
+    _restore_sent_files(folder)
+    file_count = target_info.get("file_count")
+    if file_count is None:
+        file_count = len(list(folder.glob(mercure_names.DCMFILTER)))
+    logger.info(
+        f"Folder {folder} successfully sent, moving to {success_folder}"
+    )
+    if report_file and report_file.exists():
+        _link_report(report_file, folder / mercure_names.SENDLOG)
+    # Send bookkeeper notification
+    send_series_event(
+        s_events.DISPATCH,
+        series_uid,
+        file_count,
+        target_info.get("target_name", "target_name-missing"),
+        "",
+    )
+    _move_sent_directory(folder, success_folder)
+    send_series_event(s_events.MOVE, series_uid, 0, success_folder, "")
+
+
+def _handle_failure(folder, target_info, error_message, error_folder, retry_max, retry_delay, file_count=0):
+    """Schedules the next retry for the folder or moves it to the error folder if the maximum 
+       number of retries has been reached. The file count is the number of files that have been
+       sent successfully by the failed transfer."""
+    series_uid=target_info.get("series_uid", "series_uid-missing") 
+    target_name=target_info.get("target_name", "target_name-missing")
+    send_event(h_events.PROCESSING, severity.ERROR, f"Error sending {series_uid} to {target_name}")
+    send_series_event(s_events.ERROR, series_uid, file_count, target_name, error_message)
+    retry_increased = increase_retry(folder, retry_max, retry_delay)
+    if retry_increased:
+        (Path(folder) / mercure_names.PROCESSING).unlink()
     else:
+        logger.info(f"Max retries reached, moving to {error_folder}")
+        _restore_sent_files(folder)
+        send_series_event(s_events.SUSPEND, series_uid, 0, target_name, "Max retries reached")
+        _move_sent_directory(folder, error_folder)
+        send_series_event(s_events.MOVE, series_uid, 0, error_folder, "")
+        send_event(h_events.PROCESSING, severity.ERROR, f"Series suspended after reaching max retries")
+
+
+def _keep_sent_files(folder, file_status):
+    """Moves the files that have been sent successfully by a failed transfer into the subfolder for
+       sent files, so that they are not sent again with the next retry. Returns True if all files of
+       the folder have been sent."""
+    sent_folder = folder / mercure_names.SENT
+    for f in folder.glob(mercure_names.DCMFILTER):
+        if file_status.get(os.path.normpath(str(f))) in (FILE_SUCCESS, FILE_WARNING):
+            try:
+                sent_folder.mkdir(exist_ok=True)
+                os.rename(f, sent_folder / f.name)
+            except OSError:
+                logger.warning(f"Unable to keep track of sent file {f}")
+    return _is_completed(folder)
+
+
+def _is_completed(folder):
+    """Checks if all files of the folder have been sent by earlier transfers."""
+    return (folder / mercure_names.SENT).exists() and not any(folder.glob(mercure_names.DCMFILTER))
+
+
+def _restore_sent_files(folder):
+    """Moves the files sent by earlier transfers back into the folder. Returns the number of files."""
+    sent_folder = folder / mercure_names.SENT
+    if not sent_folder.exists():
+        return 0
+    count = 0
+    for f in sent_folder.glob(mercure_names.DCMFILTER):
+        try:
+            os.rename(f, folder / f.name)
+            count += 1
+        except OSError:
+            logger.warning(f"Unable to restore sent file {f}")
+    try:
+        sent_folder.rmdir()
+    except OSError:
+        pass
+    return count
+
+
+def _link_report(report_file, target_file):
+    """Places the report of dcmsend into the sent folder. A hard link is used if possible, so that the 
+       report of a batch does not need to be copied into every folder."""
+    try:
+        storage.link_or_copy(report_file, target_file)
+    except OSError:
+        logger.warning(f"Unable to store report {report_file} in {target_file}")
+
+
+def _remove_report(report_file):
+    try:
+        report_file.unlink()
+    except OSError:
         pass
-        #logger.warning(f"Folder {source_folder} is *not* ready for sending")
 
 
 def _move_sent_directory(source_folder, destination_folder):
@@ -138,13 +346,13 @@ def _move_sent_directory(source_folder, destination_folder):
                 source_folder.name + "_" + datetime.now().isoformat()
             )
             logger.debug(f"Moving {source_folder} to {target_folder}")
-            shutil.move(source_folder, target_folder, copy_function=shutil.copy2)
+            storage.move_folder(source_folder, target_folder)
             (Path(target_folder) / mercure_names.PROCESSING).unlink()
         else:
             logger.debug(
                 f"Moving {source_folder} to {destination_folder / source_folder.name}"
             )
-            shutil.move(source_folder, destination_folder / source_folder.name)
+            storage.move_folder(source_folder, destination_folder / source_folder.name)
             (destination_folder / source_folder.name / mercure_names.PROCESSING).unlink()
     except:
         logger.info(f"Error moving folder {source_folder} to {destination_folder}")        
@@ -1,8 +1,9 @@
 import json
 from pathlib import Path
 
+import common.helper as helper
 from common.monitor import s_events, send_series_event
-from common.constants import mercure_names
+from common.constants import mercure_names, mercure_sections
 
 
 def is_ready_for_sending(folder):
@@ -11,19 +12,26 @@ def is_ready_for_sending(folder):
     No lock file (.lock) should be in sending folder and no error file (.error),
     if there is one copy/move is not done yet. Also at least some dicom files
     should be there for sending. Also checks for a task.json file and if it is
-    valid.
+    valid. If the task file contains a file manifest, the number of files and
+    their size are added to the returned dispatch information as file_count
+    and file_size.
     """
     path = Path(folder)
-    folder_status = (
-        not (path / mercure_names.LOCK).exists()
-        and not (path / mercure_names.ERROR).exists()
-        and not (path / mercure_names.PROCESSING).exists()
-        and len(list(path.glob(mercure_names.DCMFILTER))) > 0
-    )
-    content = is_target_json_valid(folder)
-    if folder_status and content:
-        return content
-    return False
+    if ((path / mercure_names.LOCK).exists()
+        or (path / mercure_names.ERROR).exists()
+        or (path / mercure_names.PROCESSING).exists()):
+        return False
+    task = read_task(folder)
+    content = get_dispatch_info(task)
+    if not content:
+        return False
+    # Files that have been sent by an earlier, failed transfer are kept in a subfolder
+    if helper.get_file_count(folder, task) == 0 and not (path / mercure_names.SENT).exists():
+        return False
+    if "count" in task.get(mercure_sections.FILES, {}):
+        content["file_count"] = task[mercure_sections.FILES]["count"]
+        content["file_size"]  = task[mercure_sections.FILES].get("size", 0)
+    return content
 
 
 def has_been_send(folder):
@@ -37,12 +45,23 @@ def is_target_json_valid(folder):
     subkeys are target_ip, target_port and target_aet_target under the
     dispatch key
     """
+    return get_dispatch_info(read_task(folder))
+
+
+def read_task(folder):
+    """Returns the content of the task.json file of the folder, or None if the folder has no task file."""
     path = Path(folder) / mercure_names.TASKFILE
     if not path.exists():
         return None
 
     with open(path, "r") as f:
-        target = json.load(f)
+        return json.load(f)
+
+
+def get_dispatch_info(target):
+    """Returns the dispatch section of the task, or None if mandatory keys are missing."""
+    if target is None:
+        return None
 
     if not all(
         [key in target.get("dispatch",{}) for key in ["target_ip", "target_port", "target_aet_target"]]
@@ -56,3 +75,15 @@ def is_target_json_valid(folder):
         )
         return None
     return target["dispatch"]
+
+
+def get_target_key(target_info):
+    """Returns the key that identifies the target of the transfer (e.g., for limiting parallel transfers)."""
+    if target_info.get("target_name"):
+        return target_info["target_name"]
+    return f'{target_info.get("target_ip","")}:{target_info.get("target_port","")}'
+
+
+def get_connection_key(target_info):
+    """Returns the connection settings of the transfer. Folders with identical settings can be sent together."""
+    return tuple(str(target_info.get(key,"")) for key in ["target_ip", "target_port", "target_aet_target", "target_aet_source"])
@@ -0,0 +1,188 @@
+"""
+store_scu.py
+============
+Native DICOM sender based on pynetdicom, which can be used instead of dcmsend. The sender runs inside
+the dispatcher process and keeps the associations to the targets open, so that subsequent transfers
+do not need to start a process and negotiate a new association.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+import daiquiri
+from pydicom import dcmread
+from pydicom.filereader import read_file_meta_info
+from pynetdicom import AE, build_context
+
+from common.constants import mercure_names
+from dispatch.process_dcmsend_result import FILE_SUCCESS, FILE_WARNING, FILE_ERROR, FILE_NOT_SENT
+from dispatch.send import SendResult, DCMSEND_ERROR_CODES
+from dispatch.status import get_connection_key
+
+
+logger = daiquiri.getLogger("store_scu")
+
+# Error codes of dcmsend that are reported for the corresponding problems, so that the retry
+# and health handling does not depend on the used sender
+EXITCODE_CANNOT_NEGOTIATE_ASSOCIATION = 61
+EXITCODE_CANNOT_SEND_REQUEST          = 62
+
+# Maximum number of presentation contexts that can be proposed for one association
+MAX_CONTEXTS = 128
+
+
+def get_status_category(status):
+    """Maps the DIMSE status of a C-STORE response to the status of the file."""
+    if status is None or "Status" not in status:
+        return FILE_ERROR
+    code = status.Status
+    if code == 0x0000:
+        return FILE_SUCCESS
+    if code == 0x0001 or 0xB000 <= code <= 0xBFFF:
+        return FILE_WARNING
+    return FILE_ERROR
+
+
+class StoreSCUSender:
+    """Sends the folders via C-STORE requests using pynetdicom. Associations are kept open after a transfer
+       and reused for the next transfer with the same connection settings, as long as the presentation
+       contexts accepted by the target cover the SOP classes and transfer syntaxes of the files. Associations
+       that have not been used for longer than IDLE_TIMEOUT are released."""
+    IDLE_TIMEOUT = 60 # in seconds
+    TIMEOUT      = 60 # in seconds
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Idle associations for each connection key, together with the proposed contexts and the time of last use
+        self.idle = {}
+
+    def send(self, target_info, folders, report_file, bandwidth_limit=None):
+        """Sends the files of the folders. If a bandwidth limit is given (in MB/s), the transfer is paused 
+           between the files as needed to keep the average data rate below the limit."""
+        files = sorted(f for folder in folders for f in Path(folder).glob(mercure_names.DCMFILTER))
+        contexts = set()
+        for f in files:
+            try:
+                meta = read_file_meta_info(str(f))
+                contexts.add((meta.MediaStorageSOPClassUID, meta.TransferSyntaxUID))
+            except Exception:
+                logger.warning(f"Unable to read file meta information of {f}")
+
+        key = get_connection_key(target_info)
+        assoc, proposed = self._acquire(key, target_info, contexts)
+        if not assoc:
+            return SendResult(EXITCODE_CANNOT_NEGOTIATE_ASSOCIATION, DCMSEND_ERROR_CODES[EXITCODE_CANNOT_NEGOTIATE_ASSOCIATION])
+
+        file_status = {}
+        start_time = time.time()
+        bytes_sent = 0
+        try:
+            for f in files:
+                if not assoc.is_established:
+                    break
+                try:
+                    status = assoc.send_c_store(dcmread(str(f)))
+                    file_status[os.path.normpath(str(f))] = get_status_category(status)
+                    if bandwidth_limit:
+                        bytes_sent += f.stat().st_size
+                        wait_time = start_time + bytes_sent / (float(bandwidth_limit) * 1000000) - time.time()
+                        if wait_time > 0:
+                            time.sleep(wait_time)
+                except Exception as e:
+                    logger.error(f"Unable to send {f}: {e}")
+                    file_status[os.path.normpath(str(f))] = FILE_ERROR
+        finally:
+            self._release(key, assoc, proposed)
+
+        for f in files:
+            file_status.setdefault(os.path.normpath(str(f)), FILE_NOT_SENT)
+        self._write_report(report_file, target_info, file_status)
+
+        if files and all(file_status[name] == FILE_NOT_SENT for name in file_status):
+            return SendResult(EXITCODE_CANNOT_SEND_REQUEST, DCMSEND_ERROR_CODES[EXITCODE_CANNOT_SEND_REQUEST], file_status)
+        return SendResult(file_status=file_status)
+
+    def close(self):
+        """Releases all idle associations."""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for key in idle:
+            for assoc, _, _ in idle[key]:
+                assoc.release()
+
+    def _acquire(self, key, target_info, contexts):
+        """Returns an open association that covers the given contexts, or creates a new one."""
+        now = time.time()
+        expired = []
+        found = None
+        with self.lock:
+            for entry in list(self.idle.get(key, [])):
+                assoc, proposed, last_used = entry
+                if (not assoc.is_established) or (now - last_used > self.IDLE_TIMEOUT):
+                    self.idle[key].remove(entry)
+                    expired.append(assoc)
+                elif found is None and self._covers(assoc, contexts):
+                    self.idle[key].remove(entry)
+                    found = (assoc, proposed)
+            # Contexts that have been needed before are proposed again, so that the new association
+            # can also be reused for the other transfers
+            if found is None:
+                for _, proposed, _ in self.idle.get(key, []):
+                    contexts = contexts | proposed
+        for assoc in expired:
+            if assoc.is_established:
+                assoc.release()
+        if found:
+            return found
+
+        contexts = set(sorted(contexts)[:MAX_CONTEXTS])
+        ae = AE(ae_title=target_info.get("target_aet_source", "mercure"))
+        ae.acse_timeout = self.TIMEOUT
+        ae.dimse_timeout = self.TIMEOUT
+        ae.network_timeout = self.TIMEOUT
+        ae.requested_contexts = [build_context(sop_class, transfer_syntax) for sop_class, transfer_syntax in contexts]
+        try:
+            assoc = ae.associate(target_info.get("target_ip", ""), int(target_info.get("target_port", 104)),
+                                 ae_title=target_info.get("target_aet_target", "ANY-SCP"))
+        except Exception as e:
+            logger.error(f"Unable to connect to {key}: {e}")
+            return None, contexts
+        if not assoc.is_established:
+            logger.error(f"Unable to establish association with {key}")
+            return None, contexts
+        return assoc, contexts
+
+    def _release(self, key, assoc, proposed):
+        """Keeps the association open for reuse by the next transfer."""
+        if not assoc.is_established:
+            return
+        with self.lock:
+            self.idle.setdefault(key, []).append((assoc, proposed, time.time()))
+
+    @staticmethod
+    def _covers(assoc, contexts):
+        accepted = set((cx.abstract_syntax, cx.transfer_syntax[0]) for cx in assoc.accepted_contexts)
+        return contexts <= accepted
+
+    @staticmethod
+    def _write_report(report_file, target_info, file_status):
+        """Writes the status of the files in the format of the transfer list of dcmsend."""
+        try:
+            with open(report_file, "w") as f:
+                f.write(f"Communication Peer : {target_info.get('target_ip','')}:{target_info.get('target_port','')}\n")
+                f.write(f"AE Titles used     : {target_info.get('target_aet_source','')} -> {target_info.get('target_aet_target','')}\n\n")
+                f.write("Status Information\n------------------\n")
+                for name in sorted(file_status):
+                    f.write(f"{name} : {file_status[name].replace('_', ' ')}\n")
+                counts = { status: list(file_status.values()).count(status) 
+                           for status in (FILE_SUCCESS, FILE_WARNING, FILE_ERROR, FILE_NOT_SENT) }
+                f.write("\nStatus Summary\n--------------\n")
+                f.write(f"Number of SOP instances  : {len(file_status)}\n")
+                f.write(f"- sent to the peer       : {len(file_status) - counts[FILE_NOT_SENT]}\n")
+                f.write(f"  * with status SUCCESS  : {counts[FILE_SUCCESS]}\n")
+                f.write(f"  * with status WARNING  : {counts[FILE_WARNING]}\n")
+                f.write(f"  * with status ERROR    : {counts[FILE_ERROR]}\n")
+                f.write(f"- not sent to the peer   : {counts[FILE_NOT_SENT]}\n")
+        except OSError:
+            logger.warning(f"Unable to write report {report_file}")
@@ -0,0 +1,70 @@
+"""
+throttle.py
+===========
+Limits the data rate and the number of associations of the transfers to every target, so that
+targets on slow network links are not flooded by large series.
+"""
+import threading
+import time
+from collections import deque
+
+import daiquiri
+
+from common.constants import mercure_names
+
+
+logger = daiquiri.getLogger("throttle")
+
+# Time window for limiting the number of associations
+ASSOCIATION_WINDOW = 60 # in seconds
+
+
+def get_transfer_size(batch):
+    """Returns the number of bytes of the folders of the batch (given as tuples of folder and dispatch
+       information). The size is taken from the file manifest or determined from the files."""
+    size = 0
+    for folder, target_info in batch:
+        if "file_size" in target_info:
+            size += target_info["file_size"]
+        else:
+            size += sum(f.stat().st_size for f in folder.glob(mercure_names.DCMFILTER))
+    return size
+
+
+class TargetThrottle:
+    """Enforces the limits configured for the targets: the maximum data rate (bandwidth_limit in MB/s) and
+       the maximum number of associations per minute (association_limit). The data rate is enforced by
+       holding back transfers until the previous transfers to the target would have been completed at the
+       allowed rate. Urgent transfers are not held back by the data rate, so that they can use the remaining
+       bandwidth of the link, but their size is counted for the following transfers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.targets = {}
+
+    def acquire(self, target_key, limits, size, urgent=False, now=None):
+        """Checks if a transfer with the given size can be started now. If so, the transfer is counted
+           for the target and True is returned."""
+        bandwidth_limit = limits.get("bandwidth_limit") or 0
+        association_limit = limits.get("association_limit") or 0
+        if not bandwidth_limit and not association_limit:
+            return True
+        if now is None:
+            now = time.time()
+        with self.lock:
+            state = self.targets.setdefault(target_key, { "available_at": 0, "associations": deque() })
+            associations = state["associations"]
+            while associations and associations[0] <= now - ASSOCIATION_WINDOW:
+                associations.popleft()
+            if association_limit and len(associations) >= association_limit:
+                return False
+            if bandwidth_limit and not urgent and now < state["available_at"]:
+                return False
+            associations.append(now)
+            if bandwidth_limit:
+                state["available_at"] = max(state["available_at"], now) + size / (float(bandwidth_limit) * 1000000)
+            return True
+
+
+# Shared throttle state of all targets of the dispatcher instance
+target_throttle = TargetThrottle()
@@ -7,6 +7,7 @@ import logging
 import os
 import signal
 import sys
+import time
 from pathlib import Path
 import daiquiri
 import graphyte
@@ -14,10 +15,15 @@ import graphyte
 import common.config as config
 import common.helper as helper
 import common.monitor as monitor
-from dispatch.status import has_been_send, is_ready_for_sending
-from dispatch.send import execute
+from dispatch.status import has_been_send, is_ready_for_sending, is_target_json_valid, get_target_key, get_connection_key
+from dispatch.retry import RetryQueue
+from dispatch.health import target_health
+from dispatch.throttle import target_throttle, get_transfer_size
+from dispatch.send import execute_batch, close_senders
+from dispatch.pool import DispatchPool
+from dispatch.scheduler import order_folders
 from common.config import mercure
-from common.constants import mercure_defs, mercure_folders
+from common.constants import mercure_defs, mercure_folders, mercure_options
 
 daiquiri.setup(
     level=logging.INFO,
@@ -32,6 +38,12 @@ daiquiri.setup(
 logger = daiquiri.getLogger("dispatcher")
 
 
+# Pool of worker threads for sending multiple folders in parallel (only used if more than one worker is configured)
+dispatch_pool = None
+# Folders that are waiting for the next retry after a failed transfer
+retry_queue = RetryQueue()
+
+
 def terminate_process(signalNumber, frame):
     """Triggers the shutdown of the service."""
     helper.g_log('events.shutdown', 1)
@@ -66,21 +78,132 @@ def dispatch(args):
     retry_max      = config.mercure["retry_max"]
     retry_delay    = config.mercure["retry_delay"]
 
-    # TODO: Sort list so that the oldest DICOMs get dispatched first
-    with os.scandir(config.mercure[mercure_folders.OUTGOING]) as it:
-        for entry in it:
-            if (
-                entry.is_dir()
-                and not has_been_send(entry.path)
-                and is_ready_for_sending(entry.path)
-            ):
-                logger.info(f"Sending folder {entry.path}")
-                execute(Path(entry.path), success_folder, error_folder, retry_max, retry_delay)
+    outgoing_folder = config.mercure[mercure_folders.OUTGOING]
+
+    while True:
+        known_folders, ready_folders = get_ready_folders(outgoing_folder)
+        queue = order_folders(ready_folders, config.mercure["dispatcher_aging_time"],
+                              config.mercure["offpeak_start"], config.mercure["offpeak_end"])
+
+        for batch in create_batches(queue, config.mercure["dispatcher_batch_size"]):
+            target_key = get_target_key(batch[0][1])
+            folders = [folder for folder, _ in batch]
+            if not dispatch_pool:
+                # Transfers to targets that are unreachable are paused (without counting as retry)
+                if target_health.allow(target_key):
+                    if acquire_transfer(batch, target_key):
+                        logger.info(f"Sending folders {', '.join(str(folder) for folder in folders)}")
+                        send_batch(batch, success_folder, error_folder, retry_max, retry_delay)
+                    else:
+                        target_health.release(target_key)
+            else:
+                if dispatch_pool.is_full():
+                    return
+                if dispatch_pool.can_submit(target_key) and target_health.allow(target_key):
+                    # If the batch is not started, the probe of an unreachable target is left for the next batch
+                    if (acquire_transfer(batch, target_key)
+                        and dispatch_pool.submit(folders, target_key, send_batch,
+                                                 batch, success_folder, error_folder, retry_max, retry_delay)):
+                        logger.info(f"Sending folders {', '.join(str(folder) for folder in folders)}")
+                    else:
+                        target_health.release(target_key)
 
             # If termination is requested, stop processing series after the
             # active one has been completed
             if helper.is_terminated():
+                return
+
+            # If new series have arrived while sending, the queue needs to be ordered again, so that 
+            # urgent series do not need to wait until all queued series have been sent
+            if not dispatch_pool and has_new_folders(outgoing_folder, known_folders):
                 break
+        else:
+            return
+
+
+def get_ready_folders(outgoing_folder):
+    """Returns the names of all folders in the outgoing folder and the list of folders (together with the 
+       dispatch information) that are ready for sending. Folders waiting for the next retry are skipped 
+       without accessing their files."""
+    known_folders = set()
+    ready_folders = []
+    now = time.time()
+    retry_queue.release_due(now)
+    with os.scandir(outgoing_folder) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            known_folders.add(entry.name)
+            if retry_queue.is_waiting(entry.name):
+                continue
+            if dispatch_pool and dispatch_pool.is_active(entry.path):
+                continue
+            target_info = not has_been_send(entry.path) and is_ready_for_sending(entry.path)
+            if not target_info:
+                continue
+            # Folders that have failed before the last restart or that have been sent by another instance
+            if target_info.get("next_retry_at", 0) > now:
+                retry_queue.add(entry.name, target_info["next_retry_at"])
+                continue
+            ready_folders.append((Path(entry.path), target_info))
+    return known_folders, ready_folders
+
+
+def create_batches(queue, batch_size):
+    """Groups the ordered folders into batches of up to batch_size folders that are sent to the same target
+       with the same settings, so that they can be transferred using one association. The batches are 
+       ordered by their first folder."""
+    batches = []
+    open_batches = {}
+    for folder, target_info in queue:
+        key = get_connection_key(target_info)
+        batch = open_batches.get(key)
+        if batch is None or len(batch) >= batch_size:
+            batch = []
+            batches.append(batch)
+            open_batches[key] = batch
+        batch.append((folder, target_info))
+    return batches
+
+
+def get_target_limits(target_key):
+    """Returns the configured bandwidth and association limits of the target."""
+    return config.mercure["targets"].get(target_key, {})
+
+
+def acquire_transfer(batch, target_key):
+    """Checks if the limits of the target allow sending the batch now. Urgent series are not held back 
+       by the bandwidth limit."""
+    limits = get_target_limits(target_key)
+    if not limits.get("bandwidth_limit") and not limits.get("association_limit"):
+        return True
+    urgent = any(target_info.get("priority") == mercure_options.URGENT for _, target_info in batch)
+    size = get_transfer_size(batch) if limits.get("bandwidth_limit") else 0
+    return target_throttle.acquire(target_key, limits, size, urgent)
+
+
+def send_batch(batch, success_folder, error_folder, retry_max, retry_delay):
+    """Sends the folders of the batch to the target. Folders that could not be sent are placed into the retry queue."""
+    target_key = get_target_key(batch[0][1])
+    bandwidth_limit = get_target_limits(target_key).get("bandwidth_limit")
+    try:
+        execute_batch(batch, success_folder, error_folder, retry_max, retry_delay, config.mercure["dispatcher_sender"],
+                      bandwidth_limit)
+    finally:
+        # If the batch was the probe of an unreachable target, the next transfer can be used as probe, also if
+        # the result of the batch did not indicate whether the target is reachable (e.g., an invalid file)
+        target_health.release(target_key)
+    # If a folder is still in the outgoing folder, the transfer has failed and will be retried later
+    for folder, _ in batch:
+        retry_info = folder.exists() and is_target_json_valid(folder)
+        if retry_info and retry_info.get("next_retry_at", 0) > time.time():
+            retry_queue.add(folder.name, retry_info["next_retry_at"])
+
+
+def has_new_folders(outgoing_folder, known_folders):
+    """Checks if the outgoing folder contains folders that have not been seen during the last scan."""
+    with os.scandir(outgoing_folder) as it:
+        return any(entry.name not in known_folders for entry in it if entry.is_dir())
 
 
 def exit_dispatcher(args):
@@ -115,7 +238,7 @@ if __name__ == "__main__":
     logger.info(f"Instance  PID  = {os.getpid()}")
     logger.info(sys.version)
 
-    monitor.configure("dispatcher", instance_name, config.mercure["bookkeeper"])
+    monitor.configure("dispatcher", instance_name, config.mercure["bookkeeper"], config.mercure["bookkeeper_journal_folder"])
     monitor.send_event(
         monitor.h_events.BOOT, monitor.severity.INFO, f"PID = {os.getpid()}"
     )
@@ -133,6 +256,13 @@ if __name__ == "__main__":
 
     logger.info(f"Dispatching folder: {config.mercure[mercure_folders.OUTGOING]}")
 
+    retry_queue = RetryQueue(os.path.join(config.mercure[mercure_folders.OUTGOING], f".retry_queue_{instance_name}.json"))
+
+    if config.mercure["dispatcher_max_workers"] > 1:
+        logger.info(f'Sending with {config.mercure["dispatcher_max_workers"]} workers '
+                    f'(max {config.mercure["dispatcher_target_workers"]} per target)')
+        dispatch_pool = DispatchPool(config.mercure["dispatcher_max_workers"], config.mercure["dispatcher_target_workers"])
+
     global main_loop
     main_loop = helper.RepeatedTimer(
         config.mercure["dispatcher_scan_interval"], dispatch, exit_dispatcher, {}
@@ -144,5 +274,10 @@ if __name__ == "__main__":
     # Start the asyncio event loop for asynchronous function calls
     helper.loop.run_forever()
 
+    # Wait until the active transfers have been completed
+    if dispatch_pool:
+        dispatch_pool.shutdown()
+    close_senders()
+
     monitor.send_event(monitor.h_events.SHUTDOWN, monitor.severity.INFO)
     logging.info("Going down now")
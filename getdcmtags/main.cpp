@@ -1,5 +1,9 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/file.h>
+#include <sys/stat.h>
 
 #include "dcmtk/dcmdata/dcpath.h"
 #include "dcmtk/dcmdata/dcerror.h"
@@ -52,6 +56,42 @@ static OFString tagInstanceNumber="";
 static OFString tagAcquisitionNumber="";
 
 static std::string bookkeeperAddress="";
+static std::string spoolFilename="";
+
+
+bool appendToSpool(std::string line)
+{
+    // The router moves the spool file aside before forwarding the entries. Therefore, it needs to be
+    // checked after acquiring the lock that the opened file is still the current spool file. Otherwise,
+    // the entry would be written into a file that has already been forwarded
+    for (int attempt=0; attempt<10; attempt++)
+    {
+        int fd=open(spoolFilename.c_str(), O_WRONLY | O_APPEND | O_CREAT, 0664);
+        if (fd<0)
+        {
+            return false;
+        }
+
+        if (flock(fd, LOCK_SH)!=0)
+        {
+            close(fd);
+            return false;
+        }
+
+        struct stat fileStat, pathStat;
+        if ((fstat(fd, &fileStat)==0) && (stat(spoolFilename.c_str(), &pathStat)==0)
+            && (fileStat.st_dev==pathStat.st_dev) && (fileStat.st_ino==pathStat.st_ino))
+        {
+            // The line is written with a single call, so that it does not interleave with the entries of
+            // other receiver processes
+            bool success=(write(fd, line.data(), line.size())==(ssize_t) line.size());
+            close(fd);
+            return success;
+        }
+        close(fd);
+    }
+    return false;
+}
 
 
 void sendBookkeeperPost(OFString filename, OFString fileUID, OFString seriesUID)
@@ -61,6 +101,25 @@ void sendBookkeeperPost(OFString filename, OFString fileUID, OFString seriesUID)
         return;
     }
 
+    // If a spool file has been specified, append the registration to the spool file. The entries
+    // are forwarded in batches to the bookkeeper by the router, which avoids starting a separate
+    // process for every received file
+    if (!spoolFilename.empty())
+    {
+        std::string line=filename.c_str();
+        line.append("\t");
+        line.append(fileUID.c_str());
+        line.append("\t");
+        line.append(seriesUID.c_str());
+        line.append("\n");
+
+        if (appendToSpool(line))
+        {
+            return;
+        }
+        std::cout << "ERROR: Unable to write to spool file " << spoolFilename << std::endl;
+    }
+
     // Send REST call to bookkeeper instance as forked process, so that the
     // current process can proceed and terminate
     std::string cmd="wget -q -T 1 -t 3 --post-data=\"filename=";
@@ -222,7 +281,7 @@ int main(int argc, char *argv[])
         std::cout << std::endl;
         std::cout << "getdcmtags ver "                                      << VERSION   << std::endl;
         std::cout << "-------------------"                                  << std::endl << std::endl;
-        std::cout << "Usage: [dcm file to analyze] [ip:port of bookkeeper]" << std::endl << std::endl;
+        std::cout << "Usage: [dcm file to analyze] [ip:port of bookkeeper] [spool file for bookkeeper registrations]" << std::endl << std::endl;
 
         return 0;
     }
@@ -232,6 +291,11 @@ int main(int argc, char *argv[])
         bookkeeperAddress=std::string(argv[2]);
     }
 
+    if (argc > 3)
+    {
+        spoolFilename=std::string(argv[3]);
+    }
+
     OFString origFilename=OFString(argv[1]);
     OFString path="";
 
@@ -0,0 +1,134 @@
+"""
+images.py
+=========
+Manages the Docker images of the processing modules. The images are pulled when a module is saved and
+checked by the processor, so that processing jobs do not need to wait for the image download and missing
+images are noticed before series arrive for processing. The status of the images is kept in a small state
+file next to the configuration file, which is shared by the webgui and the processor.
+"""
+import json
+import os
+import threading
+import time
+
+import daiquiri
+import docker
+
+import common.config as config
+import common.monitor as monitor
+from process.runtime import get_docker_client
+
+
+logger = daiquiri.getLogger("images")
+
+# Status of the images
+IMAGE_READY   = "ready"
+IMAGE_PULLING = "pulling"
+IMAGE_MISSING = "missing"
+
+# Time after which a failed image is pulled again
+MISSING_RETRY_TIME = 300 # in seconds
+
+
+def split_tag(docker_tag):
+    """Splits the docker tag into repository and tag (the tag defaults to "latest")."""
+    repository, _, tag = docker_tag.rpartition(":")
+    # A colon can also be part of the registry address (e.g., localhost:5000/module)
+    if not repository or "/" in tag:
+        return docker_tag, "latest"
+    return repository, tag
+
+
+class ImageManager:
+    """Pulls the images of the modules in the background and keeps track of their status and digest."""
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.pulling = set()
+
+    def get_status(self):
+        """Returns the status of all known images, with the docker tag as key."""
+        try:
+            with open(self.state_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def is_ready(self, docker_tag):
+        """Checks if the image is available locally. Images that failed to download are also considered
+           ready, so that the processing jobs fail (and are moved to the error folder) instead of waiting."""
+        if not docker_tag:
+            return True
+        status = self.get_status().get(docker_tag, {}).get("status")
+        return status in (IMAGE_READY, IMAGE_MISSING)
+
+    def prepare(self, docker_tag):
+        """Verifies that the image exists locally and pulls it otherwise. Blocks until the image is available.
+           Returns True if the image is ready."""
+        if not docker_tag:
+            return False
+        with self.lock:
+            if docker_tag in self.pulling:
+                return False
+            self.pulling.add(docker_tag)
+        try:
+            previous_digest = self.get_status().get(docker_tag, {}).get("digest")
+            client = get_docker_client()
+            try:
+                image = client.images.get(docker_tag)
+            except docker.errors.ImageNotFound:
+                self._update(docker_tag, IMAGE_PULLING)
+                logger.info(f"Pulling image {docker_tag}")
+                repository, tag = split_tag(docker_tag)
+                image = client.images.pull(repository, tag=tag)
+            digest = (image.attrs.get("RepoDigests") or [image.id])[0]
+            if previous_digest and previous_digest != digest:
+                logger.info(f"Image {docker_tag} has changed to {digest}")
+            self._update(docker_tag, IMAGE_READY, digest)
+            return True
+        except Exception as e:
+            logger.error(f"Unable to pull image {docker_tag}: {e}")
+            monitor.send_event(monitor.h_events.PROCESSING, monitor.severity.ERROR, f"Docker image {docker_tag} not available")
+            self._update(docker_tag, IMAGE_MISSING, error=str(e))
+            return False
+        finally:
+            with self.lock:
+                self.pulling.discard(docker_tag)
+
+    def prepare_modules(self, modules):
+        """Starts pulling the images of all modules that are not ready in background threads."""
+        for module in modules.values():
+            self.prepare_in_background(module.get("docker_tag"))
+
+    def prepare_in_background(self, docker_tag):
+        """Starts pulling the image in a background thread, unless the image is ready, already being pulled,
+           or has failed to download a short time ago."""
+        if not docker_tag:
+            return
+        entry = self.get_status().get(docker_tag, {})
+        if entry.get("status") == IMAGE_READY:
+            return
+        if entry.get("status") == IMAGE_MISSING and time.time() - entry.get("checked", 0) < MISSING_RETRY_TIME:
+            return
+        with self.lock:
+            if docker_tag in self.pulling:
+                return
+        threading.Thread(target=self.prepare, args=(docker_tag,), daemon=True).start()
+
+    def _update(self, docker_tag, status, digest=None, error=None):
+        """Stores the status of the image. The state file is replaced atomically, so that other processes
+           never read an incomplete file."""
+        with self.lock:
+            state = self.get_status()
+            state[docker_tag] = { "status": status, "digest": digest, "error": error, "checked": time.time() }
+            temp_file = self.state_file + ".tmp." + str(os.getpid())
+            try:
+                with open(temp_file, "w") as f:
+                    json.dump(state, f)
+                os.replace(temp_file, self.state_file)
+            except OSError:
+                logger.warning(f"Unable to store status of image {docker_tag}")
+
+
+# Image manager of the service, with the state file stored next to the configuration file
+image_manager = ImageManager(os.path.join(os.path.dirname(config.configuration_filename), "module_images.json"))
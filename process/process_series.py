@@ -11,7 +11,9 @@ import docker
 import common.monitor as monitor
 import common.helper as helper
 import common.config as config
+import common.storage as storage
 from common.constants import mercure_names
+from process.runtime import module_runtime
 import traceback
 
 
@@ -20,7 +22,6 @@ logger = daiquiri.getLogger("process_series")
 
 def process_series(folder):    
     logger.info(f'Now processing = {folder}')
-    docker_client = docker.from_env()
     
     lock_file=Path(folder) / mercure_names.PROCESSING
     if lock_file.exists():
@@ -49,12 +50,18 @@ def process_series(folder):
         with open(the_path, "r") as f:
             return json.load(f)
     
+    module = ''
+    series_uid = ''
+    metrics = {}
     try:
         task = get_task()
         docker_image = task['process']['docker_tag']
-        docker_client.containers.run(docker_image, 
-            '--dicom-path /data',
-            volumes={folder:{'bind':'/data','mode':'rw'}})
+        module = task['info'].get('module', '')
+        series_uid = task['info'].get('uid', '')
+        # The settings for warm containers are taken from the current configuration
+        module_config = dict(task['process'])
+        module_config['warm_instances'] = config.mercure['modules'].get(module, {}).get('warm_instances', 0)
+        module_runtime.run(module, module_config, folder, config.mercure['processing_folder'], get_resource_limits(), metrics)
         processing_success = True
     except json.JSONDecodeError:
         logger.error("Task not valid.")
@@ -68,6 +75,10 @@ def process_series(folder):
         monitor.send_event(monitor.h_events.PROCESSING, monitor.severity.ERROR, f"Docker image {docker_image} not found")
     except:
         logger.info(f"Unknown processing failure")
+
+    if "wall_time" in metrics:
+        send_metrics(series_uid, module, processing_success, metrics)
+
     # Create a new lock file to ensure that no other process picks up the folder while copying
     lock_file=Path(folder) / mercure_names.LOCK
     try:
@@ -92,6 +103,27 @@ def process_series(folder):
     return
 
 
+def send_metrics(series_uid, module, success, metrics):
+    """Publishes the resource usage of the processing job to graphite and the bookkeeper."""
+    metrics = dict(metrics)
+    logger.info(f"Processing with module {module} took {metrics['wall_time']:.1f} s")
+    # Dots and spaces would break the metric path of graphite
+    metric_name = (module or "unknown").replace(".", "_").replace(" ", "_")
+    for key, value in metrics.items():
+        helper.g_log(f'processing.{metric_name}.{key}', value)
+    monitor.send_processing_metrics(series_uid, module, success, metrics)
+
+
+def get_resource_limits():
+    """Returns the CPU and memory limits for the module container, as configured for the processing slots."""
+    limits={}
+    if config.mercure['processor_slot_cpus']:
+        limits['nano_cpus']=int(float(config.mercure['processor_slot_cpus'])*1000000000)
+    if config.mercure['processor_slot_memory']:
+        limits['mem_limit']=config.mercure['processor_slot_memory']
+    return limits
+
+
 def move_folder(source_folder_str, destination_folder_str):
 
     source_folder=Path(source_folder_str)
@@ -103,7 +135,7 @@ def move_folder(source_folder_str, destination_folder_str):
 
     logger.debug(f"Moving {source_folder} to {target_folder}")
     try:
-        shutil.move(source_folder, target_folder)        
+        storage.move_folder(source_folder, target_folder)
         lockfile=target_folder / mercure_names.LOCK
         lockfile.unlink()
     except:
@@ -0,0 +1,319 @@
+"""
+runtime.py
+==========
+Runtime for the processing modules. Provides a Docker client that is shared by all processing jobs and
+manages warm module containers, which keep running between the jobs so that lightweight modules do not
+need to pay the startup time of a new container for every series.
+
+Warm containers are started with the argument "--watch-jobs /jobs", with a jobs folder of the container
+(inside of the processing folder) mounted as /jobs. For every job, the series folder is moved into the
+jobs folder and a job file "<id>.job" is placed next to it, which contains the path of the series folder
+inside the container (as JSON with key "dicom_path"). Once the job has been processed, the module writes
+the exit code into the file "<id>.done" and the series folder is moved back. Thus, like containers started
+for a single series, warm containers can only access the series that they are processing. Only modules
+that implement this protocol should be configured with warm instances.
+
+For every job, the wall time is measured. For jobs running in their own container, the peak memory, the
+CPU time, and the bytes read and written are also taken from the resource statistics of the container
+(warm containers are shared by consecutive jobs, so that their statistics cannot be assigned to one job).
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import daiquiri
+import docker
+
+
+logger = daiquiri.getLogger("runtime")
+
+# Folder for the jobs of warm containers, inside of the processing folder
+JOBS_FOLDER    = ".jobs"
+# Mount point of the jobs folder inside the warm containers
+CONTAINER_ROOT = "/jobs"
+# Interval for checking if a job has been completed
+POLL_INTERVAL  = 0.01 # in seconds
+# Interval for checking if the warm container is still running while waiting for a job
+LIVENESS_INTERVAL = 1 # in seconds
+# Labels of the warm containers, containing the module and the owning processor (process ID and container ID)
+WARM_LABEL     = "mercure.warm"
+OWNER_LABEL    = "mercure.owner"
+# Maximum time for processing one series by a warm container
+JOB_TIMEOUT    = 3600 # in seconds
+# Time for collecting the last resource statistics after the container has exited
+STATS_TIMEOUT  = 5    # in seconds
+
+docker_client = None
+client_lock = threading.Lock()
+
+
+def get_docker_client():
+    """Returns the Docker client that is shared by all processing jobs."""
+    global docker_client
+    with client_lock:
+        if docker_client is None:
+            docker_client = docker.from_env()
+        return docker_client
+
+
+def update_metrics(metrics, stats):
+    """Updates the metrics of the job with one entry of the container statistics. All values are cumulative,
+       so that the maximum is kept (the last entries of exited containers can be empty)."""
+    memory_stats = stats.get("memory_stats") or {}
+    peak_memory = memory_stats.get("max_usage") or memory_stats.get("usage") or 0
+    metrics["peak_memory"] = max(metrics.get("peak_memory", 0), peak_memory)
+
+    cpu_time = ((stats.get("cpu_stats") or {}).get("cpu_usage") or {}).get("total_usage") or 0
+    metrics["cpu_time"] = max(metrics.get("cpu_time", 0), cpu_time / 1000000000)
+
+    io_bytes = { "read": 0, "write": 0 }
+    for entry in (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []:
+        op = str(entry.get("op", "")).lower()
+        if op in io_bytes:
+            io_bytes[op] += entry.get("value", 0)
+    metrics["read_bytes"] = max(metrics.get("read_bytes", 0), io_bytes["read"])
+    metrics["write_bytes"] = max(metrics.get("write_bytes", 0), io_bytes["write"])
+
+
+def collect_stats(container, metrics):
+    """Reads the resource statistics of the container until it has exited."""
+    try:
+        for stats in container.stats(decode=True):
+            update_metrics(metrics, stats)
+    except Exception as e:
+        logger.debug(f"Unable to read statistics of container {container.id}: {e}")
+
+
+def is_other_instance(pid):
+    """Checks if the given process ID belongs to another running processor instance. Unknown IDs and the own
+       process ID count as finished, as the latter can only refer to an earlier processor that had the same ID
+       (e.g., inside a container)."""
+    if pid <= 0 or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def get_owner(name):
+    """Returns the process ID contained in the label or folder name of a warm container, or 0 if unknown."""
+    try:
+        return int(name.split("_", 1)[0])
+    except ValueError:
+        return 0
+
+
+def recover_jobs(processing_folder):
+    """Cleans up after processor instances that have been terminated while running warm containers: Their
+       containers are stopped and the series folders that have been left in their jobs folders are moved back
+       into the processing folder. Containers and jobs folders of other running instances are not touched."""
+    try:
+        for container in get_docker_client().containers.list(all=True, filters={ "label": WARM_LABEL }):
+            if not is_other_instance(get_owner(container.labels.get(OWNER_LABEL, ""))):
+                logger.warning(f"Stopping orphaned warm container of module {container.labels.get(WARM_LABEL)}")
+                container.remove(force=True)
+    except Exception as e:
+        logger.warning(f"Unable to check for orphaned warm containers: {e}")
+
+    jobs_root = Path(processing_folder) / JOBS_FOLDER
+    for instance_folder in jobs_root.glob("*/*"):
+        if not instance_folder.is_dir() or is_other_instance(get_owner(instance_folder.name)):
+            continue
+        for entry in instance_folder.iterdir():
+            if not entry.is_dir():
+                # Job files of the terminated container
+                entry.unlink()
+                continue
+            target_folder = Path(processing_folder) / entry.name
+            if target_folder.exists():
+                logger.error(f"Unable to recover {entry}, as {target_folder} already exists")
+                continue
+            logger.warning(f"Recovering series {entry.name} from jobs folder")
+            os.rename(entry, target_folder)
+        try:
+            instance_folder.rmdir()
+        except OSError:
+            pass
+
+
+class WarmContainer:
+    """Long-running container of a module that processes the series submitted via job files."""
+    def __init__(self, module, docker_tag, processing_folder, limits):
+        self.module = module
+        self.docker_tag = docker_tag
+        # Every container has its own jobs folder, so that it cannot access the series of other containers. The
+        # process ID is part of the folder name and the labels, so that leftovers can be removed after a crash
+        owner = f"{os.getpid()}_{uuid.uuid1()}"
+        self.jobs_folder = Path(processing_folder) / JOBS_FOLDER / module / owner
+        self.jobs_folder.mkdir(parents=True, exist_ok=True)
+        self.container = get_docker_client().containers.run(docker_tag, f'--watch-jobs {CONTAINER_ROOT}',
+            volumes={str(self.jobs_folder.resolve()):{'bind':CONTAINER_ROOT,'mode':'rw'}},
+            labels={ WARM_LABEL: module, OWNER_LABEL: owner }, detach=True, **limits)
+        logger.info(f"Started warm container for module {module}")
+
+    def is_running(self):
+        try:
+            self.container.reload()
+            return self.container.status in ("created", "running")
+        except docker.errors.APIError:
+            return False
+
+    def run_job(self, folder):
+        """Processes the series in the given folder. Returns the exit code of the job."""
+        job_id = str(uuid.uuid1())
+        job_file = self.jobs_folder / (job_id + ".job")
+        done_file = self.jobs_folder / (job_id + ".done")
+        staged_folder = self.jobs_folder / Path(folder).name
+
+        # The series folder is moved into the jobs folder for the time of the job (renaming takes constant time)
+        os.rename(folder, staged_folder)
+        try:
+            # The job file is renamed after writing, so that the module never sees incomplete job files
+            with open(str(job_file) + ".tmp", "w") as f:
+                json.dump({ "dicom_path": f"{CONTAINER_ROOT}/{staged_folder.name}" }, f)
+            os.rename(str(job_file) + ".tmp", job_file)
+
+            timeout = time.time() + JOB_TIMEOUT
+            next_check = time.time() + LIVENESS_INTERVAL
+            while not done_file.exists():
+                # Checking the container requires a request to the Docker daemon, so it is done less often
+                if time.time() > next_check:
+                    if not self.is_running():
+                        raise docker.errors.ContainerError(self.container, -1, "--watch-jobs", self.docker_tag,
+                                                           "Warm container has stopped")
+                    next_check = time.time() + LIVENESS_INTERVAL
+                if time.time() > timeout:
+                    raise docker.errors.ContainerError(self.container, -1, "--watch-jobs", self.docker_tag,
+                                                       "Warm container did not complete the job")
+                time.sleep(POLL_INTERVAL)
+            return int(done_file.read_text().strip() or 0)
+        finally:
+            for f in (job_file, done_file):
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+            os.rename(staged_folder, folder)
+
+    def stop(self):
+        try:
+            self.container.stop()
+            self.container.remove()
+        except docker.errors.APIError:
+            logger.warning(f"Unable to stop warm container of module {self.module}")
+        try:
+            self.jobs_folder.rmdir()
+        except OSError:
+            pass
+
+
+class ModuleRuntime:
+    """Runs the module containers for the processing jobs. For modules configured with warm_instances, up to
+       the given number of warm containers are kept running and reused for the following jobs. If all warm
+       containers of the module are busy, a regular container is started for the job."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.counts = {}
+
+    def run(self, module, module_config, folder, processing_folder, limits, metrics=None):
+        """Processes the series in the given folder with the module. Raises ContainerError if the module fails.
+           The resource usage of the job is stored in the given metrics dictionary, also if the module fails."""
+        docker_tag = module_config.get('docker_tag')
+        warm_instances = module_config.get('warm_instances', 0)
+        if metrics is None:
+            metrics = {}
+
+        container = None
+        if warm_instances:
+            container = self._acquire(module, docker_tag, warm_instances, processing_folder, limits)
+        if container is None:
+            self._run_container(docker_tag, folder, limits, metrics)
+            return
+
+        start = time.monotonic()
+        try:
+            exit_code = container.run_job(folder)
+        except Exception:
+            self._discard(container)
+            raise
+        finally:
+            metrics["wall_time"] = time.monotonic() - start
+        self._release(container)
+        if exit_code != 0:
+            raise docker.errors.ContainerError(container.container, exit_code, "--watch-jobs", docker_tag, "")
+
+    def _run_container(self, docker_tag, folder, limits, metrics):
+        """Runs the job in a new container, while collecting the resource statistics of the container."""
+        start = time.monotonic()
+        container = get_docker_client().containers.run(docker_tag, '--dicom-path /data',
+            volumes={folder:{'bind':'/data','mode':'rw'}}, detach=True, **limits)
+        stats_thread = threading.Thread(target=collect_stats, args=(container, metrics), daemon=True)
+        stats_thread.start()
+        exit_code = container.wait().get("StatusCode", 0)
+        metrics["wall_time"] = time.monotonic() - start
+        # The statistics stream ends once the container has exited
+        stats_thread.join(STATS_TIMEOUT)
+        if exit_code != 0:
+            raise docker.errors.ContainerError(container, exit_code, '--dicom-path /data', docker_tag,
+                                               container.logs(stdout=False, stderr=True))
+
+    def _acquire(self, module, docker_tag, warm_instances, processing_folder, limits):
+        """Returns an idle warm container of the module, or starts a new one if the limit has not been reached."""
+        outdated = []
+        container = None
+        with self.lock:
+            idle = self.idle.setdefault(module, [])
+            while idle and container is None:
+                candidate = idle.pop()
+                # Containers of a previous version of the module are replaced
+                if candidate.docker_tag == docker_tag and candidate.is_running():
+                    container = candidate
+                else:
+                    outdated.append(candidate)
+                    self.counts[module] -= 1
+            if container is None and self.counts.get(module, 0) < warm_instances:
+                self.counts[module] = self.counts.get(module, 0) + 1
+                start_new = True
+            else:
+                start_new = False
+        for candidate in outdated:
+            candidate.stop()
+        if container or not start_new:
+            return container
+        try:
+            return WarmContainer(module, docker_tag, processing_folder, limits)
+        except Exception:
+            logger.exception(f"Unable to start warm container for module {module}")
+            with self.lock:
+                self.counts[module] -= 1
+            return None
+
+    def _release(self, container):
+        with self.lock:
+            self.idle.setdefault(container.module, []).append(container)
+
+    def _discard(self, container):
+        with self.lock:
+            self.counts[container.module] -= 1
+        container.stop()
+
+    def close(self):
+        """Stops all warm containers."""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+            self.counts = {}
+        for module in idle:
+            for container in idle[module]:
+                container.stop()
+
+
+# Runtime shared by all processing jobs of the processor instance
+module_runtime = ModuleRuntime()
@@ -0,0 +1,61 @@
+"""
+slots.py
+========
+Slots for running multiple processing modules in parallel.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import daiquiri
+
+
+logger = daiquiri.getLogger("slots")
+
+
+class ProcessingSlots:
+    """Runs the processing of the series in a pool of worker threads, each of which waits for one module
+       container. The number of series processed in parallel is limited overall (max_slots) and for every
+       module (given when submitting), so that long-running modules cannot block all other processing jobs."""
+    def __init__(self, max_slots):
+        self.max_slots = max_slots
+        self.executor = ThreadPoolExecutor(max_workers=max_slots)
+        self.lock = threading.Lock()
+        self.active = {}
+        self.module_counts = {}
+
+    def is_active(self, folder):
+        """Checks if the given folder is currently being processed."""
+        with self.lock:
+            return str(folder) in self.active
+
+    def is_full(self):
+        """Checks if all slots are busy."""
+        with self.lock:
+            return len(self.active) >= self.max_slots
+
+    def submit(self, folder, module, module_limit, function, *args):
+        """Starts the function for the given folder in a free slot. Returns False if the folder is already
+           active or if the limits for the slots or the module (0 = no limit) have been reached."""
+        folder = str(folder)
+        with self.lock:
+            if (folder in self.active or len(self.active) >= self.max_slots
+                    or (module_limit and self.module_counts.get(module, 0) >= module_limit)):
+                return False
+            self.active[folder] = module
+            self.module_counts[module] = self.module_counts.get(module, 0) + 1
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda f: self._finished(folder, module, f))
+        return True
+
+    def _finished(self, folder, module, future):
+        with self.lock:
+            del self.active[folder]
+            self.module_counts[module] -= 1
+            if not self.module_counts[module]:
+                del self.module_counts[module]
+        if future.exception():
+            logger.error(f"Error while processing folder {folder}: {future.exception()}")
+
+    def shutdown(self):
+        """Waits until all active processing jobs have been completed."""
+        self.executor.shutdown(wait=True)
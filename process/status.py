@@ -1,17 +1,27 @@
 import json
 from pathlib import Path
 
+import common.helper as helper
 from common.monitor import s_events, send_series_event
 from common.constants import mercure_names
 
 
-def is_ready_for_processing(folder):
-    """Checks if a case in the processing folder is ready for the processor.
+def is_ready_for_processing(folder, task=None):
+    """Checks if a case in the processing folder is ready for the processor. If the task file 
+       has already been read, its content can be passed as task.
     """
     path = Path(folder)
-    folder_status = (
-        not (path / mercure_names.LOCK).exists()
-        and not (path / mercure_names.PROCESSING).exists()
-        and len(list(path.glob("*.dcm"))) > 0
-    )
-    return folder_status
+    if (path / mercure_names.LOCK).exists() or (path / mercure_names.PROCESSING).exists():
+        return False
+    if task is None:
+        task = read_task(folder)
+    return helper.get_file_count(folder, task) > 0
+
+
+def read_task(folder):
+    """Returns the content of the task file of the folder, or None if it cannot be read."""
+    try:
+        with open(Path(folder) / mercure_names.TASKFILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
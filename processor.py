@@ -17,10 +17,14 @@ from pathlib import Path
 import common.helper as helper
 import common.config as config
 import common.monitor as monitor
-from common.constants import mercure_defs
+from common.constants import mercure_defs, mercure_sections, mercure_rule, mercure_options
 
-from process.status import is_ready_for_processing
+from process.status import is_ready_for_processing, read_task
 from process.process_series import process_series
+from process.slots import ProcessingSlots
+from process.runtime import module_runtime, recover_jobs
+from process.images import image_manager
+from dispatch.scheduler import order_folders
 
 
 daiquiri.setup(
@@ -39,54 +43,77 @@ logger = daiquiri.getLogger("processor")
 
 processor_lockfile=Path("")
 processor_is_locked=False
+# Slots for processing multiple series in parallel (only used if more than one slot is configured)
+processing_slots=None
+# Timestamp of the configuration for which the images of the modules have been checked
+modules_checked=None
 
 
-def search_folder(counter):
-    global processor_lockfile
+def is_halted():
+    """Checks if processing has been suspended via the UI."""
     global processor_is_locked
-
-    helper.g_log('events.run', 1)
-
-    tasks={}
-
-    for entry in os.scandir(config.mercure['processing_folder']):        
-        if entry.is_dir() and is_ready_for_processing(entry.path):
-            modification_time=entry.stat().st_mtime
-            tasks[entry.path]=modification_time
-
-    # Check if processing has been suspended via the UI
     if processor_lockfile.exists():
         if not processor_is_locked:
             processor_is_locked=True
             logger.info("Processing halted")
-        return False
-    else:
-        if processor_is_locked:
-            processor_is_locked=False
-            logger.info("Processing resumed")
-
-    # Return if no tasks have been found
-    if not len(tasks):
-        return False
-
-    sorted_tasks=sorted(tasks)
-    # TODO: Add priority sorting. However, do not honor the priority flag for every third run
-    #       so that stagnation of cases is avoided
-
-    # Only process one case at a time because the processing might take a while and
-    # another instance might have processed the other entries already. So the folder
-    # needs to be refreshed each time
-    task=sorted_tasks[0]
-
-    try:
-        process_series(task)
-        # Return true, so that the parent function will trigger another search of the folder
         return True
+    if processor_is_locked:
+        processor_is_locked=False
+        logger.info("Processing resumed")
+    return False
+
+
+def get_task_info(task, modification_time):
+    """Returns the information needed for scheduling the task: the module, the priority of the applied rule
+       and the time when the series has been placed into the processing folder."""
+    info=(task or {}).get(mercure_sections.INFO, {})
+    rule=config.mercure['rules'].get(info.get("applied_rule",""), {})
+    return { "module": info.get("module",""), 
+             "docker_tag": (task or {}).get(mercure_sections.PROCESS, {}).get("docker_tag"),
+             "priority": rule.get(mercure_rule.PRIORITY, mercure_options.NORMAL), 
+             "queued_at": modification_time }
+
+
+def get_ready_tasks(processing_folder):
+    """Returns the names of all folders in the processing folder and the list of folders (together with the
+       task information) that are ready for processing, ordered by priority and waiting time."""
+    known_folders=set()
+    candidates=[]
+    with os.scandir(processing_folder) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            known_folders.add(entry.name)
+            if processing_slots and processing_slots.is_active(entry.path):
+                continue
+            task=read_task(entry.path)
+            if not is_ready_for_processing(entry.path, task):
+                continue
+            task_info=get_task_info(task, entry.stat().st_mtime)
+            # Series are held back while the image of the module is being pulled
+            if not image_manager.is_ready(task_info["docker_tag"]):
+                image_manager.prepare_in_background(task_info["docker_tag"])
+                continue
+            candidates.append((entry.path, task_info))
+    queue=order_folders(candidates, config.mercure['processor_aging_time'],
+                        config.mercure['offpeak_start'], config.mercure['offpeak_end'])
+    return known_folders, queue
+
+
+def has_new_folders(processing_folder, known_folders):
+    """Checks if the processing folder contains folders that have not been seen during the last scan."""
+    with os.scandir(processing_folder) as it:
+        return any(entry.name not in known_folders for entry in it if entry.is_dir())
+
+
+def process_task(folder):
+    """Processes the series in the given folder."""
+    try:
+        process_series(folder)
     except Exception:
-        logger.exception(f'Problems while processing series {task}')
-        monitor.send_series_event(monitor.s_events.ERROR, entry, 0, "", "Exception while processing")
+        logger.exception(f'Problems while processing series {folder}')
+        monitor.send_series_event(monitor.s_events.ERROR, folder, 0, "", "Exception while processing")
         monitor.send_event(monitor.h_events.PROCESSING, monitor.severity.ERROR, "Exception while processing series")
-        return False
 
 
 def run_processor(args):
@@ -94,6 +121,8 @@ def run_processor(args):
     if helper.is_terminated():
         return  
 
+    helper.g_log('events.run', 1)
+
     try:
         config.read_config()
     except Exception:
@@ -101,12 +130,46 @@ def run_processor(args):
         monitor.send_event(monitor.h_events.CONFIG_UPDATE,monitor.severity.WARNING,"Unable to update configuration (possibly locked)")
         return
 
-    call_counter=0
+    # Check the images of the modules after configuration changes, so that the images are available
+    # before the first series arrives for processing
+    global modules_checked
+    if modules_checked != config.configuration_timestamp:
+        modules_checked=config.configuration_timestamp
+        image_manager.prepare_modules(config.mercure['modules'])
 
-    while (search_folder(call_counter)):
-        call_counter += 1
-        # If termination is requested, stop processing series after the active one has been completed
-        if helper.is_terminated():
+    processing_folder=config.mercure['processing_folder']
+
+    while True:
+        # No need to scan the folder if all slots are busy
+        if (processing_slots and processing_slots.is_full()) or is_halted():
+            return
+
+        # The folder is scanned once and the ready series are processed in the order of their priority
+        # and waiting time, so that series of long-running modules do not block the other series 
+        known_folders, queue = get_ready_tasks(processing_folder)
+
+        for folder, task_info in queue:
+            if processing_slots:
+                if processing_slots.is_full():
+                    return
+                module_limit=config.mercure['modules'].get(task_info["module"], {}).get("max_parallel", 0)
+                if processing_slots.submit(folder, task_info["module"], module_limit, process_task, folder):
+                    logger.info(f'Processing {folder} with module {task_info["module"]}')
+                continue
+
+            if is_halted():
+                return
+            process_task(folder)
+
+            # If termination is requested, stop processing series after the active one has been completed
+            if helper.is_terminated():
+                return
+
+            # If new series have arrived while processing, the queue needs to be ordered again, so that 
+            # urgent series do not need to wait until all queued series have been processed
+            if has_new_folders(processing_folder, known_folders):
+                break
+        else:
             return
 
 
@@ -155,7 +218,7 @@ if __name__ == '__main__':
     logger.info(f'Instance  PID  = {os.getpid()}')
     logger.info(sys.version)
 
-    monitor.configure('processor',instance_name,config.mercure['bookkeeper'])
+    monitor.configure('processor',instance_name,config.mercure['bookkeeper'],config.mercure['bookkeeper_journal_folder'])
     monitor.send_event(monitor.h_events.BOOT,monitor.severity.INFO,f'PID = {os.getpid()}')
       
     if len(config.mercure['graphite_ip']) > 0:
@@ -165,6 +228,11 @@ if __name__ == '__main__':
 
     logger.info(f'Processing folder: {config.mercure["processing_folder"]}')
     processor_lockfile=Path(config.mercure['processing_folder'] + '/HALT')
+    recover_jobs(config.mercure['processing_folder'])
+
+    if config.mercure['processor_slots'] > 1:
+        logger.info(f'Processing with {config.mercure["processor_slots"]} slots')
+        processing_slots=ProcessingSlots(config.mercure['processor_slots'])
 
     # Start the timer that will periodically trigger the scan of the incoming folder
     global main_loop
@@ -176,6 +244,10 @@ if __name__ == '__main__':
     # Start the asyncio event loop for asynchronous function calls
     helper.loop.run_forever()
 
-    # Process will exit here once the asyncio loop has been stopped
+    # Process will exit here once the asyncio loop has been stopped. Wait until the active
+    # processing jobs have been completed
+    if processing_slots:
+        processing_slots.shutdown()
+    module_runtime.close()
     monitor.send_event(monitor.h_events.SHUTDOWN, monitor.severity.INFO)
     logger.info('Going down now')
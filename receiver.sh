@@ -19,6 +19,7 @@ fi
 incoming=$(cat $config | jq -r '.incoming_folder')
 port=$(cat $config | jq '.port')
 bookkeeper=$(cat $config | jq -r '.bookkeeper')
+journal=$(cat $config | jq -r '.bookkeeper_journal_folder')
 
 # Check if incoming folder exists
 if [ ! -d "$incoming" ]; then
@@ -54,6 +55,15 @@ else
     echo "Bookkeeper: $bookkeeper"
     # If configured, add preceding space so that both that two arguments are passed
     bookkeeper=" $bookkeeper"
+
+    # If the journal folder is configured, the file registrations are written into a spool file
+    # that is forwarded to the bookkeeper by the router. Otherwise, they are sent directly
+    if [ -n "$journal" ] && [ "$journal" != "null" ]
+    then
+        mkdir -p "$journal"
+        echo "Registration spool: $journal/registration.spool"
+        bookkeeper="$bookkeeper $journal/registration.spool"
+    fi
 fi
 
 echo ""
@@ -19,6 +19,7 @@ import common.config as config
 import common.monitor as monitor
 from routing.route_series import route_series, route_error_files
 from routing.route_studies import route_studies
+from routing.incoming_index import IncomingIndex, IncomingWatcher
 
 
 # NOTES: Currently, the router only implements series-level rules, i.e. the proxy rules will be executed
@@ -46,6 +47,11 @@ daiquiri.setup(
 logger = daiquiri.getLogger("router")
 
 
+# Index of the incoming folder that is updated from inotify events (only used in watcher mode)
+incoming_watcher=None
+last_studies_check=0
+
+
 def terminate_process(signalNumber, frame):
     """Triggers the shutdown of the service."""
     helper.g_log('events.shutdown', 1)
@@ -72,60 +78,63 @@ def run_router(args):
     except Exception:
         logger.exception("Unable to update configuration. Skipping processing.")
         monitor.send_event(monitor.h_events.CONFIG_UPDATE,monitor.severity.WARNING,"Unable to update configuration (possibly locked)")
+        # In watcher mode, the router is called continuously and would otherwise retry immediately
+        if incoming_watcher:
+            incoming_watcher.wait(config.mercure.get('router_scan_interval', 1))
         return
 
-    filecount=0
-    series={}
-    complete_series={}
-
-    error_files_found = False
-
-    # Check the incoming folder for completed series. To this end, generate a map of all
-    # series in the folder with the timestamp of the latest DICOM file as value
-    for entry in os.scandir(config.mercure[mercure_folders.INCOMING]):
-        if entry.name.endswith(mercure_names.TAGS) and not entry.is_dir():
-            filecount += 1
-            seriesString=entry.name.split(mercure_defs.SEPARATOR,1)[0]
-            modificationTime=entry.stat().st_mtime
-
-            if seriesString in series.keys():
-                if modificationTime > series[seriesString]:
-                    series[seriesString]=modificationTime
-            else:
-                series[seriesString]=modificationTime
-        # Check if at least one .error file exists. In that case, the incoming folder should
-        # be searched for .error files at the end of the update run
-        if (not error_files_found) and entry.name.endswith(mercure_names.ERROR):
-            error_files_found = True
+    # In watcher mode, the index of the incoming folder is kept up-to-date from file events, so
+    # that the folder only needs to be scanned for reconciliation. Otherwise, the index is built
+    # with a single scan of the incoming folder, which also provides the list of files for every
+    # series, so that route_series does not need to scan the folder again
+    if incoming_watcher:
+        incoming_index=incoming_watcher
+        wait_time=config.mercure['router_scan_interval']
+        next_completion=incoming_watcher.get_next_completion(config.mercure['series_complete_trigger'])
+        if next_completion is not None:
+            wait_time=min(wait_time, next_completion-time.time())
+        incoming_watcher.wait(wait_time)
+        if (time.time()-incoming_watcher.last_rescan) > config.mercure['router_reconcile_interval']:
+            incoming_watcher.reconcile()
+    else:
+        incoming_index=IncomingIndex(config.mercure[mercure_folders.INCOMING])
+        incoming_index.rescan()
 
     # Check if any of the series exceeds the "series complete" threshold
-    for entry in series:
-        if ((time.time()-series[entry]) > config.mercure['series_complete_trigger']):
-            complete_series[entry]=series[entry]
+    complete_series=incoming_index.get_complete_series(config.mercure['series_complete_trigger'])
+    filecount=incoming_index.get_filecount()
 
-    #logger.info(f'Files found     = {filecount}')
-    #logger.info(f'Series found    = {len(series)}')
-    #logger.info(f'Complete series = {len(complete_series)}')
     helper.g_log('incoming.files', filecount)
-    helper.g_log('incoming.series', len(series))
+    helper.g_log('incoming.series', len(incoming_index.series))
 
     # Process all complete series
     for entry in sorted(complete_series):
         try:
-            route_series(entry)
+            route_series(entry, sorted(complete_series[entry]["files"]))
         except Exception:
             logger.exception(f'Problems while processing series {entry}')
             monitor.send_series_event(monitor.s_events.ERROR, entry, 0, "", "Exception while processing")
             monitor.send_event(monitor.h_events.PROCESSING, monitor.severity.ERROR, "Exception while processing series")
+        # In watcher mode, the series is removed from the index once it has left the incoming folder, so that
+        # it is not routed again before the file events have been received. Otherwise, it is retried later
+        if incoming_watcher:
+            incoming_watcher.finish_series(entry, time.time()+config.mercure['router_scan_interval'])
         # If termination is requested, stop processing series after the active one has been completed
         if helper.is_terminated():
             return
 
-    if error_files_found:
+    if incoming_index.error_files_found:
         route_error_files()
+        incoming_index.error_files_found=False
+
+    # In watcher mode, the function is called continuously. Thus, the studies folder is only
+    # checked in the regular interval
+    global last_studies_check
+    if (not incoming_watcher) or ((time.time()-last_studies_check) >= config.mercure['router_scan_interval']):
+        last_studies_check=time.time()
 
-    # Now, check if studies in the studies folder are ready for routing/processing
-    route_studies()
+        # Now, check if studies in the studies folder are ready for routing/processing
+        route_studies()
 
 
 def exit_router(args):
@@ -162,9 +171,14 @@ if __name__ == '__main__':
     logger.info(f'Instance  PID  = {os.getpid()}')
     logger.info(sys.version)
 
-    monitor.configure('router',instance_name,config.mercure['bookkeeper'])
+    monitor.configure('router',instance_name,config.mercure['bookkeeper'],config.mercure['bookkeeper_journal_folder'])
     monitor.send_event(monitor.h_events.BOOT,monitor.severity.INFO,f'PID = {os.getpid()}')
 
+    # The registrations of the received files are written by the receiver into a spool file and forwarded
+    # by the router to the bookkeeper. Only one router instance should forward the registrations
+    if config.mercure['bookkeeper_journal_folder'] and instance_name=="main":
+        monitor.forward_registrations(os.path.join(config.mercure['bookkeeper_journal_folder'], mercure_names.SPOOL))
+
     if len(config.mercure['graphite_ip']) > 0:
         logger.info(f'Sending events to graphite server: {config.mercure["graphite_ip"]}')
         graphite_prefix='mercure.'+appliance_name+'.router.'+instance_name
@@ -175,9 +189,16 @@ if __name__ == '__main__':
     logger.info(f'Outgoing   folder: {config.mercure[mercure_folders.OUTGOING]}')
     logger.info(f'Processing folder: {config.mercure[mercure_folders.PROCESSING]}')
 
-    # Start the timer that will periodically trigger the scan of the incoming folder
+    # Start the timer that will periodically trigger the scan of the incoming folder. In watcher mode,
+    # the router is called continuously and waits inside for file events of the incoming folder
+    scan_interval=config.mercure['router_scan_interval']
+    if config.mercure['router_watch_incoming']:
+        logger.info('Watching incoming folder for file events')
+        incoming_watcher=IncomingWatcher(config.mercure[mercure_folders.INCOMING])
+        scan_interval=0
+
     global main_loop
-    main_loop = helper.RepeatedTimer(config.mercure['router_scan_interval'], run_router, exit_router, {})
+    main_loop = helper.RepeatedTimer(scan_interval, run_router, exit_router, {})
     main_loop.start()
 
     helper.g_log('events.boot', 1)
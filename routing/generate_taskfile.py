@@ -1,4 +1,5 @@
 import os
+import time
 from pathlib import Path
 import uuid
 import json
@@ -12,7 +13,7 @@ import common.config as config
 import common.rule_evaluation as rule_evaluation
 import common.monitor as monitor
 import common.helper as helper
-from common.constants import mercure_defs, mercure_names, mercure_sections, mercure_rule, mercure_config, mercure_options, mercure_actions
+from common.constants import mercure_defs, mercure_folders, mercure_names, mercure_sections, mercure_rule, mercure_config, mercure_options, mercure_actions
 
 
 logger = daiquiri.getLogger("generate_taskfile")
@@ -49,9 +50,28 @@ def add_dispatching(applied_rule, tags_list, target):
     dispatch_section[mercure_sections.DISPATCH]["target_port"]      =config.mercure[mercure_config.TARGETS][target]["port"]
     dispatch_section[mercure_sections.DISPATCH]["target_aet_target"]=config.mercure[mercure_config.TARGETS][target].get("aet_target","ANY-SCP")
     dispatch_section[mercure_sections.DISPATCH]["target_aet_source"]=config.mercure[mercure_config.TARGETS][target].get("aet_source","mercure")
+    dispatch_section[mercure_sections.DISPATCH]["priority"]         =config.mercure[mercure_config.RULES][applied_rule].get(mercure_rule.PRIORITY,mercure_options.NORMAL)
+    dispatch_section[mercure_sections.DISPATCH]["queued_at"]        =time.time()
     return dispatch_section
 
 
+def add_files(file_list, source_folder):
+    """Creates the manifest of the DICOM files of the series, so that the other services do not need to 
+       scan the folder for determining the number of files. The file names contain the SOP instance UIDs."""
+    total_size=0
+    for entry in file_list:
+        try:
+            total_size += os.stat(source_folder + entry + mercure_names.DCM).st_size
+        except OSError:
+            pass
+    files_section = {}
+    files_section[mercure_sections.FILES]={}
+    files_section[mercure_sections.FILES]["count"]=len(file_list)
+    files_section[mercure_sections.FILES]["size"] =total_size
+    files_section[mercure_sections.FILES]["names"]=[ entry + mercure_names.DCM for entry in file_list ]
+    return files_section
+
+
 def add_info(uid, uid_type, applied_rule, tags_list):
     info_section = {}
     info_section[mercure_sections.INFO]={}
@@ -92,11 +112,13 @@ def create_study_task(folder_name, applied_rule, study_UID, tags_list):
     return True
 
 
-def create_series_task_processing(folder_name, applied_rule, series_UID, tags_list):
+def create_series_task_processing(folder_name, applied_rule, series_UID, tags_list, file_list=None):
     """Generate task file with processing information for the series"""
 
     task_filename = folder_name + mercure_names.TASKFILE
     task_json = generate_taskfile_process(series_UID, mercure_options.SERIES, applied_rule, tags_list)
+    if file_list is not None:
+        task_json.update(add_files(file_list, config.mercure[mercure_folders.INCOMING] + '/'))
 
     try:
         with open(task_filename, 'w') as task_file:
@@ -0,0 +1,133 @@
+"""
+incoming_index.py
+=================
+In-memory index of the series contained in the incoming folder. The index can either be rebuilt
+by scanning the folder (polling mode) or kept up-to-date from inotify events (watcher mode).
+"""
+import os
+import time
+import daiquiri
+from inotify_simple import INotify, flags
+
+# App-specific includes
+from common.constants import mercure_defs, mercure_names
+
+
+logger = daiquiri.getLogger("incoming_index")
+
+
+class IncomingIndex:
+    """Map of all series in the incoming folder. For every series, the time of the latest received
+       file and the names of the files belonging to the series (without extension) are stored."""
+    def __init__(self, folder):
+        self.folder = folder
+        self.series = {}
+        self.error_files_found = False
+
+    def rescan(self):
+        """Rebuilds the index with a single pass over the incoming folder."""
+        self.series = {}
+        self.error_files_found = False
+
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(mercure_names.TAGS) and not entry.is_dir():
+                self.add_file(entry.name, entry.stat().st_mtime)
+            # Check if at least one .error file exists. In that case, the incoming folder should
+            # be searched for .error files at the end of the update run
+            if (not self.error_files_found) and entry.name.endswith(mercure_names.ERROR):
+                self.error_files_found = True
+
+    def add_file(self, filename, modification_time):
+        """Adds the given .tags file to the index."""
+        series_uid = filename.split(mercure_defs.SEPARATOR,1)[0]
+        stem_name = filename[:-len(mercure_names.TAGS)]
+
+        if series_uid in self.series:
+            if modification_time > self.series[series_uid]["time"]:
+                self.series[series_uid]["time"] = modification_time
+            self.series[series_uid]["files"].add(stem_name)
+        else:
+            self.series[series_uid] = { "time": modification_time, "files": { stem_name } }
+
+    def remove_file(self, filename):
+        """Removes the given .tags file from the index. Series without files are dropped."""
+        series_uid = filename.split(mercure_defs.SEPARATOR,1)[0]
+        if series_uid not in self.series:
+            return
+        self.series[series_uid]["files"].discard(filename[:-len(mercure_names.TAGS)])
+        if not self.series[series_uid]["files"]:
+            del self.series[series_uid]
+
+    def finish_series(self, series_uid, retry_at):
+        """Updates the index after the series has been routed. If the files have left the incoming folder,
+           the series is dropped, so that it is not routed again before the file events have been received.
+           Otherwise (e.g., if the series was locked or routing failed), the remaining files are kept and 
+           the series is routed again once the retry time has been reached."""
+        if series_uid not in self.series:
+            return
+        files = { name for name in self.series[series_uid]["files"] 
+                  if os.path.exists(os.path.join(self.folder, name + mercure_names.TAGS)) }
+        if not files:
+            del self.series[series_uid]
+            return
+        self.series[series_uid]["files"] = files
+        self.series[series_uid]["retry_at"] = retry_at
+
+    def get_filecount(self):
+        """Returns the number of .tags files contained in the index."""
+        return sum(len(self.series[entry]["files"]) for entry in self.series)
+
+    def get_complete_series(self, complete_trigger):
+        """Returns all series that did not receive any file for longer than the given trigger time (in sec)."""
+        now = time.time()
+        return { entry: self.series[entry] for entry in self.series 
+                 if (now-self.series[entry]["time"]) > complete_trigger and self.series[entry].get("retry_at", 0) <= now }
+
+    def get_next_completion(self, complete_trigger):
+        """Returns the time when the next series will exceed the trigger time (or reach its retry time), or None
+           if the index is empty."""
+        if not self.series:
+            return None
+        return min(max(self.series[entry]["time"] + complete_trigger, self.series[entry].get("retry_at", 0)) 
+                   for entry in self.series)
+
+
+class IncomingWatcher(IncomingIndex):
+    """Index of the incoming folder that is updated from inotify events, so that the folder does not need
+       to be scanned every time. A full rescan is only needed for reconciliation, e.g. if the kernel event
+       queue has overflown."""
+    WATCH_FLAGS = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+
+    def __init__(self, folder):
+        super().__init__(folder)
+        self.inotify = INotify()
+        # Register the watch before scanning the folder, so that no file can get lost between both steps
+        self.inotify.add_watch(folder, self.WATCH_FLAGS)
+        self.rescan()
+        self.last_rescan = time.time()
+
+    def wait(self, timeout):
+        """Waits until file events arrive or the timeout (in sec) has passed and applies the events to the index."""
+        for event in self.inotify.read(timeout=max(int(timeout*1000),0), read_delay=50):
+            if event.mask & flags.Q_OVERFLOW:
+                logger.warning("Event queue overflow. Rescanning incoming folder")
+                self.reconcile()
+                continue
+            if event.name.endswith(mercure_names.TAGS):
+                if event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    # The time of the event is used instead of the modification time of the file, which
+                    # saves one stat call per received file
+                    self.add_file(event.name, time.time())
+                else:
+                    self.remove_file(event.name)
+            elif event.name.endswith(mercure_names.ERROR) and event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                self.error_files_found = True
+
+    def reconcile(self):
+        """Performs a full rescan of the incoming folder to correct possible deviations of the index."""
+        self.rescan()
+        self.last_rescan = time.time()
+
+    def close(self):
+        """Releases the inotify instance."""
+        self.inotify.close()
@@ -10,9 +10,10 @@ import common.config as config
 import common.rule_evaluation as rule_evaluation
 import common.monitor as monitor
 import common.helper as helper
+import common.storage as storage
 import common.notification as notification
 from common.constants import mercure_defs, mercure_names, mercure_actions, mercure_rule, mercure_config, mercure_options, mercure_folders, mercure_events
-from routing.generate_taskfile import generate_taskfile_route, generate_taskfile_process, create_study_task, create_series_task_processing
+from routing.generate_taskfile import generate_taskfile_route, generate_taskfile_process, create_study_task, create_series_task_processing, add_files
 
 
 logger = daiquiri.getLogger("route_series")
@@ -64,8 +65,10 @@ def parse_ascconv(path):
         cur_dict[keys[-1]] = value 
     return data_dict
 
-def route_series(series_UID):
-    """Processes the series with the given series UID from the incoming folder."""
+def route_series(series_UID, fileList):
+    """Processes the series with the given series UID from the incoming folder. The list of files belonging
+       to the series (file names without extension) is collected by the router while scanning the incoming
+       folder, so that the folder does not need to be scanned again for every series."""
     lock_file=Path(config.mercure[mercure_folders.INCOMING] + '/' + str(series_UID) + mercure_names.LOCK)
 
     if lock_file.exists():
@@ -82,14 +85,6 @@ def route_series(series_UID):
         return
 
     logger.info(f'Processing series {series_UID}')
-    fileList = []
-    seriesPrefix=series_UID+"#"
-
-    # Collect all files belonging to the series
-    for entry in os.scandir(config.mercure[mercure_folders.INCOMING]):
-            if entry.name.endswith(mercure_names.TAGS) and entry.name.startswith(seriesPrefix) and not entry.is_dir():
-                stemName=entry.name[:-5]
-                fileList.append(stemName)
 
     logger.info("DICOM files found: "+str(len(fileList)))
 
@@ -116,7 +111,7 @@ def route_series(series_UID):
             tagsList=json.load(json_file)
     except Exception:
         logger.exception(f"Invalid tag information of series {series_UID}")
-        monitor.send_series_event(monitor.s_events.ERROR, entry, 0, "", "Invalid tag information")
+        monitor.send_series_event(monitor.s_events.ERROR, series_UID, 0, "", "Invalid tag information")
         monitor.send_event(monitor.h_events.PROCESSING, monitor.severity.ERROR, f"Invalid tag for series {series_UID}")        
         return
 
@@ -148,15 +143,28 @@ def route_series(series_UID):
         return
 
 
+# Index of the currently configured rules. Rebuilt whenever a new configuration has been loaded
+rule_index_cache = { "rules": None, "timestamp": None, "index": None }
+
+
+def get_rule_index():
+    """Returns the index of the configured rules, which is only rebuilt if the configuration has changed."""
+    rules = config.mercure["rules"]
+    if (rule_index_cache["rules"] is not rules) or (rule_index_cache["timestamp"]!=config.configuration_timestamp):
+        rule_index_cache["index"] = rule_evaluation.RuleIndex(rules)
+        rule_index_cache["rules"] = rules
+        rule_index_cache["timestamp"] = config.configuration_timestamp
+    return rule_index_cache["index"]
+
+
 def get_triggered_rules(tagList):
-    """Evaluates the routing rules and returns a list with trigger rules."""
+    """Evaluates the routing rules and returns a list with trigger rules. Only the rules that can
+       possibly trigger according to the rule index are evaluated, in the configured order."""
     triggered_rules = {}
     discard_rule = ""
 
-    for current_rule in config.mercure["rules"]:
+    for current_rule in get_rule_index().get_candidates(tagList):
         try:
-            if config.mercure["rules"][current_rule].get(mercure_rule.DISABLED,"False")=="True":
-                continue
             if rule_evaluation.parse_rule(config.mercure["rules"][current_rule].get(mercure_rule.RULE,"False"),tagList):
                 triggered_rules[current_rule]=current_rule
                 if config.mercure["rules"][current_rule].get(mercure_rule.ACTION,"")==mercure_actions.DISCARD:
@@ -334,7 +342,7 @@ def push_serieslevel_processing(triggered_rules,file_list,series_UID,tags_list):
                     return False
 
                 # Generate task file with processing information
-                if (not create_series_task_processing(target_folder, current_rule, series_UID, tags_list)):
+                if (not create_series_task_processing(target_folder, current_rule, series_UID, tags_list, file_list)):
                     return False
 
                 if (not push_files(file_list, target_folder, copy_files)):
@@ -378,6 +386,9 @@ def push_serieslevel_outgoing(triggered_rules,file_list,series_UID,tags_list,sel
     if len(triggered_rules)==1:
         move_operation=True
 
+    # The manifest is identical for all targets, so the files only need to be checked once
+    files_manifest=add_files(file_list, source_folder) if selected_targets else {}
+
     for target in selected_targets:
         if not target in config.mercure["targets"]:
             logger.error(f"Invalid target selected {target}")
@@ -400,7 +411,7 @@ def push_serieslevel_outgoing(triggered_rules,file_list,series_UID,tags_list,sel
             return
 
         try:
-            lock_file=Path(folder_name / mercure_names.LOCK)
+            lock_file=Path(folder_name) / mercure_names.LOCK
             lock=helper.FileLock(lock_file)
         except:
             # Can't create lock file, so something must be seriously wrong
@@ -412,6 +423,7 @@ def push_serieslevel_outgoing(triggered_rules,file_list,series_UID,tags_list,sel
         # Generate task file with dispatch information
         task_filename = target_folder + mercure_names.TASKFILE
         task_json = generate_taskfile_route(series_UID, mercure_options.SERIES, selected_targets[target], tags_list, target)
+        task_json.update(files_manifest)
 
         try:
             with open(task_filename, 'w') as task_file:
@@ -423,10 +435,11 @@ def push_serieslevel_outgoing(triggered_rules,file_list,series_UID,tags_list,sel
 
         monitor.send_series_event(monitor.s_events.ROUTE, series_UID, len(file_list), target, selected_targets[target])
 
+        # The files in the outgoing folder are not modified, so hard links can be used instead of copies
         if move_operation:
             operation=shutil.move
         else:
-            operation=shutil.copy
+            operation=storage.link_or_copy
 
         for entry in file_list:
             try:
@@ -457,7 +470,7 @@ def push_files(file_list, target_path, copy_files):
     if (copy_files==False):
         operation=shutil.move
     else:
-        operation=shutil.copy
+        operation=storage.clone_or_copy
 
     source_folder=config.mercure[mercure_folders.INCOMING] + '/'
     target_folder=target_path + '/'  
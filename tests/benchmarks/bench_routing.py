@@ -0,0 +1,164 @@
+"""
+bench_routing.py
+================
+Benchmarks for the routing decision path of the router. The tags dictionaries are generated from
+the tag list of getdcmtags, so that they have the same shape as the .tags files in the incoming
+folder. The benchmarks are not collected by the regular test run and need to be called explicitly:
+
+    python -m pytest tests/benchmarks/bench_routing.py
+
+The throughput is reported as "series_per_second" in the extra info of each benchmark (use
+--benchmark-json to store the results for comparisons between versions).
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+
+import pytest
+
+import common.config as config
+import routing.route_series as route_series
+import webinterface.tagslist as tagslist
+from common.constants import mercure_names
+
+
+SERIES_COUNT = 200
+FILES_PER_SERIES = 20
+
+modalities = ["MR", "CT", "PT", "CR", "US", "XA"]
+manufacturers = ["SIEMENS", "GE MEDICAL SYSTEMS", "Philips", "TOSHIBA"]
+models = ["Prisma", "Skyra", "Trio", "Revolution", "Ingenia", "Aquilion"]
+stations = [f"STATION{i:03d}" for i in range(50)]
+descriptions = ["T1 MPRAGE", "T2 FLAIR", "DWI", "AX 5mm", "COR T1 POST", "LOCALIZER"]
+
+
+def generate_tags(rng, series_uid):
+    """Generates a tags dictionary with the same keys as written by getdcmtags."""
+    if not tagslist.alltags:
+        tagslist.read_tagslist()
+    tags = dict(tagslist.alltags)
+    tags["Modality"] = rng.choice(modalities)
+    tags["Manufacturer"] = rng.choice(manufacturers)
+    tags["ManufacturerModelName"] = rng.choice(models)
+    tags["StationName"] = rng.choice(stations)
+    tags["SeriesDescription"] = rng.choice(descriptions)
+    tags["SeriesInstanceUID"] = series_uid
+    tags["Filename"] = "image.dcm"
+    return tags
+
+
+def generate_rule(rng):
+    """Generates a rule expression similar to the rules used in practice."""
+    kind = rng.randrange(4)
+    if kind == 0:
+        return f"@Modality@ == '{rng.choice(modalities)}'"
+    if kind == 1:
+        return f"(@Modality@ == '{rng.choice(modalities)}') and (@StationName@ == '{rng.choice(stations)}')"
+    if kind == 2:
+        return f"'{rng.choice(models)[:3]}' in @ManufacturerModelName@"
+    return f"(@Manufacturer@ == '{rng.choice(manufacturers)}') and ('T1' in @SeriesDescription@)"
+
+
+def generate_rules(rng, count):
+    """Generates the rules section of the configuration with the given number of routing rules."""
+    rules = {}
+    for i in range(count):
+        rules[f"rule{i:04d}"] = {
+            "rule": generate_rule(rng),
+            "action": "route",
+            "action_trigger": "series",
+            "target": "pacs",
+        }
+    return rules
+
+
+@pytest.fixture
+def corpus():
+    rng = random.Random(42)
+    return [generate_tags(rng, f"1.2.826.0.1.3680043.8.498.{i}") for i in range(SERIES_COUNT)]
+
+
+@pytest.fixture
+def router_config(mocker):
+    mocker.patch("routing.route_series.monitor.send_event")
+    mocker.patch("routing.route_series.monitor.send_series_event")
+    mocker.patch("routing.route_series.monitor.send_register_series")
+    mocker.patch("routing.route_series.monitor.send_series_sequence_data")
+    mocker.patch("common.rule_evaluation.monitor.send_event")
+    mocker.patch.object(route_series.logger, "info")
+    mocker.patch.object(route_series.logger, "error")
+    mocker.patch.dict(config.mercure, dict(config.mercure_defaults))
+    config.mercure["targets"] = { "pacs": { "ip": "127.0.0.1", "port": "104", "aet_target": "PACS", "aet_source": "mercure" } }
+    return config.mercure
+
+
+def _report(benchmark, series_count):
+    if benchmark.stats:
+        benchmark.extra_info["series_per_second"] = series_count / benchmark.stats.stats.mean
+
+
+@pytest.mark.parametrize("rule_count", [10, 100, 1000])
+def test_get_triggered_rules(benchmark, corpus, router_config, rule_count):
+    router_config["rules"] = generate_rules(random.Random(rule_count), rule_count)
+
+    def evaluate_corpus():
+        for tags in corpus:
+            route_series.get_triggered_rules(tags)
+
+    benchmark(evaluate_corpus)
+    _report(benchmark, len(corpus))
+
+
+@pytest.mark.parametrize("rule_count", [10, 100, 1000])
+def test_parse_rule(benchmark, corpus, router_config, rule_count):
+    rules = [generate_rule(random.Random(i)) for i in range(rule_count)]
+
+    def evaluate_corpus():
+        for tags in corpus:
+            for rule in rules:
+                route_series.rule_evaluation.parse_rule(rule, tags)
+
+    benchmark(evaluate_corpus)
+    _report(benchmark, len(corpus))
+
+
+@pytest.mark.parametrize("rule_count", [10, 100])
+def test_route_series(benchmark, corpus, router_config, rule_count):
+    """End-to-end routing of complete series from the incoming folder into the outgoing folder. The
+       folders are placed on tmpfs (if available), so that the disk speed does not dominate."""
+    base = tempfile.mkdtemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    for folder in ["incoming", "outgoing", "discard", "processing", "studies"]:
+        os.mkdir(os.path.join(base, folder))
+        router_config[folder + "_folder"] = os.path.join(base, folder)
+    router_config["rules"] = generate_rules(random.Random(rule_count), rule_count)
+
+    def fill_incoming():
+        for folder in ["outgoing", "discard"]:
+            shutil.rmtree(os.path.join(base, folder))
+            os.mkdir(os.path.join(base, folder))
+        series = {}
+        for tags in corpus:
+            series_uid = tags["SeriesInstanceUID"]
+            series[series_uid] = []
+            for i in range(FILES_PER_SERIES):
+                stem = f"{series_uid}#{i:05d}"
+                with open(os.path.join(base, "incoming", stem + mercure_names.DCM), "wb") as f:
+                    f.write(b"\0" * 1024)
+                with open(os.path.join(base, "incoming", stem + mercure_names.TAGS), "w") as f:
+                    json.dump(tags, f)
+                series[series_uid].append(stem)
+        return (series,), {}
+
+    def route_all(series):
+        for series_uid in series:
+            route_series.route_series(series_uid, series[series_uid])
+
+    try:
+        benchmark.pedantic(route_all, setup=fill_incoming, rounds=3)
+        _report(benchmark, len(corpus))
+        assert not os.listdir(os.path.join(base, "incoming"))
+        assert len(os.listdir(os.path.join(base, "outgoing"))) + len(os.listdir(os.path.join(base, "discard"))) == len(corpus)
+    finally:
+        shutil.rmtree(base)
@@ -0,0 +1,114 @@
+import json
+
+import requests
+
+import common.monitor as monitor
+from common.monitor import EventSender, RegistrationForwarder
+
+
+def _create_sender(mocker, journal_file, fail=False):
+    sender = EventSender("http://bookkeeper", str(journal_file))
+    post = mocker.patch.object(sender.session, "post")
+    post.return_value.status_code = 200
+    if fail:
+        post.side_effect = requests.exceptions.ConnectionError()
+    return sender, post
+
+
+def test_events_are_sent_in_batches(mocker, tmp_path):
+    sender, post = _create_sender(mocker, tmp_path / "router.main.journal")
+    sender.start()
+    for i in range(5):
+        sender.submit("/series-event", { "series_uid": str(i) })
+    sender.submit("/mercure-event", { "event": "BOOT" })
+    sender.stop()
+
+    urls = [call[0][0] for call in post.call_args_list]
+    assert "http://bookkeeper/series-event/bulk" in urls
+    assert "http://bookkeeper/mercure-event/bulk" in urls
+    sent = sum(len(call[1]["json"]) for call in post.call_args_list)
+    assert sent == 6
+    assert not (tmp_path / "router.main.journal").exists()
+
+
+def test_events_are_journaled_if_bookkeeper_unreachable(mocker, tmp_path):
+    journal_file = tmp_path / "router.main.journal"
+    sender, post = _create_sender(mocker, journal_file, fail=True)
+    sender.start()
+    sender.submit("/series-event", { "series_uid": "1" })
+    sender.submit("/series-event", { "series_uid": "2" })
+    sender.stop()
+
+    lines = journal_file.read_text().splitlines()
+    assert [json.loads(line)["payload"]["series_uid"] for line in lines] == ["1", "2"]
+
+
+def test_journal_is_replayed_before_new_events(mocker, tmp_path):
+    journal_file = tmp_path / "router.main.journal"
+    journal_file.write_text(json.dumps({ "endpoint": "/series-event", "payload": { "series_uid": "old" } })+"\n")
+
+    sender, post = _create_sender(mocker, journal_file)
+    sender.start()
+    sender.submit("/series-event", { "series_uid": "new" })
+    sender.stop()
+
+    sent = [entry["series_uid"] for call in post.call_args_list for entry in call[1]["json"]]
+    assert sent == ["old", "new"]
+    assert not journal_file.exists()
+
+
+def test_rejected_events_are_dropped(mocker, tmp_path):
+    """ Events rejected as invalid are not journaled, and only the groups that could not be
+    delivered are journaled if the bookkeeper fails. """
+    journal_file = tmp_path / "router.main.journal"
+    sender, post = _create_sender(mocker, journal_file)
+    responses = { "http://bookkeeper/series-event/bulk": 400, "http://bookkeeper/mercure-event/bulk": 200,
+                  "http://bookkeeper/webgui-event/bulk": 503 }
+    post.side_effect = lambda url, **kwargs: mocker.Mock(status_code=responses[url])
+
+    sender._send_batch([("/series-event", { "series_uid": "invalid" }), ("/mercure-event", { "event": "BOOT" }),
+                        ("/webgui-event", { "event": "LOGIN" })])
+
+    lines = journal_file.read_text().splitlines()
+    assert [json.loads(line)["endpoint"] for line in lines] == ["/webgui-event"]
+
+
+def test_replay_continues_after_delivered_events(mocker, tmp_path):
+    journal_file = tmp_path / "router.main.journal"
+    journal_file.write_text("".join(json.dumps({ "endpoint": "/series-event", "payload": { "series_uid": str(i) } })+"\n"
+                                    for i in range(5)))
+    sender, post = _create_sender(mocker, journal_file)
+    sender.BATCH_SIZE = 2
+    post.side_effect = [mocker.Mock(status_code=200), requests.exceptions.ConnectionError()]
+
+    assert not sender._replay_journal()
+
+    post.side_effect = None
+    assert sender._replay_journal()
+    sent = [entry["series_uid"] for call in post.call_args_list for entry in call[1]["json"]]
+    assert sent == ["0", "1", "2", "3", "2", "3", "4"]
+
+
+def test_registrations_are_forwarded_from_spool_file(mocker, tmp_path):
+    submit = mocker.patch.object(monitor, "submit")
+    spool_file = tmp_path / "registration.spool"
+    spool_file.write_text("1.2.3#MR.1\t1.2.3.1\t1.2.3\n1.2.3#MR.2\t1.2.3.2\t1.2.3\nincomplete\n")
+    forwarder = RegistrationForwarder(str(spool_file))
+
+    assert forwarder.forward() == 2
+    submit.assert_any_call("/register-dicom", { "filename": "1.2.3#MR.2", "file_uid": "1.2.3.2", "series_uid": "1.2.3" })
+    assert not spool_file.exists()
+    assert not (tmp_path / "registration.spool.forward").exists()
+    assert forwarder.forward() == 0
+
+
+def test_events_contain_the_time_of_occurrence(mocker):
+    sender = mocker.Mock()
+    mocker.patch.object(monitor, "event_sender", sender)
+    mocker.patch("common.monitor.time.time", return_value=1000.0)
+
+    monitor.submit("/series-event", { "series_uid": "1" })
+    monitor.submit("/series-event", { "series_uid": "2", "event_time": 900.0 })
+
+    payloads = [call[0][1] for call in sender.submit.call_args_list]
+    assert [payload["event_time"] for payload in payloads] == [1000.0, 900.0]
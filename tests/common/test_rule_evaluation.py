@@ -0,0 +1,70 @@
+from common.rule_evaluation import compile_rule, evaluate_rule, parse_rule, test_rule as check_rule
+from common.rule_evaluation import get_index_predicate, RuleIndex
+
+
+tags = { "Modality": "MR", "ManufacturerModelName": "Trio", "StationName": "O'Brien MR" }
+
+
+def test_parse_rule():
+    assert parse_rule("('Tr' in @ManufacturerModelName@) | (@ManufacturerModelName@ == 'Trio')", tags)
+    assert not parse_rule("@Modality@ == 'CT'", tags)
+
+
+def test_parse_rule_with_quotes_in_tag_value():
+    assert parse_rule("@StationName@ == \"O'Brien MR\"", tags)
+
+
+def test_parse_rule_with_missing_tag(mocker):
+    mocker.patch("common.rule_evaluation.monitor.send_event")
+    assert not parse_rule("@SeriesDescription@ == 'COR T1'", tags)
+
+
+def test_parse_rule_with_invalid_syntax(mocker):
+    mock = mocker.patch("common.rule_evaluation.monitor.send_event")
+    assert not parse_rule("@Modality@ ==", tags)
+    assert mock.called
+
+
+def test_compiled_rule_is_cached():
+    rule = "@Modality@ == 'MR'"
+    assert compile_rule(rule) is compile_rule(rule)
+    assert evaluate_rule(compile_rule(rule), tags)
+
+
+def test_test_rule():
+    assert check_rule("@Modality@ == 'MR'", tags) == "True"
+    assert check_rule("@Modality@ == 'CT'", tags) == "False"
+    assert check_rule("@SeriesDescription@ == 'CT'", tags).startswith("Rule contains invalid tag")
+    assert check_rule("@SeriesDescription@ == 'CT'", { "SeriesDescription": "MissingTag" }) == "Rule contains invalid tag"
+    assert check_rule("@Modality@ != 'MissingTag'", tags) == "True"
+
+
+def test_index_predicate():
+    assert get_index_predicate("@Modality@ == 'MR'") == ("Modality", frozenset(["MR"]))
+    assert get_index_predicate("'CT' == @Modality@") == ("Modality", frozenset(["CT"]))
+    assert get_index_predicate("@Modality@ in ('CT', 'MR')") == ("Modality", frozenset(["CT", "MR"]))
+    assert get_index_predicate("('Tr' in @ManufacturerModelName@) and (@StationName@ == 'ST1')") == ("StationName", frozenset(["ST1"]))
+    assert get_index_predicate("(@Modality@ == 'CT') | (@Modality@ == 'MR')") == ("Modality", frozenset(["CT", "MR"]))
+
+
+def test_index_predicate_not_indexable():
+    assert get_index_predicate("'Tr' in @ManufacturerModelName@") is None
+    assert get_index_predicate("(@Modality@ == 'CT') or (@StationName@ == 'ST1')") is None
+    assert get_index_predicate("not (@Modality@ == 'CT')") is None
+    assert get_index_predicate("@Modality@ in 'CTMR'") is None
+    assert get_index_predicate("@Modality@ ==") is None
+
+
+def test_rule_index_candidates():
+    rules = {
+        "ct": { "rule": "@Modality@ == 'CT'" },
+        "trio": { "rule": "'Tr' in @ManufacturerModelName@" },
+        "mr": { "rule": "@Modality@ in ('MR', 'PT')" },
+        "disabled": { "rule": "@Modality@ == 'MR'", "disabled": "True" },
+        "station": { "rule": "@StationName@ == 'MR1'" },
+    }
+    index = RuleIndex(rules)
+    assert index.get_candidates(tags) == ["trio", "mr"]
+    assert index.get_candidates({ "Modality": "CT", "StationName": "MR1" }) == ["ct", "trio", "station"]
+    # Rules on missing tags stay candidates, so that they are reported as invalid
+    assert index.get_candidates({ "Modality": "CT" }) == ["ct", "trio", "station"]
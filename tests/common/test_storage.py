@@ -0,0 +1,36 @@
+import errno
+import os
+
+import pytest
+
+import common.storage as storage
+
+
+def test_link_or_copy_creates_hard_link(tmp_path):
+    (tmp_path / "a.dcm").write_text("data")
+    storage.link_or_copy(tmp_path / "a.dcm", tmp_path / "b.dcm")
+    assert os.stat(tmp_path / "a.dcm").st_ino == os.stat(tmp_path / "b.dcm").st_ino
+
+
+def test_clone_or_copy_creates_independent_copy(tmp_path):
+    (tmp_path / "a.dcm").write_text("data")
+    storage.clone_or_copy(tmp_path / "a.dcm", tmp_path / "b.dcm")
+    (tmp_path / "b.dcm").write_text("modified")
+    assert (tmp_path / "a.dcm").read_text() == "data"
+
+
+def test_move_folder_copies_between_filesystems(tmp_path, mocker):
+    (tmp_path / "source").mkdir()
+    (tmp_path / "source" / "a.dcm").write_text("data")
+    event = mocker.patch("common.storage.monitor.send_event")
+    rename = mocker.patch("common.storage.os.rename", side_effect=OSError(errno.EXDEV, "Cross-device link"))
+
+    storage.move_folder(tmp_path / "source", tmp_path / "target")
+
+    assert (tmp_path / "target" / "a.dcm").read_text() == "data"
+    assert not (tmp_path / "source").exists()
+    assert event.called
+
+    rename.side_effect = OSError(errno.EACCES, "Permission denied")
+    with pytest.raises(OSError):
+        storage.move_folder(tmp_path / "target", tmp_path / "other")
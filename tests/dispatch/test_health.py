@@ -0,0 +1,56 @@
+from dispatch.health import TargetHealth
+
+
+def test_circuit_opens_after_consecutive_connection_failures(mocker):
+    mocker.patch("dispatch.health.send_event")
+    health = TargetHealth()
+    for _ in range(TargetHealth.FAILURE_THRESHOLD - 1):
+        health.record_failure("pacs", 61, now=1000)
+    assert health.allow("pacs", now=1000)
+
+    health.record_failure("pacs", 61, now=1000)
+    assert health.is_open("pacs")
+    assert not health.allow("pacs", now=1000 + TargetHealth.OPEN_TIME - 1)
+    assert health.allow("other", now=1000)
+
+    # Only one probe is allowed once the open time has passed
+    assert health.allow("pacs", now=1000 + TargetHealth.OPEN_TIME)
+    assert not health.allow("pacs", now=1000 + TargetHealth.OPEN_TIME + 1)
+
+    health.record_success("pacs")
+    assert not health.is_open("pacs")
+    assert health.allow("pacs", now=1000 + TargetHealth.OPEN_TIME + 1)
+
+
+def test_open_time_doubles_if_probe_fails(mocker):
+    mocker.patch("dispatch.health.send_event")
+    health = TargetHealth()
+    for _ in range(TargetHealth.FAILURE_THRESHOLD):
+        health.record_failure("pacs", 61, now=0)
+    probe_time = TargetHealth.OPEN_TIME
+    assert health.allow("pacs", now=probe_time)
+    health.record_failure("pacs", 61, now=probe_time)
+
+    assert not health.allow("pacs", now=probe_time + 2 * TargetHealth.OPEN_TIME - 1)
+    assert health.allow("pacs", now=probe_time + 2 * TargetHealth.OPEN_TIME)
+
+
+def test_series_errors_do_not_open_circuit(mocker):
+    mocker.patch("dispatch.health.send_event")
+    health = TargetHealth()
+    for _ in range(TargetHealth.FAILURE_THRESHOLD):
+        health.record_failure("pacs", 23)
+    assert not health.is_open("pacs")
+
+
+def test_released_probe_can_be_used_by_next_transfer(mocker):
+    mocker.patch("dispatch.health.send_event")
+    health = TargetHealth()
+    for _ in range(TargetHealth.FAILURE_THRESHOLD):
+        health.record_failure("pacs", 61, now=0)
+    assert health.allow("pacs", now=TargetHealth.OPEN_TIME)
+
+    # The probe has not been started (e.g., held back by the throttle)
+    health.release("pacs")
+    assert health.is_open("pacs")
+    assert health.allow("pacs", now=TargetHealth.OPEN_TIME + 1)
@@ -0,0 +1,30 @@
+import threading
+
+from dispatch.pool import DispatchPool
+
+
+def test_pool_limits_transfers_per_target():
+    pool = DispatchPool(3, 1)
+    release = threading.Event()
+    sent = []
+
+    def send(folder):
+        release.wait(5)
+        sent.append(folder)
+
+    assert pool.submit(["/outgoing/a"], "pacs", send, "/outgoing/a")
+    assert not pool.submit(["/outgoing/a"], "other", send, "/outgoing/a")
+    assert not pool.submit(["/outgoing/b"], "pacs", send, "/outgoing/b")
+    assert pool.submit(["/outgoing/c"], "archive", send, "/outgoing/c")
+    assert pool.submit(["/outgoing/d", "/outgoing/f"], "research", send, "/outgoing/d")
+    assert pool.is_full()
+    assert not pool.submit(["/outgoing/e"], "other", send, "/outgoing/e")
+    assert pool.is_active("/outgoing/a")
+    assert pool.is_active("/outgoing/f")
+
+    release.set()
+    pool.shutdown()
+    assert sorted(sent) == ["/outgoing/a", "/outgoing/c", "/outgoing/d"]
+    assert not pool.is_active("/outgoing/a")
+    assert pool.can_submit("pacs")
+
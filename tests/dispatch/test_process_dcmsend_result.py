@@ -0,0 +1,42 @@
+from dispatch.process_dcmsend_result import parse, parse_report, FILE_SUCCESS, FILE_ERROR, FILE_NOT_SENT
+
+
+REPORT = """
+dcmsend v3.6.5 (2019-10-28)
+
+Communication Peer : 10.0.0.1:104
+AE Titles used     : MERCURE -> PACS
+Current Date/Time  : 2021-01-02 10:11:12
+
+Transfer List
+-------------
+/var/mercure/outgoing/a/1.dcm : SOP instance sent successfully (Success)
+/var/mercure/outgoing/a/2.dcm
+  Error 0xa700 (Refused: Out of Resources)
+/var/mercure/outgoing/a/3.dcm : not sent to the peer
+
+Status Summary
+--------------
+Number of associations   : 1
+Number of pres. contexts : 1
+Number of SOP instances  : 3
+- sent to the peer       : 2
+  * with status SUCCESS  : 1
+  * with status WARNING  : 0
+  * with status ERROR    : 1
+- not sent to the peer   : 1
+"""
+
+
+def test_parse_report(fs):
+    fs.create_file("/var/report.txt", contents=REPORT)
+    report = parse_report("/var/report.txt")
+
+    assert report.header == { "communication_peer": "10.0.0.1:104", "ae_titles_used": "MERCURE -> PACS",
+                              "current_datetime": "2021-01-02 10:11:12" }
+    assert report.summary == { "associations": 1, "presentation_contexts": 1, "sop_instances": 3, "sent_to_peer": 2,
+                               "successfull": 1, "warning": 0, "error": 1, "not_sent": 1 }
+    assert report.file_status == { "/var/mercure/outgoing/a/1.dcm": FILE_SUCCESS,
+                                   "/var/mercure/outgoing/a/2.dcm": FILE_ERROR,
+                                   "/var/mercure/outgoing/a/3.dcm": FILE_NOT_SENT }
+    assert parse("/var/report.txt")["summary"]["error"] == 1
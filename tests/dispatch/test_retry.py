@@ -6,7 +6,7 @@ from subprocess import CalledProcessError
 
 import pytest
 
-from dispatch.retry import increase_retry
+from dispatch.retry import increase_retry, RetryQueue
 from common.constants import mercure_names
 
 
@@ -41,3 +41,35 @@ def test_execute_increase_fail(fs, mocker):
     result = increase_retry(source, 5, 50)
 
     assert not result
+
+
+def test_execute_increase_backoff(fs, mocker):
+    source = "/var/data"
+    fs.create_dir(source)
+    target = { "dispatch": { "target_ip": "0.0.0.0", "target_aet_target": "a", "target_port": 90, "retries": 2 } }
+    fs.create_file("/var/data/"+mercure_names.TASKFILE, contents=json.dumps(target))
+    mocker.patch("dispatch.retry.time.time", return_value=1000)
+    assert increase_retry(source, 5, 50)
+
+    with open("/var/data/"+mercure_names.TASKFILE, "r") as f:
+        modified_target = json.load(f)
+
+    assert modified_target["dispatch"]["retries"] == 3
+    assert modified_target["dispatch"]["next_retry_at"] == 1000 + 200
+
+
+def test_retry_queue_releases_due_folders(fs):
+    fs.create_dir("/var/outgoing")
+    queue = RetryQueue("/var/outgoing/.retry_queue_main.json")
+    queue.add("a", 100)
+    queue.add("b", 200)
+    queue.add("a", 300)
+
+    assert queue.release_due(250) == ["b"]
+    assert queue.is_waiting("a")
+    assert not queue.is_waiting("b")
+
+    restored = RetryQueue("/var/outgoing/.retry_queue_main.json")
+    assert restored.is_waiting("a")
+    assert restored.release_due(300) == ["a"]
+    assert not restored.is_waiting("a")
@@ -0,0 +1,54 @@
+from datetime import datetime
+from pathlib import Path
+
+from dispatch.scheduler import order_folders
+
+
+def _names(queue):
+    return [folder.name for folder, _ in queue]
+
+
+def _now(hour):
+    return datetime(2021, 3, 1, hour, 0).timestamp()
+
+
+def test_urgent_series_are_sent_first():
+    now = _now(12)
+    candidates = [
+        (Path("/outgoing/routine_old"), { "priority": "normal", "queued_at": now - 600 }),
+        (Path("/outgoing/routine_new"), { "priority": "normal", "queued_at": now - 10 }),
+        (Path("/outgoing/stroke"),      { "priority": "urgent", "queued_at": now - 1 }),
+        (Path("/outgoing/legacy"),      { "queued_at": now - 300 }),
+    ]
+    queue = order_folders(candidates, 3600, "22:00", "06:00", now)
+    assert _names(queue) == ["stroke", "routine_old", "legacy", "routine_new"]
+
+
+def test_urgent_series_are_sent_before_long_waiting_series():
+    now = _now(12)
+    candidates = [
+        (Path("/outgoing/stroke"),  { "priority": "urgent", "queued_at": now - 1 }),
+        (Path("/outgoing/routine"), { "priority": "normal", "queued_at": now - 40000 }),
+    ]
+    queue = order_folders(candidates, 3600, "22:00", "06:00", now)
+    assert _names(queue) == ["stroke", "routine"]
+
+
+def test_offpeak_series_are_not_starved():
+    now = _now(23)
+    candidates = [
+        (Path("/outgoing/research_new"), { "priority": "offpeak", "queued_at": now - 60 }),
+        (Path("/outgoing/routine"),      { "priority": "normal",  "queued_at": now - 10 }),
+        (Path("/outgoing/research_old"), { "priority": "offpeak", "queued_at": now - 4000 }),
+    ]
+    queue = order_folders(candidates, 3600, "22:00", "06:00", now)
+    assert _names(queue) == ["research_old", "routine", "research_new"]
+
+
+def test_offpeak_series_are_deferred_to_offpeak_window():
+    candidates = [
+        (Path("/outgoing/research"), { "priority": "offpeak", "queued_at": _now(1) - 60 }),
+        (Path("/outgoing/routine"),  { "priority": "normal",  "queued_at": _now(1) - 10 }),
+    ]
+    assert _names(order_folders(candidates, 3600, "22:00", "06:00", _now(12))) == ["routine"]
+    assert _names(order_folders(candidates, 3600, "22:00", "06:00", _now(23))) == ["routine", "research"]
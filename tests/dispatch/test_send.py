@@ -6,7 +6,7 @@ from subprocess import CalledProcessError
 
 import pytest
 
-from dispatch.send import execute, is_ready_for_sending
+from dispatch.send import execute, execute_batch, is_ready_for_sending
 from common.constants import mercure_names
 
 
@@ -123,3 +123,125 @@ def test_execute_error_case_delay_is_not_over(fs, mocker):
     
     execute(Path(source), Path(success), Path(error), 5, 1)
     assert not mock.called
+
+
+def test_execute_batch_retries_only_failed_folders(fs, mocker):
+    """ Two folders are sent with one dcmsend call. The report lists a failed file for the
+    second folder, so only the first folder is moved to the success folder. """
+    outgoing = "/var/data/outgoing"
+    success = "/var/data/success"
+    error = "/var/data/error"
+    fs.create_dir(success)
+    fs.create_dir(error)
+    batch = []
+    for name in ["a", "b"]:
+        fs.create_file(f"{outgoing}/{name}/{name}.dcm")
+        target = { "dispatch": {"target_name": "pacs", "target_ip": "1.2.3.4", "target_aet_target": "a", "target_port": 90 } }
+        fs.create_file(f"{outgoing}/{name}/"+mercure_names.TASKFILE, contents=json.dumps(target))
+        batch.append((Path(outgoing) / name, target["dispatch"]))
+
+    def dcmsend(command, check):
+        assert command[:3] == ["dcmsend", "1.2.3.4", "90"]
+        assert f"{outgoing}/a" in command and f"{outgoing}/b" in command
+        report = command[command.index("+crf")+1]
+        with open(report, "w") as f:
+            f.write(f"Status Information\n{outgoing}/a/a.dcm : Success\n{outgoing}/b/b.dcm : Error 0xa700\n")
+
+    mocker.patch("dispatch.send.run", side_effect=dcmsend)
+    execute_batch(batch, Path(success), Path(error), 5, 1)
+
+    assert (Path(success) / "a" / "a.dcm").exists()
+    assert (Path(success) / "a" / mercure_names.SENDLOG).exists()
+    assert (Path(outgoing) / "b" / "b.dcm").exists()
+    assert not (Path(outgoing) / "b" / mercure_names.PROCESSING).exists()
+    with open(f"{outgoing}/b/"+mercure_names.TASKFILE, "r") as f:
+        assert json.load(f)["dispatch"]["retries"] == 1
+    assert os.listdir(outgoing) == ["b"]
+
+
+def test_execute_resends_only_failed_files(fs, mocker):
+    """ The first transfer fails after sending one of the two files. The retry only sends the
+    remaining file, and the sent folder contains both files afterwards. """
+    outgoing = "/var/data/outgoing"
+    success = "/var/data/success"
+    error = "/var/data/error"
+    fs.create_dir(success)
+    fs.create_dir(error)
+    fs.create_file(f"{outgoing}/a/one.dcm")
+    fs.create_file(f"{outgoing}/a/two.dcm")
+    target = { "dispatch": {"target_name": "pacs", "target_ip": "1.2.3.4", "target_aet_target": "a", "target_port": 90 } }
+    fs.create_file(f"{outgoing}/a/"+mercure_names.TASKFILE, contents=json.dumps(target))
+    sent_files = []
+
+    def dcmsend(command, check):
+        files = sorted(os.listdir(f"{outgoing}/a"))
+        sent_files.append([f for f in files if f.endswith(".dcm")])
+        report = command[command.index("+crf")+1]
+        with open(report, "w") as f:
+            f.write(f"Status Information\n{outgoing}/a/one.dcm : Success\n")
+            if len(sent_files) == 1:
+                f.write(f"{outgoing}/a/two.dcm : Not sent\n")
+            else:
+                f.write(f"{outgoing}/a/two.dcm : Success\n")
+        if len(sent_files) == 1:
+            raise CalledProcessError(62, cmd="dcmsend")
+
+    mocker.patch("dispatch.send.run", side_effect=dcmsend)
+    execute(Path(outgoing) / "a", Path(success), Path(error), 5, 0)
+    assert (Path(outgoing) / "a" / mercure_names.SENT / "one.dcm").exists()
+
+    execute(Path(outgoing) / "a", Path(success), Path(error), 5, 0)
+    assert sent_files == [["one.dcm", "two.dcm"], ["two.dcm"]]
+    assert (Path(success) / "a" / "one.dcm").exists()
+    assert (Path(success) / "a" / "two.dcm").exists()
+    assert not (Path(success) / "a" / mercure_names.SENT).exists()
+
+
+def test_execute_completes_folder_if_failed_transfer_sent_all_files(fs, mocker):
+    """ The transfer reports an error after all files have been sent. The folder is moved to the
+    success folder, also if the files have been kept aside by an earlier attempt, without sending
+    an empty folder. """
+    outgoing = "/var/data/outgoing"
+    success = "/var/data/success"
+    fs.create_dir(success)
+    target = { "dispatch": {"target_name": "pacs", "target_ip": "1.2.3.4", "target_aet_target": "a", "target_port": 90 } }
+    fs.create_file(f"{outgoing}/a/one.dcm")
+    fs.create_file(f"{outgoing}/a/"+mercure_names.TASKFILE, contents=json.dumps(target))
+    fs.create_file(f"{outgoing}/b/{mercure_names.SENT}/one.dcm")
+    fs.create_file(f"{outgoing}/b/"+mercure_names.TASKFILE, contents=json.dumps(dict(target, files={ "count": 1 })))
+
+    def dcmsend(command, check):
+        with open(command[command.index("+crf")+1], "w") as f:
+            f.write(f"Status Information\n{outgoing}/a/one.dcm : Success\n")
+        raise CalledProcessError(62, cmd="dcmsend")
+
+    run = mocker.patch("dispatch.send.run", side_effect=dcmsend)
+    execute(Path(outgoing) / "a", Path(success), Path("/var/data/error"), 5, 0)
+    execute(Path(outgoing) / "b", Path(success), Path("/var/data/error"), 5, 0)
+
+    assert run.call_count == 1
+    assert os.listdir(outgoing) == []
+    for name in ["a", "b"]:
+        assert (Path(success) / name / "one.dcm").exists()
+        assert not (Path(success) / name / mercure_names.SENT).exists()
+
+
+def test_execute_retries_files_counted_as_failed_in_summary(fs, mocker):
+    """ The report does not list the individual files, but its summary counts a failed file.
+    Thus, the folder is retried. """
+    outgoing = "/var/data/outgoing"
+    fs.create_dir("/var/data/success")
+    fs.create_file(f"{outgoing}/a/one.dcm")
+    target = { "dispatch": {"target_name": "pacs", "target_ip": "1.2.3.4", "target_aet_target": "a", "target_port": 90 } }
+    fs.create_file(f"{outgoing}/a/"+mercure_names.TASKFILE, contents=json.dumps(target))
+
+    def dcmsend(command, check):
+        with open(command[command.index("+crf")+1], "w") as f:
+            f.write("Status Summary\n--------------\nNumber of SOP instances  : 1\n- not sent to the peer   : 1\n")
+
+    mocker.patch("dispatch.send.run", side_effect=dcmsend)
+    execute(Path(outgoing) / "a", Path("/var/data/success"), Path("/var/data/error"), 5, 1)
+
+    assert (Path(outgoing) / "a" / "one.dcm").exists()
+    with open(f"{outgoing}/a/"+mercure_names.TASKFILE, "r") as f:
+        assert json.load(f)["dispatch"]["retries"] == 1
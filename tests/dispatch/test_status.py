@@ -1,7 +1,8 @@
 import json
+from pathlib import Path
 
 from dispatch.status import (has_been_send, is_ready_for_sending,
-                           is_target_json_valid)
+                           is_target_json_valid, get_target_key)
 from common.constants import mercure_names
 
 pytest_plugins = ("pyfakefs",)
@@ -33,6 +34,17 @@ def test_is_read_for_sending(fs):
     assert is_ready_for_sending("/var/data")
 
 
+def test_is_read_for_sending_uses_manifest(fs, mocker):
+    fs.create_dir("/var/data/")
+    fs.create_file("/var/data/a.dcm")
+    target = { "dispatch": {"target_ip": "0.0.0.0", "target_port": 104, "target_aet_target": "ANY" },
+               "files": { "count": 1, "size": 0, "names": ["a.dcm"] } }
+    fs.create_file("/var/data/task.json", contents=json.dumps(target))
+    glob = mocker.spy(Path, "glob")
+    assert is_ready_for_sending("/var/data")["file_count"] == 1
+    assert not glob.called
+
+
 def test_has_been_send(fs):
     fs.create_dir("/var/data/")
     fs.create_file("/var/data/"+mercure_names.SENDLOG)
@@ -59,3 +71,8 @@ def test_read_target_with_missing_key(fs):
     fs.create_file("/var/data/"+mercure_names.TASKFILE, contents=json.dumps(target))
     read_target = is_target_json_valid("/var/data/")
     assert not read_target
+
+
+def test_get_target_key():
+    assert get_target_key({ "target_name": "pacs", "target_ip": "1.2.3.4" }) == "pacs"
+    assert get_target_key({ "target_ip": "1.2.3.4", "target_port": 104 }) == "1.2.3.4:104"
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from pynetdicom import AE, evt, AllStoragePresentationContexts
+
+from dispatch.process_dcmsend_result import FILE_SUCCESS, parse_report
+from dispatch.store_scu import StoreSCUSender
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+
+
+def _create_file(path):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = CT_IMAGE_STORAGE
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = CT_IMAGE_STORAGE
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.PatientName = "Test"
+    ds.save_as(str(path), enforce_file_format=True)
+
+
+@pytest.fixture
+def scp():
+    received = []
+    associations = []
+    def handle_store(event):
+        received.append(event.request.AffectedSOPInstanceUID)
+        return 0x0000
+    def handle_requested(event):
+        associations.append(event.assoc)
+    ae = AE(ae_title="PACS")
+    ae.supported_contexts = AllStoragePresentationContexts
+    server = ae.start_server(("127.0.0.1", 0), block=False,
+                             evt_handlers=[(evt.EVT_C_STORE, handle_store), (evt.EVT_REQUESTED, handle_requested)])
+    yield server.server_address[1], received, associations
+    server.shutdown()
+
+
+def test_store_scu_sends_files_and_reuses_association(scp, tmp_path):
+    port, received, associations = scp
+    target_info = { "target_ip": "127.0.0.1", "target_port": port, "target_aet_target": "PACS", "target_aet_source": "mercure" }
+    sender = StoreSCUSender()
+
+    for name in ["a", "b"]:
+        os.mkdir(tmp_path / name)
+        for i in range(3):
+            _create_file(tmp_path / name / f"{i}.dcm")
+
+    result = sender.send(target_info, [tmp_path / "a"], tmp_path / "report_a.txt")
+    assert result.error_code is None
+    assert set(result.file_status.values()) == { FILE_SUCCESS }
+    report = parse_report(tmp_path / "report_a.txt")
+    assert report.file_status == result.file_status
+    assert report.summary["successfull"] == 3
+
+    result = sender.send(target_info, [tmp_path / "b"], tmp_path / "report_b.txt")
+    assert result.error_code is None
+    sender.close()
+
+    assert len(received) == 6
+    assert len(associations) == 1
+
+
+def test_store_scu_reports_unreachable_target(tmp_path):
+    os.mkdir(tmp_path / "a")
+    _create_file(tmp_path / "a" / "0.dcm")
+    target_info = { "target_ip": "127.0.0.1", "target_port": 1, "target_aet_target": "PACS", "target_aet_source": "mercure" }
+
+    result = StoreSCUSender().send(target_info, [tmp_path / "a"], tmp_path / "report.txt")
+    assert result.error_code == 61
@@ -0,0 +1,24 @@
+from dispatch.throttle import TargetThrottle
+
+
+def test_bandwidth_limit_delays_bulk_but_not_urgent_transfers():
+    throttle = TargetThrottle()
+    limits = { "bandwidth_limit": 2 }
+    # 10 MB at 2 MB/s occupy the target for 5 sec
+    assert throttle.acquire("pacs", limits, 10000000, now=100)
+    assert not throttle.acquire("pacs", limits, 1000, now=104)
+    assert throttle.acquire("pacs", limits, 2000000, urgent=True, now=104)
+    # The urgent transfer is counted for the following transfers
+    assert not throttle.acquire("pacs", limits, 1000, now=105.5)
+    assert throttle.acquire("pacs", limits, 1000, now=106)
+    assert throttle.acquire("other", limits, 1000, now=104)
+    assert throttle.acquire("pacs", {}, 1000, now=104)
+
+
+def test_association_limit_per_minute():
+    throttle = TargetThrottle()
+    limits = { "association_limit": 2 }
+    assert throttle.acquire("pacs", limits, 0, now=0)
+    assert throttle.acquire("pacs", limits, 0, now=10)
+    assert not throttle.acquire("pacs", limits, 0, urgent=True, now=59)
+    assert throttle.acquire("pacs", limits, 0, now=60)
@@ -0,0 +1,56 @@
+import docker
+
+import process.images as images
+from process.images import ImageManager, split_tag, IMAGE_READY, IMAGE_MISSING
+
+
+class FakeRegistry:
+    """Stand-in for the local image store and a registry that provides the given images."""
+    def __init__(self, available):
+        self.available = available
+        self.local = {}
+        self.pulls = []
+
+    def get(self, docker_tag):
+        if docker_tag not in self.local:
+            raise docker.errors.ImageNotFound(docker_tag)
+        return self.local[docker_tag]
+
+    def pull(self, repository, tag):
+        self.pulls.append((repository, tag))
+        docker_tag = f"{repository}:{tag}"
+        if docker_tag not in self.available:
+            raise docker.errors.NotFound(f"{docker_tag} not found")
+        image = type("Image", (), { "id": "sha256:1", "attrs": { "RepoDigests": [self.available[docker_tag]] } })
+        self.local[docker_tag] = image
+        return image
+
+
+def test_prepare_pulls_missing_image_and_tracks_digest(tmp_path, mocker):
+    registry = FakeRegistry({ "localhost:5000/anonymizer:1": "localhost:5000/anonymizer@sha256:abc" })
+    client = mocker.Mock()
+    client.images = registry
+    mocker.patch.object(images, "get_docker_client", return_value=client)
+    mocker.patch("process.images.monitor.send_event")
+    manager = ImageManager(str(tmp_path / "module_images.json"))
+
+    assert not manager.is_ready("localhost:5000/anonymizer:1")
+    assert manager.prepare("localhost:5000/anonymizer:1")
+    assert manager.prepare("localhost:5000/anonymizer:1")
+    assert registry.pulls == [("localhost:5000/anonymizer", "1")]
+    status = manager.get_status()["localhost:5000/anonymizer:1"]
+    assert status["status"] == IMAGE_READY
+    assert status["digest"] == "localhost:5000/anonymizer@sha256:abc"
+    assert manager.is_ready("localhost:5000/anonymizer:1")
+
+    assert not manager.prepare("localhost:5000/missing:2")
+    assert manager.get_status()["localhost:5000/missing:2"]["status"] == IMAGE_MISSING
+    # Jobs of missing images are not held back, so that they are moved to the error folder
+    assert manager.is_ready("localhost:5000/missing:2")
+
+
+def test_split_tag():
+    assert split_tag("module:1.0") == ("module", "1.0")
+    assert split_tag("module") == ("module", "latest")
+    assert split_tag("localhost:5000/module") == ("localhost:5000/module", "latest")
+    assert split_tag("localhost:5000/module:2") == ("localhost:5000/module", "2")
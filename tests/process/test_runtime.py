@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+
+import docker
+import pytest
+
+import process.runtime as runtime
+from process.runtime import ModuleRuntime, JOBS_FOLDER
+
+
+class FakeContainer:
+    """Simulates a warm module container that completes the jobs placed into its jobs folder."""
+    def __init__(self, jobs_folder):
+        self.status = "running"
+        self.jobs = []
+        self.reloads = 0
+        self.thread = threading.Thread(target=self.watch, args=(jobs_folder,), daemon=True)
+        self.thread.start()
+
+    def watch(self, jobs_folder):
+        while self.status == "running":
+            for name in os.listdir(jobs_folder) if os.path.exists(jobs_folder) else []:
+                if name.endswith(".job"):
+                    with open(os.path.join(jobs_folder, name)) as f:
+                        dicom_path = json.load(f)["dicom_path"]
+                    # The series folder needs to be accessible via the mounted jobs folder
+                    assert os.path.isdir(os.path.join(jobs_folder, os.path.relpath(dicom_path, "/jobs")))
+                    self.jobs.append(dicom_path)
+                    os.remove(os.path.join(jobs_folder, name))
+                    with open(os.path.join(jobs_folder, name[:-4] + ".done"), "w") as f:
+                        f.write("0")
+            time.sleep(0.005)
+
+    def reload(self):
+        self.reloads += 1
+
+    def stop(self):
+        self.status = "exited"
+
+    def remove(self):
+        pass
+
+
+def test_warm_container_is_reused_for_jobs(tmp_path, mocker):
+    processing = tmp_path / "processing"
+    containers = []
+    def run(image, command, **kwargs):
+        assert kwargs["detach"]
+        assert command == "--watch-jobs /jobs"
+        assert kwargs["labels"]["mercure.warm"] == "anonymizer"
+        assert kwargs["labels"]["mercure.owner"].startswith(f"{os.getpid()}_")
+        jobs_folder, = [folder for folder, mount in kwargs["volumes"].items() if mount["bind"] == "/jobs"]
+        assert jobs_folder.startswith(str(processing / JOBS_FOLDER / "anonymizer"))
+        containers.append(FakeContainer(jobs_folder))
+        return containers[-1]
+    client = mocker.Mock()
+    client.containers.run.side_effect = run
+    mocker.patch.object(runtime, "docker_client", client)
+
+    module_runtime = ModuleRuntime()
+    module_config = { "docker_tag": "anonymizer:1", "warm_instances": 1 }
+    metrics = {}
+    for name in ["a", "b"]:
+        os.makedirs(processing / name)
+        module_runtime.run("anonymizer", module_config, str(processing / name), str(processing), {}, metrics)
+    module_runtime.close()
+
+    assert set(metrics) == { "wall_time" }
+    assert len(containers) == 1
+    assert containers[0].jobs == ["/jobs/a", "/jobs/b"]
+    assert containers[0].status == "exited"
+    # The container is only checked when it is reused, not while waiting for the jobs
+    assert containers[0].reloads == 1
+    assert (processing / "a").is_dir() and (processing / "b").is_dir()
+    assert os.listdir(processing / JOBS_FOLDER / "anonymizer") == []
+
+
+def test_series_left_in_jobs_folder_are_recovered(tmp_path, mocker):
+    processing = tmp_path / "processing"
+    os.makedirs(processing / JOBS_FOLDER / "anonymizer" / "instance" / "a")
+    (processing / JOBS_FOLDER / "anonymizer" / "instance" / "1.job").write_text("{}")
+    # Folder of a terminated processor that had the same process ID
+    os.makedirs(processing / JOBS_FOLDER / "anonymizer" / f"{os.getpid()}_x" / "b")
+    # Folder of another running processor instance
+    os.makedirs(processing / JOBS_FOLDER / "anonymizer" / f"{os.getppid()}_y" / "c")
+    orphaned, running = mocker.Mock(), mocker.Mock()
+    orphaned.labels = { "mercure.warm": "anonymizer", "mercure.owner": f"{os.getpid()}_x" }
+    running.labels = { "mercure.warm": "anonymizer", "mercure.owner": f"{os.getppid()}_y" }
+    client = mocker.Mock()
+    client.containers.list.return_value = [orphaned, running]
+    mocker.patch.object(runtime, "docker_client", client)
+
+    runtime.recover_jobs(str(processing))
+
+    client.containers.list.assert_called_once_with(all=True, filters={ "label": "mercure.warm" })
+    orphaned.remove.assert_called_once_with(force=True)
+    running.remove.assert_not_called()
+    assert (processing / "a").is_dir() and (processing / "b").is_dir()
+    assert os.listdir(processing / JOBS_FOLDER / "anonymizer") == [f"{os.getppid()}_y"]
+
+
+def test_jobs_are_recovered_if_docker_is_unavailable(tmp_path, mocker):
+    processing = tmp_path / "processing"
+    os.makedirs(processing / JOBS_FOLDER / "anonymizer" / "instance" / "a")
+    client = mocker.Mock()
+    client.containers.list.side_effect = docker.errors.APIError("unavailable")
+    mocker.patch.object(runtime, "docker_client", client)
+
+    runtime.recover_jobs(str(processing))
+
+    assert (processing / "a").is_dir()
+
+
+def test_cold_container_is_used_without_warm_instances(mocker):
+    client = mocker.Mock()
+    container = client.containers.run.return_value
+    container.wait.return_value = { "StatusCode": 0 }
+    container.stats.return_value = iter([
+        { "memory_stats": { "usage": 1000, "max_usage": 5000 }, "cpu_stats": { "cpu_usage": { "total_usage": 1500000000 } },
+          "blkio_stats": { "io_service_bytes_recursive": [{ "op": "Read", "value": 300 }, { "op": "Write", "value": 200 }] } },
+        # Entry of the exited container
+        { "memory_stats": {}, "cpu_stats": {}, "blkio_stats": { "io_service_bytes_recursive": None } }
+    ])
+    mocker.patch.object(runtime, "docker_client", client)
+
+    metrics = {}
+    ModuleRuntime().run("converter", { "docker_tag": "converter:1" }, "/processing/a", "/processing", {}, metrics)
+
+    client.containers.run.assert_called_once_with("converter:1", "--dicom-path /data",
+                                                  volumes={"/processing/a": {"bind": "/data", "mode": "rw"}}, detach=True)
+    assert metrics["wall_time"] >= 0
+    assert metrics["peak_memory"] == 5000
+    assert metrics["cpu_time"] == 1.5
+    assert (metrics["read_bytes"], metrics["write_bytes"]) == (300, 200)
+
+
+def test_failed_cold_container_raises_with_metrics(mocker):
+    client = mocker.Mock()
+    container = client.containers.run.return_value
+    container.wait.return_value = { "StatusCode": 1 }
+    container.stats.return_value = iter([])
+    mocker.patch.object(runtime, "docker_client", client)
+
+    metrics = {}
+    with pytest.raises(docker.errors.ContainerError):
+        ModuleRuntime().run("converter", { "docker_tag": "converter:1" }, "/processing/a", "/processing", {}, metrics)
+    assert "wall_time" in metrics
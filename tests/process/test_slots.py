@@ -0,0 +1,28 @@
+import threading
+
+from process.slots import ProcessingSlots
+
+
+def test_slots_limit_jobs_per_module():
+    slots = ProcessingSlots(3)
+    release = threading.Event()
+    processed = []
+
+    def process(folder):
+        release.wait(5)
+        processed.append(folder)
+
+    assert slots.submit("/processing/a", "ai", 1, process, "/processing/a")
+    assert not slots.submit("/processing/b", "ai", 1, process, "/processing/b")
+    assert not slots.submit("/processing/a", "anonymizer", 0, process, "/processing/a")
+    assert slots.submit("/processing/c", "anonymizer", 0, process, "/processing/c")
+    assert slots.submit("/processing/d", "anonymizer", 0, process, "/processing/d")
+    assert slots.is_full()
+    assert not slots.submit("/processing/e", "converter", 0, process, "/processing/e")
+    assert slots.is_active("/processing/a")
+
+    release.set()
+    slots.shutdown()
+    assert sorted(processed) == ["/processing/a", "/processing/c", "/processing/d"]
+    assert not slots.is_active("/processing/a")
+    assert not slots.is_full()
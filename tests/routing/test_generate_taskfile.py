@@ -0,0 +1,10 @@
+from routing.generate_taskfile import add_files
+
+
+def test_add_files_creates_manifest(fs):
+    fs.create_file("/var/incoming/1.2#CT.1.2.3.dcm", contents="abcd")
+    fs.create_file("/var/incoming/1.2#CT.1.2.4.dcm", contents="ef")
+
+    manifest = add_files(["1.2#CT.1.2.3", "1.2#CT.1.2.4"], "/var/incoming/")
+
+    assert manifest == { "files": { "count": 2, "size": 6, "names": ["1.2#CT.1.2.3.dcm", "1.2#CT.1.2.4.dcm"] } }
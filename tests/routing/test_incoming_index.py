@@ -0,0 +1,89 @@
+import os
+import time
+
+from routing.incoming_index import IncomingIndex, IncomingWatcher
+from common.constants import mercure_names
+
+
+def _receive_file(folder, name):
+    with open(os.path.join(folder, name + mercure_names.DCM), "w") as f:
+        f.write("")
+    with open(os.path.join(folder, name + mercure_names.TAGS), "w") as f:
+        f.write("{}")
+
+
+def test_rescan_groups_files_by_series(fs):
+    fs.create_dir("/var/incoming")
+    for name in ["1.2.3#a", "1.2.3#b", "4.5.6#a"]:
+        fs.create_file("/var/incoming/" + name + mercure_names.DCM)
+        fs.create_file("/var/incoming/" + name + mercure_names.TAGS)
+
+    index = IncomingIndex("/var/incoming")
+    index.rescan()
+
+    assert index.series["1.2.3"]["files"] == {"1.2.3#a", "1.2.3#b"}
+    assert index.series["4.5.6"]["files"] == {"4.5.6#a"}
+    assert index.get_filecount() == 3
+    assert not index.error_files_found
+
+
+def test_rescan_detects_error_files(fs):
+    fs.create_dir("/var/incoming")
+    fs.create_file("/var/incoming/broken" + mercure_names.ERROR)
+
+    index = IncomingIndex("/var/incoming")
+    index.rescan()
+
+    assert index.error_files_found
+
+
+def test_complete_series():
+    index = IncomingIndex("/var/incoming")
+    index.add_file("1.2.3#a" + mercure_names.TAGS, time.time() - 120)
+    index.add_file("4.5.6#a" + mercure_names.TAGS, time.time())
+
+    assert list(index.get_complete_series(60)) == ["1.2.3"]
+    assert index.get_next_completion(60) < time.time()
+
+    index.remove_file("1.2.3#a" + mercure_names.TAGS)
+    assert "1.2.3" not in index.series
+
+
+def test_watcher_follows_file_events(tmp_path):
+    folder = str(tmp_path)
+    _receive_file(folder, "1.2.3#a")
+    watcher = IncomingWatcher(folder)
+    try:
+        assert watcher.series["1.2.3"]["files"] == {"1.2.3#a"}
+
+        _receive_file(folder, "1.2.3#b")
+        _receive_file(folder, "4.5.6#a")
+        watcher.wait(1)
+        assert watcher.series["1.2.3"]["files"] == {"1.2.3#a", "1.2.3#b"}
+        assert watcher.series["4.5.6"]["files"] == {"4.5.6#a"}
+
+        os.remove(os.path.join(folder, "4.5.6#a" + mercure_names.TAGS))
+        watcher.wait(1)
+        assert "4.5.6" not in watcher.series
+    finally:
+        watcher.close()
+
+
+def test_series_remaining_after_routing_is_retried(fs):
+    fs.create_dir("/var/incoming")
+    index = IncomingIndex("/var/incoming")
+    for series_uid in ["1.2.3", "4.5.6"]:
+        fs.create_file(f"/var/incoming/{series_uid}#a" + mercure_names.TAGS)
+        index.add_file(f"{series_uid}#a" + mercure_names.TAGS, time.time() - 120)
+    # The first series has been routed, the second one was locked
+    os.remove("/var/incoming/1.2.3#a" + mercure_names.TAGS)
+
+    now = time.time()
+    for series_uid in ["1.2.3", "4.5.6"]:
+        index.finish_series(series_uid, now + 10)
+
+    assert list(index.series) == ["4.5.6"]
+    assert index.get_complete_series(60) == {}
+    assert index.get_next_completion(60) == now + 10
+    index.series["4.5.6"]["retry_at"] = now - 1
+    assert list(index.get_complete_series(60)) == ["4.5.6"]
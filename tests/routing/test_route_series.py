@@ -0,0 +1,20 @@
+import common.config as config
+from routing.route_series import get_triggered_rules
+
+
+def test_triggered_rules_keep_order_and_discard(mocker):
+    rules = {
+        "route_ct": { "rule": "@Modality@ == 'CT'", "action": "route", "target": "a" },
+        "route_all": { "rule": "True", "action": "route", "target": "b" },
+        "discard_station": { "rule": "@StationName@ == 'TEST'", "action": "discard" },
+        "route_late": { "rule": "@Modality@ == 'CT'", "action": "route", "target": "c" },
+    }
+    mocker.patch.dict(config.mercure, { "rules": rules })
+
+    triggered, discard = get_triggered_rules({ "Modality": "CT", "StationName": "TEST" })
+    assert list(triggered) == ["route_ct", "route_all", "discard_station"]
+    assert discard == "discard_station"
+
+    triggered, discard = get_triggered_rules({ "Modality": "MR", "StationName": "CT1" })
+    assert list(triggered) == ["route_all"]
+    assert discard == ""
@@ -2,8 +2,148 @@
 test_bookkeeper.py
 ==================
 """
+import asyncio
+import datetime
+
+import databases
+import sqlalchemy
+
 import bookkeeper as b
 
+def _run(coroutine):
+    # asyncio.run is not available in Python 3.6
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
 def test_bookkeeper_no_syntax_errors():
     """ Checks if bookkeeper.py can be started. """
     assert b
+
+
+def test_write_buffer_inserts_rows_and_skips_duplicates(mocker, tmp_path):
+    """ Checks that buffered rows are written with multi-row inserts and that duplicate
+    series do not discard the other rows of the same statement. """
+    database_url = f"sqlite:///{tmp_path / 'bookkeeper.db'}"
+    engine = sqlalchemy.create_engine(database_url)
+    b.metadata.create_all(engine)
+    database = databases.Database(database_url)
+    mocker.patch.object(b, "database", database)
+
+    buffer = b.WriteBuffer(b.dicom_series, unique=True)
+    buffer.add([b.dicom_series_row({ "SeriesInstanceUID": uid }) for uid in ["1", "2", "1", "3"]])
+
+    async def flush():
+        await database.connect()
+        await buffer.flush()
+        await database.disconnect()
+    _run(flush())
+
+    with engine.connect() as connection:
+        rows = connection.execute(b.dicom_series.select()).fetchall()
+    assert sorted(row.series_uid for row in rows) == ["1", "2", "3"]
+    assert not buffer.rows
+
+
+def test_write_buffer_keeps_valid_rows_if_a_row_fails(mocker, tmp_path):
+    """ Checks that an invalid row does not discard the other rows of the statement. """
+    database_url = f"sqlite:///{tmp_path / 'bookkeeper.db'}"
+    engine = sqlalchemy.create_engine(database_url)
+    b.metadata.create_all(engine)
+    database = databases.Database(database_url)
+    mocker.patch.object(b, "database", database)
+
+    buffer = b.WriteBuffer(b.series_events)
+    buffer.add([b.series_event_row({ "series_uid": uid }) for uid in ["1", "2"]])
+    buffer.add([dict(b.series_event_row({ "series_uid": "3" }), time="invalid")])
+
+    async def flush():
+        await database.connect()
+        await buffer.flush()
+        await database.disconnect()
+    _run(flush())
+
+    with engine.connect() as connection:
+        rows = connection.execute(b.series_events.select()).fetchall()
+    assert sorted(row.series_uid for row in rows) == ["1", "2"]
+
+
+def test_write_buffer_creates_partitions_for_old_rows(mocker):
+    """ Checks that the partitions are created for replayed rows outside of the regular partitions. """
+    class FakeDatabase:
+        def __init__(self):
+            self.queries = []
+        async def execute(self, query):
+            self.queries.append(str(query))
+    database = FakeDatabase()
+    mocker.patch.object(b, "database", database)
+    mocker.patch.object(b, "DATABASE_PARTITIONING", True)
+    mocker.patch.object(b, "partitions_created", set())
+
+    buffer = b.WriteBuffer(b.series_events)
+    for month in [1, 1, 2]:
+        buffer.add([dict(b.series_event_row({ "series_uid": "1" }), time=datetime.datetime(2020, month, 15))])
+    _run(buffer.flush())
+
+    partitions = [query for query in database.queries if query.startswith("CREATE TABLE")]
+    assert len(partitions) == 2
+    assert sorted(query.split()[5] for query in partitions) == ['"series_events_2020_01"', '"series_events_2020_02"']
+    assert database.queries[-1].startswith("INSERT")
+
+
+def test_maintain_tables_removes_rows_after_retention_period(mocker, tmp_path):
+    """ Checks that event rows older than the retention period are removed, while newer rows
+    and the series information are kept. """
+    database_url = f"sqlite:///{tmp_path / 'bookkeeper.db'}"
+    mocker.patch.object(b, "DATABASE_URL", database_url)
+    mocker.patch.object(b, "RETENTION_DAYS", 30)
+    b.create_database()
+    database = databases.Database(database_url)
+    mocker.patch.object(b, "database", database)
+
+    now = datetime.datetime.now()
+    async def maintain():
+        await database.connect()
+        for days in [1, 29, 31, 400]:
+            await database.execute(b.series_events.insert().values(time=now - datetime.timedelta(days=days), series_uid=str(days)))
+        await database.execute(b.dicom_series.insert().values(time=now - datetime.timedelta(days=400), series_uid="400"))
+        await b.maintain_tables()
+        events = await database.fetch_all(b.series_events.select())
+        series = await database.fetch_all(b.dicom_series.select())
+        await database.disconnect()
+        return events, series
+    events, series = _run(maintain())
+
+    assert sorted(row["series_uid"] for row in events) == ["1", "29"]
+    assert len(series) == 1
+
+
+def test_month_start():
+    assert b.month_start(datetime.datetime(2020, 12, 15, 10, 30), 1) == datetime.datetime(2021, 1, 1)
+    assert b.month_start(datetime.datetime(2020, 1, 31), -1) == datetime.datetime(2019, 12, 1)
+    assert b.month_start(datetime.datetime(2020, 5, 2)) == datetime.datetime(2020, 5, 1)
+
+
+def test_processing_job_row_accepts_missing_statistics():
+    """ Checks that form and JSON payloads are converted and that statistics not available
+    for warm containers are stored as NULL. """
+    row = b.processing_job_row({ "series_uid": "1", "module": "test", "success": "True", "wall_time": "2.5",
+                                 "peak_memory": "1000" })
+    assert (row["success"], row["wall_time"], row["peak_memory"], row["cpu_time"]) == (True, 2.5, 1000, None)
+    assert b.processing_job_row({ "success": False, "wall_time": 1 })["success"] is False
+
+
+def test_rows_use_the_time_of_the_event():
+    """ Checks that events replayed from the journal keep the time of their occurrence, while
+    events without time are stored with the time of arrival. """
+    event_time = datetime.datetime(2021, 3, 1, 12, 0)
+    row = b.series_event_row({ "series_uid": "1", "event_time": event_time.timestamp() })
+    assert row["time"] == event_time
+    assert (datetime.datetime.now() - b.series_event_row({ "series_uid": "1" })["time"]).total_seconds() < 60
+
+
+def test_invalid_events_are_rejected():
+    """ Checks that events with invalid values are rejected with a client error, so that the
+    sender drops them instead of retrying. """
+    response = b.store_rows(b.series_events, b.series_event_row, [{ "series_uid": "1", "file_count": "many" }])
+    assert response.status_code == 400
+    assert not b.buffers[b.series_events.name].rows
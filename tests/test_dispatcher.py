@@ -3,7 +3,27 @@ test_dispatcher.py
 ==================
 """
 import dispatcher as d
+from dispatch.health import TargetHealth
 
 def test_dispatcher_no_syntax_errors():
     """ Checks if dispatcher.py can be started. """
     assert d
+
+
+def test_probe_is_released_after_transfer_with_other_error(mocker):
+    """ Checks that a probe ending with an error that does not indicate a connection problem
+    does not block the target until the probe timeout. """
+    mocker.patch("dispatch.health.send_event")
+    mocker.patch.dict(d.config.mercure, { "targets": {}, "dispatcher_sender": "dcmsend" })
+    health = TargetHealth()
+    mocker.patch.object(d, "target_health", health)
+    for _ in range(health.FAILURE_THRESHOLD):
+        health.record_failure("pacs", 61, now=0)
+    assert health.allow("pacs")
+
+    mocker.patch.object(d, "execute_batch", side_effect=lambda *args: health.record_failure("pacs", 65))
+    folder = mocker.Mock()
+    folder.exists.return_value = False
+    d.send_batch([(folder, { "target_name": "pacs" })], None, None, 5, 1)
+
+    assert health.allow("pacs")
@@ -0,0 +1,27 @@
+"""
+test_processor.py
+=================
+"""
+import json
+import os
+
+import common.config as config
+import processor
+
+
+def test_processor_orders_tasks_by_priority_and_age(fs, mocker):
+    rules = { "urgent_rule": { "priority": "urgent" }, "normal_rule": { "priority": "normal" } }
+    mocker.patch.dict(config.mercure, { "rules": rules, "processor_aging_time": 3600,
+                                        "offpeak_start": "22:00", "offpeak_end": "06:00" })
+    for name, rule, mtime in [("b", "normal_rule", 1000), ("a", "normal_rule", 2000), ("c", "urgent_rule", 3000)]:
+        task = { "info": { "applied_rule": rule, "module": "test" }, "files": { "count": 1 } }
+        fs.create_file(f"/processing/{name}/task.json", contents=json.dumps(task))
+        os.utime(f"/processing/{name}", (mtime, mtime))
+    fs.create_file("/processing/d/task.json", contents=json.dumps({ "files": { "count": 1 } }))
+    fs.create_file("/processing/d/.lock")
+
+    known_folders, queue = processor.get_ready_tasks("/processing")
+
+    assert known_folders == { "a", "b", "c", "d" }
+    assert [folder for folder, _ in queue] == ["/processing/c", "/processing/b", "/processing/a"]
+    assert queue[0][1]["module"] == "test"
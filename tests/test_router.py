@@ -2,8 +2,49 @@
 test_router.py
 ==============
 """
+import os
+import time
+
 import router as r
 
 def test_router_no_syntax_errors():
     """ Checks if router.py can be started. """
     assert r
+
+
+def test_run_router_collects_series_files(fs, mocker):
+    """ Checks that the files of complete series are handed over to route_series
+    from the single scan of the incoming folder. """
+    incoming = "/var/incoming"
+    fs.create_dir(incoming)
+    for name in ["1.2.3#a", "1.2.3#b", "4.5.6#a"]:
+        fs.create_file(incoming + "/" + name + ".dcm")
+        fs.create_file(incoming + "/" + name + ".tags")
+    old_time = time.time() - 120
+    for name in ["1.2.3#a", "1.2.3#b"]:
+        os.utime(incoming + "/" + name + ".tags", (old_time, old_time))
+
+    mocker.patch("router.config.read_config")
+    mocker.patch.dict(r.config.mercure, { "incoming_folder": incoming, "series_complete_trigger": 60 })
+    mock_route = mocker.patch("router.route_series")
+    mocker.patch("router.route_error_files")
+    mocker.patch("router.route_studies")
+
+    r.run_router({})
+
+    mock_route.assert_called_once()
+    assert mock_route.call_args[0][0] == "1.2.3"
+    assert sorted(mock_route.call_args[0][1]) == ["1.2.3#a", "1.2.3#b"]
+
+
+def test_run_router_waits_if_configuration_cannot_be_read(mocker):
+    """ Checks that the router does not spin in watcher mode while the configuration is locked. """
+    mocker.patch("router.config.read_config", side_effect=Exception("locked"))
+    mocker.patch("router.monitor.send_event")
+    mocker.patch.dict(r.config.mercure, { "router_scan_interval": 1 })
+    watcher = mocker.Mock()
+    mocker.patch.object(r, "incoming_watcher", watcher)
+
+    r.run_router({})
+
+    watcher.wait.assert_called_once_with(1)
@@ -456,6 +456,12 @@ async def target_edit_post(request):
     config.mercure["targets"][edittarget]["aet_target"]=form["aet_target"]
     config.mercure["targets"][edittarget]["aet_source"]=form["aet_source"]
     config.mercure["targets"][edittarget]["contact"]=form["contact"]
+    # Optional transfer limits, which are removed if the fields are left empty
+    for limit, limit_type in [("bandwidth_limit", float), ("association_limit", int)]:
+        if form.get(limit):
+            config.mercure["targets"][edittarget][limit]=limit_type(form[limit])
+        else:
+            config.mercure["targets"][edittarget].pop(limit, None)
 
     try: 
         config.save_config()
@@ -953,7 +959,7 @@ if __name__ == "__main__":
         logger.info("Going down.")
         sys.exit(1)
 
-    monitor.configure('webgui','main',config.mercure['bookkeeper'])
+    monitor.configure('webgui','main',config.mercure['bookkeeper'],config.mercure['bookkeeper_journal_folder'])
     monitor.send_event(monitor.h_events.BOOT,monitor.severity.INFO,f'PID = {os.getpid()}')    
 
     try:
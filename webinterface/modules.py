@@ -14,6 +14,7 @@ from starlette.middleware.sessions import SessionMiddleware
 from starlette.config import Config
 from starlette.datastructures import URL, Secret
 from starlette.routing import Route, Router
+from starlette.background import BackgroundTask
 
 import common.helper as helper
 import common.config as config
@@ -21,6 +22,7 @@ import common.monitor as monitor
 from common.constants import mercure_defs
 from webinterface.common import get_user_information
 from webinterface.common import templates
+from process.images import image_manager
 
 modules_app = Starlette()
 
@@ -44,7 +46,7 @@ async def show_modules(request):
 
     template = "modules.html"
     context = {"request": request, "mercure_version": mercure_defs.VERSION, "page": "modules", 
-               "modules": config.mercure["modules"], "used_modules": used_modules}
+               "modules": config.mercure["modules"], "used_modules": used_modules, "images": image_manager.get_status()}
     context.update(get_user_information(request))
     return templates.TemplateResponse(template, context)
 
@@ -73,7 +75,9 @@ async def add_module(request):
         return PlainTextResponse('ERROR: Unable to write configuration. Try again.')
     # logger.info(f'Created rule {newrule}')
     # monitor.send_webgui_event(monitor.w_events.RULE_CREATE, request.user.display_name, newrule)    
-    return RedirectResponse(url='/modules/', status_code=303)  
+    # The image of the module is pulled in the background, so that it is available before series arrive
+    return RedirectResponse(url='/modules/', status_code=303, 
+                            background=BackgroundTask(image_manager.prepare, config.mercure["modules"].get(name, {}).get("docker_tag")))
     
 
 
@@ -107,17 +111,22 @@ async def edit_module(request):
     
     name= request.path_params["module"]
     if name in config.mercure["modules"]:        
-        config.mercure["modules"][name] = { 
+        # Other settings of the module (e.g., set directly in the configuration file) are kept
+        config.mercure["modules"][name].update({ 
             "url": form.get("url",""),
-            "docker_tag": form.get("docker_tag",None)
-        }
+            "docker_tag": form.get("docker_tag",None),
+            "max_parallel": int(form.get("max_parallel") or 0),
+            "warm_instances": int(form.get("warm_instances") or 0)
+        })
     try: 
         config.save_config()
     except:
         return PlainTextResponse('ERROR: Unable to write configuration. Try again.')
     # logger.info(f'Created rule {newrule}')
     # monitor.send_webgui_event(monitor.w_events.RULE_CREATE, request.user.display_name, newrule)    
-    return RedirectResponse(url='/modules/', status_code=303)  
+    # The image of the module is pulled in the background, so that it is available before series arrive
+    return RedirectResponse(url='/modules/', status_code=303, 
+                            background=BackgroundTask(image_manager.prepare, config.mercure["modules"].get(name, {}).get("docker_tag")))
 
 @modules_app.route('/delete/{module}', methods=["POST"])
 @requires(['authenticated','admin'], redirect='login')